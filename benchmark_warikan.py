@@ -0,0 +1,234 @@
+# ==== AI割り勘 最適化エンジン ベンチマーク ====
+# 参加者数・役職分布・丸め単位・カスタム倍率ルール数の組み合わせごとに
+# レイテンシ分位点・収束までの反復数・ピークメモリ・差額を計測し JSON に出力する
+#
+# 使い方:
+#   python benchmark_warikan.py                      # 全組み合わせ
+#   python benchmark_warikan.py --quick              # 小さな組み合わせのみ
+#   python benchmark_warikan.py --compare old.json   # 前回結果との比較
+
+import argparse
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+
+from multiplier_rules import CompiledMultiplierRules
+from warikan_engine import AIWarikanOptimizer, OptimizationTrace, ROLE_NAMES
+
+SIZES = (5, 50, 500, 5_000, 100_000)
+DISTRIBUTIONS = {
+    'uniform': (0.2, 0.2, 0.2, 0.2, 0.2),
+    # 担当が多く上位役職ほど少ない一般的な構成
+    'skewed': (0.6, 0.2, 0.1, 0.07, 0.03),
+}
+MARUME_OPTIONS = (100, 500, 1000)
+RULE_COUNTS = (0, 50, 500)
+METHODS = ('exact', 'genetic')
+
+QUICK_SIZES = (5, 50, 500)
+QUICK_RULE_COUNTS = (0, 50)
+
+
+def make_participants(n: int, distribution: str, rng: np.random.Generator) -> pd.DataFrame:
+    """ベンチマーク用の参加者DataFrame"""
+    roles = rng.choice(ROLE_NAMES, size=n, p=DISTRIBUTIONS[distribution])
+    return pd.DataFrame({
+        '名前': [f"参加者{i:06d}さん" for i in range(n)],
+        '役職': roles,
+    })
+
+
+def make_rules(n_rules: int, n_participants: int, rng: np.random.Generator) -> Dict:
+    """ベンチマーク用のカスタム倍率ルール（一部の参加者にマッチ）"""
+    rules = {}
+    for r in range(n_rules):
+        targets = rng.integers(0, max(n_participants, 1), size=3)
+        rules[f"rule_{r:04d}"] = {
+            'name_patterns': [f"参加者{t:06d}" for t in targets],
+            'multiplier': float(rng.choice([0.0, 0.5, 0.8, 1.2, 1.5])),
+        }
+    return rules
+
+
+def run_case(n: int, distribution: str, marume: int, n_rules: int, method: str,
+             repeat: int, seed: int) -> Dict:
+    """1ケースを計測"""
+    rng = np.random.default_rng(seed)
+    df_participants = make_participants(n, distribution, rng)
+    total_amount = int(n * 4_000 + rng.integers(0, 1_000))
+    rules = CompiledMultiplierRules(make_rules(n_rules, n, rng))
+    optimizer = AIWarikanOptimizer()
+    # 遺伝的アルゴリズムはシード固定で毎回同じ探索を計測
+    options = {'seed': seed} if method == 'genetic' else {}
+
+    latencies = []
+    resolve_latencies = []
+    diff = None
+    trace = OptimizationTrace()
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        admin_multipliers = rules.resolve(df_participants['名前'])
+        resolved = time.perf_counter()
+        _, _, diff, _ = optimizer.optimize_warikan(
+            df_participants, total_amount, marume,
+            method=method,
+            admin_multipliers=admin_multipliers,
+            trace=trace,
+            **options
+        )
+        finished = time.perf_counter()
+
+        resolve_latencies.append((resolved - start) * 1000)
+        latencies.append((finished - start) * 1000)
+
+    # ピークメモリは計測のオーバーヘッドがあるため別に1回だけ実行
+    tracemalloc.start()
+    optimizer.optimize_warikan(
+        df_participants, total_amount, marume, method=method,
+        admin_multipliers=rules.resolve(df_participants['名前']),
+        **options
+    )
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = np.array(latencies)
+    return {
+        'participants': n,
+        'distribution': distribution,
+        'marume': marume,
+        'rules': n_rules,
+        'method': method,
+        'repeat': repeat,
+        'latency_ms': {
+            'p50': float(np.percentile(latencies, 50)),
+            'p90': float(np.percentile(latencies, 90)),
+            'p99': float(np.percentile(latencies, 99)),
+            'mean': float(latencies.mean()),
+            'min': float(latencies.min()),
+        },
+        'resolve_ms_p50': float(np.percentile(resolve_latencies, 50)),
+        'iterations': len(trace.iterations),
+        'stop_reason': trace.stop_reason,
+        'phases_ms': trace.phases,
+        'peak_memory_bytes': int(peak),
+        'diff': int(diff),
+    }
+
+
+def case_key(result: Dict) -> str:
+    return f"{result['method']}/n={result['participants']}/{result['distribution']}/marume={result['marume']}/rules={result['rules']}"
+
+
+def environment_info() -> Dict:
+    """実行環境（結果比較時の参考情報）"""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+    }
+
+
+def compare_results(baseline: Dict, current: Dict, threshold: float = 1.2) -> List[Dict]:
+    """前回結果と比較し、p50 レイテンシが threshold 倍以上に悪化したケースを返す"""
+    baseline_by_key = {case_key(result): result for result in baseline.get('results', [])}
+    regressions = []
+
+    for result in current['results']:
+        before = baseline_by_key.get(case_key(result))
+        if before is None:
+            continue
+        ratio = result['latency_ms']['p50'] / max(before['latency_ms']['p50'], 1e-9)
+        if ratio >= threshold or result['diff'] != before['diff']:
+            regressions.append({
+                'case': case_key(result),
+                'p50_before_ms': before['latency_ms']['p50'],
+                'p50_after_ms': result['latency_ms']['p50'],
+                'ratio': ratio,
+                'diff_before': before['diff'],
+                'diff_after': result['diff'],
+            })
+
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="AIWarikanOptimizer のベンチマーク")
+    parser.add_argument('--output', default='benchmark_results.json', help="結果の出力先（JSON）")
+    parser.add_argument('--repeat', type=int, default=5, help="1ケースあたりの計測回数")
+    parser.add_argument('--seed', type=int, default=20240601, help="データ生成・遺伝的アルゴリズムの乱数シード")
+    parser.add_argument('--quick', action='store_true', help="小規模な組み合わせのみ実行")
+    parser.add_argument('--max-participants', type=int, default=None, help="この人数を超えるケースを除外")
+    parser.add_argument('--methods', nargs='+', default=list(METHODS), choices=METHODS)
+    parser.add_argument('--compare', default=None, help="比較対象の過去の結果ファイル")
+    args = parser.parse_args(argv)
+
+    sizes = QUICK_SIZES if args.quick else SIZES
+    if args.max_participants is not None:
+        sizes = tuple(n for n in sizes if n <= args.max_participants)
+    rule_counts = QUICK_RULE_COUNTS if args.quick else RULE_COUNTS
+
+    results = []
+    for method in args.methods:
+        for n in sizes:
+            for distribution in DISTRIBUTIONS:
+                for marume in MARUME_OPTIONS:
+                    for n_rules in rule_counts:
+                        result = run_case(n, distribution, marume, n_rules, method, args.repeat, args.seed)
+                        results.append(result)
+                        print(
+                            f"{case_key(result):<55} p50={result['latency_ms']['p50']:9.2f}ms "
+                            f"p99={result['latency_ms']['p99']:9.2f}ms iter={result['iterations']:3d} "
+                            f"peak={result['peak_memory_bytes'] / 1024:9.0f}KiB diff={result['diff']:+d}"
+                        )
+
+    report = {
+        'environment': environment_info(),
+        'config': {
+            'repeat': args.repeat,
+            'seed': args.seed,
+            'quick': args.quick,
+            'methods': args.methods,
+        },
+        'results': results,
+    }
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"結果を保存しました: {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_results(baseline, report)
+        if regressions:
+            print(f"⚠️ 悪化したケース: {len(regressions)}件")
+            for regression in regressions:
+                print(
+                    f"  {regression['case']}: {regression['p50_before_ms']:.2f}ms → "
+                    f"{regression['p50_after_ms']:.2f}ms (x{regression['ratio']:.2f}), "
+                    f"diff {regression['diff_before']:+d} → {regression['diff_after']:+d}"
+                )
+        else:
+            print("✅ 悪化したケースはありません")
+
+
+if __name__ == '__main__':
+    main()
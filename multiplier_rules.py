@@ -0,0 +1,640 @@
+# ==== カスタム倍率ルール（Streamlit非依存） ====
+# ルール辞書を一度だけコンパイルし、参加者名 → 倍率の解決に再利用する
+
+import copy
+import itertools
+import json
+import os
+import sqlite3
+import threading
+from collections import deque
+from contextlib import closing
+from datetime import datetime
+from functools import lru_cache
+from types import MappingProxyType
+
+import numpy as np
+from typing import Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+# よくある敬称（この順に末尾から除去）
+HONORIFIC_SUFFIXES = ['さん', 'くん', 'ちゃん', '君', '様', 'サン', 'クン']
+
+# 参加者名の正規化結果を保持する件数（LRU）
+NORMALIZE_CACHE_SIZE = 4096
+
+# 正規化規則の版（normalize_pattern・敬称一覧を変えたら上げる。版が異なる保存済みキーは作り直す）
+NORMALIZATION_VERSION = 1
+
+
+def normalize_pattern(name: str) -> str:
+    """名前を正規化：空白・敬称を除去して小文字化（キャッシュなし。ルールのパターン用）"""
+    normalized = name.strip()
+    for suffix in HONORIFIC_SUFFIXES:
+        if normalized.endswith(suffix):
+            normalized = normalized[:-len(suffix)]
+    return normalized.lower()
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize_name(name: str) -> str:
+    """参加者名を正規化（同じ名前は一度だけ計算。パターンは normalize_pattern を使い、キャッシュを占有しない）"""
+    return normalize_pattern(name)
+
+
+def normalization_cache_stats() -> Dict:
+    """名前正規化キャッシュの統計情報"""
+    info = normalize_name.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        'hits': info.hits,
+        'misses': info.misses,
+        'size': info.currsize,
+        'maxsize': info.maxsize,
+        'hit_rate': info.hits / lookups if lookups else 0.0,
+    }
+
+
+def with_normalized_patterns(rules: Dict) -> Dict:
+    """各ルールに正規化済みパターン（normalized_patterns）と正規化規則の版を付与したコピーを返す
+
+    同じ版で保存済みのキーは再利用する。
+    """
+    return {
+        rule_name: dict(
+            rule_data,
+            normalized_patterns=_normalized_patterns_of(rule_data),
+            normalization_version=NORMALIZATION_VERSION
+        )
+        for rule_name, rule_data in rules.items()
+    }
+
+
+def strip_normalized_patterns(rules: Dict) -> Dict:
+    """内部用の正規化済みパターンと版を除いたコピー（エクスポート・インポート用）"""
+    return {rule_name: _without_normalized(rule_data) for rule_name, rule_data in rules.items()}
+
+
+def names_match(normalized_participant: str, normalized_pattern: str) -> bool:
+    """正規化済みの名前同士の柔軟マッチング（完全一致・部分一致の双方向）"""
+    return (
+        normalized_participant == normalized_pattern
+        or normalized_pattern in normalized_participant
+        or normalized_participant in normalized_pattern
+    )
+
+
+class PatternMatcher:
+    """正規化済みパターンの双方向部分一致マッチャー
+
+    名前に含まれるパターンは Aho–Corasick オートマトン、名前を含むパターンは
+    全パターンを連結した接尾辞オートマトンで検索し、いずれも名前の長さに比例する時間で
+    マッチしたルールの最小インデックス（= 定義順で最初のルール）を返す。
+    """
+
+    _SEPARATOR = '\x00'  # 正規化済みの名前には現れない区切り文字
+
+    def __init__(self, rule_patterns: Sequence[Sequence[str]]):
+        no_match = len(rule_patterns)
+        self._no_match = no_match
+
+        # 空パターンは任意の名前に含まれる。空の名前は任意のパターンに含まれる
+        self._empty_pattern_rule = min(
+            (index for index, patterns in enumerate(rule_patterns) if '' in patterns), default=no_match
+        )
+        self._first_rule_with_patterns = min(
+            (index for index, patterns in enumerate(rule_patterns) if patterns), default=no_match
+        )
+
+        # パターン → そのパターンを持つ最初のルール
+        first_rule: Dict[str, int] = {}
+        for index, patterns in enumerate(rule_patterns):
+            for pattern in patterns:
+                if pattern and pattern not in first_rule:
+                    first_rule[pattern] = index
+
+        self._build_aho_corasick(first_rule)
+        self._build_suffix_automaton(first_rule)
+
+    def match(self, normalized_name: str) -> Optional[int]:
+        """マッチした最初のルールのインデックス（マッチなしは None）"""
+        if normalized_name == '':
+            best = self._first_rule_with_patterns
+        else:
+            best = min(
+                self._empty_pattern_rule,
+                self._patterns_in_name(normalized_name),
+                self._patterns_containing_name(normalized_name),
+            )
+        return best if best < self._no_match else None
+
+    # ---- パターン ⊆ 名前（Aho–Corasick） ----
+    def _build_aho_corasick(self, first_rule: Dict[str, int]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[int] = [self._no_match]
+
+        for pattern, index in first_rule.items():
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(self._no_match)
+                state = next_state
+            self._output[state] = min(self._output[state], index)
+
+        # 失敗遷移を幅優先で構築し、出力（最小ルール）を失敗遷移先と合成
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state] = min(self._output[next_state], self._output[self._fail[next_state]])
+                queue.append(next_state)
+
+    def _patterns_in_name(self, name: str) -> int:
+        best = self._no_match
+        state = 0
+        for char in name:
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            if self._output[state] < best:
+                best = self._output[state]
+        return best
+
+    # ---- 名前 ⊆ パターン（接尾辞オートマトン） ----
+    def _build_suffix_automaton(self, first_rule: Dict[str, int]):
+        self._next: List[Dict[str, int]] = [{}]
+        self._link: List[int] = [-1]
+        self._length: List[int] = [0]
+        self._min_rule: List[int] = [self._no_match]
+        last = 0
+
+        for pattern, index in first_rule.items():
+            for char in pattern + self._SEPARATOR:
+                value = index if char != self._SEPARATOR else self._no_match
+                last = self._extend(last, char, value)
+
+        # 接尾辞リンク木の子から親へ最小ルールを伝播（長い状態から順に）
+        for state in sorted(range(1, len(self._length)), key=self._length.__getitem__, reverse=True):
+            parent = self._link[state]
+            if self._min_rule[state] < self._min_rule[parent]:
+                self._min_rule[parent] = self._min_rule[state]
+
+    def _extend(self, last: int, char: str, value: int) -> int:
+        current = len(self._next)
+        self._next.append({})
+        self._length.append(self._length[last] + 1)
+        self._link.append(0)
+        self._min_rule.append(value)
+
+        state = last
+        while state != -1 and char not in self._next[state]:
+            self._next[state][char] = current
+            state = self._link[state]
+        if state == -1:
+            return current
+
+        target = self._next[state][char]
+        if self._length[state] + 1 == self._length[target]:
+            self._link[current] = target
+            return current
+
+        clone = len(self._next)
+        self._next.append(dict(self._next[target]))
+        self._length.append(self._length[state] + 1)
+        self._link.append(self._link[target])
+        self._min_rule.append(self._no_match)
+        while state != -1 and self._next[state].get(char) == target:
+            self._next[state][char] = clone
+            state = self._link[state]
+        self._link[target] = clone
+        self._link[current] = clone
+        return current
+
+    def _patterns_containing_name(self, name: str) -> int:
+        state = 0
+        for char in name:
+            state = self._next[state].get(char, -1)
+            if state == -1:
+                return self._no_match
+        return self._min_rule[state]
+
+
+class CompiledMultiplierRules:
+    """倍率ルールのコンパイル済み表現（パターンは正規化済みで保持）"""
+
+    def __init__(self, rules: Dict):
+        # ルールの定義順に (正規化済みパターン一覧, 倍率) を保持
+        self._compiled: List[Tuple[List[str], float]] = [
+            (_normalized_patterns_of(rule_data), rule_data.get('multiplier', 1.0))
+            for rule_data in rules.values()
+        ]
+        self._matcher = PatternMatcher([patterns for patterns, _ in self._compiled])
+
+    def __len__(self) -> int:
+        return len(self._compiled)
+
+    def find(self, participant_name: str) -> float:
+        """参加者名に対応する倍率を検索（最初にマッチしたルールを優先）"""
+        rule_index = self._matcher.match(normalize_name(participant_name))
+        if rule_index is None:
+            return 1.0  # デフォルト倍率
+        return self._compiled[rule_index][1]
+
+    def resolve(self, participant_names: Sequence[str]) -> np.ndarray:
+        """参加者名の並びを倍率ベクトルに変換（同名は一度だけ解決）"""
+        if not self._compiled:
+            return np.ones(len(participant_names))
+
+        resolved: Dict[str, float] = {}
+        multipliers = np.empty(len(participant_names), dtype=float)
+
+        for i, name in enumerate(participant_names):
+            if name not in resolved:
+                resolved[name] = self.find(name)
+            multipliers[i] = resolved[name]
+
+        return multipliers
+
+
+# スナップショットのバージョン番号（プロセス内で単調増加、セッションをまたいでも重複しない）
+_version_counter = itertools.count(1)
+_version_lock = threading.Lock()
+
+
+def next_rules_version() -> int:
+    with _version_lock:
+        return next(_version_counter)
+
+
+class RuleSnapshot:
+    """倍率ルールの不変スナップショット（バージョン番号とコンパイル済みマッチャー付き）
+
+    保存のたびに新しいスナップショットを作り、読み取り側は現在のものを O(1) で参照する。
+    キャッシュは version をキーにすれば、ルールが変わったときだけ無効になる。
+    """
+
+    __slots__ = ('version', 'rules', 'compiled', 'updated_at', 'updated_by')
+
+    def __init__(self, rules: Dict, updated_by: str = 'unknown',
+                 updated_at: Optional[str] = None, version: Optional[int] = None):
+        rules = with_normalized_patterns(rules)
+        object.__setattr__(self, 'version', version if version is not None else next_rules_version())
+        object.__setattr__(self, 'rules', _freeze(rules))
+        object.__setattr__(self, 'compiled', CompiledMultiplierRules(rules))
+        object.__setattr__(self, 'updated_at', updated_at or datetime.now().isoformat())
+        object.__setattr__(self, 'updated_by', updated_by)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RuleSnapshot は変更できません（新しいスナップショットを作成してください）")
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def to_dict(self) -> Dict:
+        """編集用の可変なコピー"""
+        return _thaw(self.rules)
+
+
+def _freeze(value):
+    """辞書・リストを読み取り専用のビュー・タプルに再帰的に変換"""
+    if isinstance(value, Mapping):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return copy.deepcopy(value)
+
+
+def _thaw(value):
+    """_freeze の逆変換"""
+    if isinstance(value, Mapping):
+        return {key: _thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(item) for item in value]
+    return value
+
+
+def _normalized_patterns_of(rule_data: Dict) -> List[str]:
+    """現在の版で保存済みの正規化キーがあれば再利用し、なければ正規化"""
+    patterns = rule_data.get('name_patterns', [])
+    normalized = rule_data.get('normalized_patterns')
+    if (normalized is not None and len(normalized) == len(patterns)
+            and rule_data.get('normalization_version') == NORMALIZATION_VERSION):
+        return list(normalized)
+    return [normalize_pattern(pattern) for pattern in patterns]
+
+
+# ==== SQLite 永続化 ====
+# ルールデータベースのパス（環境変数 WARIKAN_RULES_DB で変更可能）
+DEFAULT_RULES_DB_PATH = 'warikan_rules.db'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rules (
+    name TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    multiplier REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rule_patterns (
+    rule_name TEXT NOT NULL REFERENCES rules(name) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    pattern TEXT NOT NULL,
+    normalized TEXT NOT NULL,
+    PRIMARY KEY (rule_name, position)
+);
+CREATE INDEX IF NOT EXISTS idx_rule_patterns_normalized ON rule_patterns(normalized);
+CREATE TABLE IF NOT EXISTS change_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    changed_at TEXT NOT NULL,
+    changed_by TEXT NOT NULL,
+    action TEXT NOT NULL,
+    rule_name TEXT NOT NULL,
+    data TEXT
+);
+"""
+
+
+def rules_db_path() -> str:
+    return os.environ.get('WARIKAN_RULES_DB') or DEFAULT_RULES_DB_PATH
+
+
+class SQLiteRuleBackend:
+    """倍率ルールの SQLite 保存先（WAL モード）
+
+    rules にルール本体、rule_patterns に正規化済みパターン（索引付き）、
+    change_log に追加・更新・削除の履歴を追記のみで記録する。
+    正規化済みパターンの版は PRAGMA user_version に保持し、起動時に版が異なれば作り直す。
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or rules_db_path()
+        with self._connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(_SCHEMA)
+            self._renormalize(connection)
+
+    def _renormalize(self, connection):
+        """保存済みの正規化キーが現在の版と異なれば作り直す"""
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            if connection.execute('PRAGMA user_version').fetchone()[0] != NORMALIZATION_VERSION:
+                rows = connection.execute('SELECT rule_name, position, pattern FROM rule_patterns').fetchall()
+                connection.executemany(
+                    'UPDATE rule_patterns SET normalized = ? WHERE rule_name = ? AND position = ?',
+                    [(normalize_pattern(pattern), rule_name, position) for rule_name, position, pattern in rows]
+                )
+                connection.execute(f'PRAGMA user_version = {NORMALIZATION_VERSION:d}')
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def _connect(self):
+        # 接続は操作ごとに開く（Streamlit のスレッド間で共有しない）
+        connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        connection.execute('PRAGMA foreign_keys=ON')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return closing(connection)
+
+    def load_rules(self) -> Dict:
+        """保存済みルールを定義順に読み込み（正規化済みパターン付き）"""
+        with self._connect() as connection:
+            rows = connection.execute('SELECT name, data FROM rules ORDER BY position').fetchall()
+            patterns = connection.execute(
+                'SELECT rule_name, normalized FROM rule_patterns ORDER BY rule_name, position'
+            ).fetchall()
+            version = connection.execute('PRAGMA user_version').fetchone()[0]
+
+        normalized: Dict[str, List[str]] = {}
+        for rule_name, pattern in patterns:
+            normalized.setdefault(rule_name, []).append(pattern)
+
+        rules = {}
+        for name, data in rows:
+            rule_data = json.loads(data)
+            rule_data['normalized_patterns'] = normalized.get(name, [])
+            rule_data['normalization_version'] = version
+            rules[name] = rule_data
+        return rules
+
+    def save_rules(self, rules: Dict, updated_by: str, updated_at: str, previous: Dict):
+        """ルール全体を書き込み、previous との差分を変更履歴に追記（1トランザクション）"""
+        rules = with_normalized_patterns(rules)
+        changes = [
+            (name, 'add' if name not in previous else 'update', rule_data)
+            for name, rule_data in rules.items()
+            if _without_normalized(rule_data) != _without_normalized(previous.get(name, {}))
+        ] + [(name, 'delete', None) for name in previous if name not in rules]
+
+        with self._connect() as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.execute('DELETE FROM rules')
+                connection.execute(f'PRAGMA user_version = {NORMALIZATION_VERSION:d}')
+                connection.executemany(
+                    'INSERT INTO rules (name, position, multiplier, data) VALUES (?, ?, ?, ?)',
+                    [
+                        (name, position, float(rule_data.get('multiplier', 1.0)), _to_json(_without_normalized(rule_data)))
+                        for position, (name, rule_data) in enumerate(rules.items())
+                    ]
+                )
+                connection.executemany(
+                    'INSERT INTO rule_patterns (rule_name, position, pattern, normalized) VALUES (?, ?, ?, ?)',
+                    [
+                        (name, index, pattern, normalized)
+                        for name, rule_data in rules.items()
+                        for index, (pattern, normalized) in enumerate(
+                            zip(rule_data.get('name_patterns', []), rule_data['normalized_patterns'])
+                        )
+                    ]
+                )
+                connection.executemany(
+                    'INSERT INTO change_log (changed_at, changed_by, action, rule_name, data) VALUES (?, ?, ?, ?, ?)',
+                    [
+                        (updated_at, updated_by, action, name,
+                         _to_json(_without_normalized(rule_data)) if rule_data is not None else None)
+                        for name, action, rule_data in changes
+                    ]
+                )
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+
+    def rules_for_pattern(self, pattern: str) -> List[str]:
+        """正規化後に pattern と一致するパターンを持つルール名（定義順）"""
+        with self._connect() as connection:
+            rows = connection.execute(
+                'SELECT DISTINCT r.name FROM rule_patterns p JOIN rules r ON r.name = p.rule_name '
+                'WHERE p.normalized = ? ORDER BY r.position',
+                (normalize_pattern(pattern),)
+            ).fetchall()
+        return [name for (name,) in rows]
+
+    def last_change(self) -> Optional[Dict]:
+        """最後の変更（変更履歴が空なら None）"""
+        history = self.change_log(limit=1)
+        return history[0] if history else None
+
+    def change_log(self, limit: int = 50) -> List[Dict]:
+        """変更履歴（新しい順）"""
+        with self._connect() as connection:
+            rows = connection.execute(
+                'SELECT id, changed_at, changed_by, action, rule_name FROM change_log ORDER BY id DESC LIMIT ?',
+                (limit,)
+            ).fetchall()
+        return [
+            {'id': row[0], 'changed_at': row[1], 'changed_by': row[2], 'action': row[3], 'rule_name': row[4]}
+            for row in rows
+        ]
+
+
+def _without_normalized(rule_data: Dict) -> Dict:
+    return {
+        key: value for key, value in rule_data.items()
+        if key not in ('normalized_patterns', 'normalization_version')
+    }
+
+
+def _to_json(value) -> str:
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, default=str)
+
+
+# ==== プロセス共有ルールストア ====
+class ReadWriteLock:
+    """読み取りは並行、書き込みは排他のロック（書き込み待ちがあれば新しい読み取りを待たせる）"""
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        with self._condition:
+            while self._writer or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._condition:
+            self._readers -= 1
+            if self._readers == 0:
+                self._condition.notify_all()
+
+    def acquire_write(self):
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._condition:
+            self._writer = False
+            self._condition.notify_all()
+
+
+class RuleStore:
+    """全セッションで共有する倍率ルールストア（Streamlit のセッション状態はブラウザごとのため）
+
+    読み取り側は現在のスナップショットを読み取りロック下で取得するだけなので、
+    計算が並行しても競合しない。更新同士は別のロックで直列化し、スナップショットの構築と
+    保存はその外側で行い、書き込みロックは参照の差し替えの間だけ保持する。
+    backend を指定すると起動時にそこから読み込み、更新は差し替え前に書き込む。
+    """
+
+    def __init__(self, backend: Optional[SQLiteRuleBackend] = None):
+        self._lock = ReadWriteLock()
+        # 更新同士の直列化用（読み取りは待たせない）
+        self._writer_lock = threading.Lock()
+        self.backend = backend
+        self.backend_error: Optional[str] = None
+        self._snapshot = RuleSnapshot({}, updated_by='')
+        self._initialized = False
+
+        if backend is not None:
+            last_change = backend.last_change()
+            if last_change is not None:
+                self._snapshot = RuleSnapshot(
+                    backend.load_rules(),
+                    updated_by=last_change['changed_by'],
+                    updated_at=last_change['changed_at']
+                )
+                self._initialized = True
+
+    @property
+    def initialized(self) -> bool:
+        """一度でもルールが保存されたか"""
+        return self._initialized
+
+    def current(self) -> RuleSnapshot:
+        """現在のスナップショット"""
+        self._lock.acquire_read()
+        try:
+            return self._snapshot
+        finally:
+            self._lock.release_read()
+
+    def publish(self, rules: Dict, updated_by: str = 'unknown') -> RuleSnapshot:
+        """ルール全体を置き換える"""
+        with self._writer_lock:
+            return self._replace(rules, updated_by)
+
+    def update(self, mutate: Callable[[Dict], None], updated_by: str = 'unknown') -> RuleSnapshot:
+        """現在のルールのコピーを mutate でその場で変更して反映（読み取りから差し替えまでを更新同士で排他）"""
+        with self._writer_lock:
+            rules = self._snapshot.to_dict()
+            mutate(rules)
+            return self._replace(rules, updated_by)
+
+    def last_change(self) -> Optional[Dict]:
+        """最後の変更（保存先があれば変更履歴から、なければ現在のスナップショットから）"""
+        if self.backend is not None:
+            return self.backend.last_change()
+        if not self._initialized:
+            return None
+        snapshot = self.current()
+        return {'changed_at': snapshot.updated_at, 'changed_by': snapshot.updated_by}
+
+    def _replace(self, rules: Dict, updated_by: str) -> RuleSnapshot:
+        # _writer_lock 下で呼ぶこと。保存に失敗した場合は現在のスナップショットを維持
+        snapshot = RuleSnapshot(rules, updated_by=updated_by)
+        if self.backend is not None:
+            self.backend.save_rules(rules, updated_by, snapshot.updated_at, self._snapshot.to_dict())
+
+        self._lock.acquire_write()
+        try:
+            self._snapshot = snapshot
+            self._initialized = True
+        finally:
+            self._lock.release_write()
+        return snapshot
+
+
+_rule_store: Optional[RuleStore] = None
+_rule_store_lock = threading.Lock()
+
+
+def get_rule_store() -> RuleStore:
+    """プロセス内で共有するルールストア（初回に SQLite から読み込み）"""
+    global _rule_store
+    if _rule_store is None:
+        with _rule_store_lock:
+            if _rule_store is None:
+                try:
+                    _rule_store = RuleStore(SQLiteRuleBackend())
+                except sqlite3.Error as e:
+                    # SQLite を開けない環境ではメモリのみで動作
+                    _rule_store = RuleStore()
+                    _rule_store.backend_error = str(e)
+    return _rule_store
@@ -0,0 +1,234 @@
+# ==== 参加者ストア（Streamlit非依存） ====
+# 参加者を列指向の配列で保持する（役職は役職コード、倍率は float 配列）
+# 辞書のリストを作らないため、テンプレート・履歴・自動保存へのコピーも配列のコピーで済む
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Sequence
+
+from warikan_engine import ROLE_CODES, ROLE_NAMES
+
+_INITIAL_CAPACITY = 16
+
+# 追加日時の表示形式（内部では UNIX 秒の整数で保持、0 は不明）
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class ParticipantStore:
+    """列指向の参加者ストア（DataFrame への変換は表示時に必要な分だけ）
+
+    追加者は文字列表に登録（intern）してコードで保持する。
+    """
+
+    def __init__(self):
+        self._size = 0
+        self._names = np.empty(_INITIAL_CAPACITY, dtype=object)
+        self._role_codes = np.empty(_INITIAL_CAPACITY, dtype=np.int8)
+        self._multipliers = np.empty(_INITIAL_CAPACITY, dtype=float)
+        self._added_at = np.empty(_INITIAL_CAPACITY, dtype=np.int64)
+        self._added_by = np.empty(_INITIAL_CAPACITY, dtype=np.int32)
+        self._adders: List[str] = []
+        self._adder_codes: Dict[str, int] = {}
+        self._index: Dict[str, int] = {}
+
+    @classmethod
+    def from_frame(cls, df) -> 'ParticipantStore':
+        """名前・役職（任意でカスタム倍率）列を持つ DataFrame から作成"""
+        missing = [column for column in ('名前', '役職') if column not in df]
+        if missing:
+            raise ValueError(f"必須列がありません: {', '.join(missing)}")
+
+        names = df['名前'].astype(str).str.strip()
+        if (names == '').any():
+            raise ValueError("名前が空の行があります")
+        if names.duplicated().any():
+            duplicated = names[names.duplicated()].unique()[:5]
+            raise ValueError(f"同じ名前の参加者が重複しています: {', '.join(duplicated)}")
+
+        codes = pd.Categorical(df['役職'].astype(str).str.strip(), categories=ROLE_NAMES).codes
+        if (codes < 0).any():
+            unknown = df['役職'][codes < 0].astype(str).unique()[:5]
+            raise ValueError(f"未対応の役職があります: {', '.join(unknown)}")
+
+        if 'カスタム倍率' in df:
+            multipliers = pd.to_numeric(df['カスタム倍率'], errors='coerce').fillna(1.0).to_numpy(dtype=float)
+        else:
+            multipliers = np.ones(len(df))
+
+        store = cls()
+        n = len(df)
+        store._reserve(n)
+        store._names[:n] = names.to_numpy(dtype=object)
+        store._role_codes[:n] = codes
+        store._multipliers[:n] = multipliers
+        store._added_at[:n] = 0
+        store._added_by[:n] = store._intern('')
+        store._size = n
+        store._index = {name: i for i, name in enumerate(store._names[:n])}
+        return store
+
+    @classmethod
+    def from_csv(cls, file) -> 'ParticipantStore':
+        """CSV（名前,役職[,カスタム倍率]）から作成"""
+        return cls.from_frame(pd.read_csv(file, dtype={'名前': str, '役職': str}))
+
+    @classmethod
+    def from_records(cls, records: Sequence[Dict]) -> 'ParticipantStore':
+        """旧形式（名前・役職・追加日時・追加者キーの辞書リスト）から作成"""
+        store = cls()
+        for record in records:
+            added_at = record.get('追加日時')
+            store.append(
+                record['名前'], record['役職'], record.get('カスタム倍率', 1.0),
+                added_at=int(datetime.strptime(added_at, TIMESTAMP_FORMAT).timestamp()) if added_at else 0,
+                added_by=record.get('追加者', '')
+            )
+        return store
+
+    @classmethod
+    def coerce(cls, participants) -> 'ParticipantStore':
+        """ストア・旧形式の辞書リスト・None のいずれからでもストアを得る（ストアはそのまま返す）"""
+        if isinstance(participants, cls):
+            return participants
+        return cls.from_records(participants or [])
+
+    def copy(self) -> 'ParticipantStore':
+        """スナップショット用のコピー（使用中の範囲の配列のみ）"""
+        store = ParticipantStore()
+        store._reserve(self._size)
+        for column in ('_names', '_role_codes', '_multipliers', '_added_at', '_added_by'):
+            getattr(store, column)[:self._size] = getattr(self, column)[:self._size]
+        store._size = self._size
+        store._adders = list(self._adders)
+        store._adder_codes = dict(self._adder_codes)
+        store._index = dict(self._index)
+        return store
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._index
+
+    def index_of(self, name: str) -> int:
+        return self._index[name]
+
+    @property
+    def names(self) -> np.ndarray:
+        return self._names[:self._size]
+
+    @property
+    def role_codes(self) -> np.ndarray:
+        return self._role_codes[:self._size]
+
+    @property
+    def roles(self) -> np.ndarray:
+        return np.asarray(ROLE_NAMES, dtype=object)[self.role_codes]
+
+    @property
+    def multipliers(self) -> np.ndarray:
+        return self._multipliers[:self._size]
+
+    def record(self, index: int) -> Dict:
+        """index 番目の参加者を表示用の辞書に変換"""
+        added_at = int(self._added_at[index])
+        return {
+            '名前': self._names[index],
+            '役職': ROLE_NAMES[self._role_codes[index]],
+            'カスタム倍率': float(self._multipliers[index]),
+            '追加日時': datetime.fromtimestamp(added_at).strftime(TIMESTAMP_FORMAT) if added_at else '',
+            '追加者': self._adders[self._added_by[index]],
+        }
+
+    def append(self, name: str, role: str, multiplier: float = 1.0,
+               added_at: Optional[int] = None, added_by: str = ''):
+        """参加者を1人追加（償却 O(1)、added_at は UNIX 秒で省略時は現在時刻）"""
+        if role not in ROLE_CODES:
+            raise ValueError(f"未対応の役職です: {role}")
+        if name in self._index:
+            raise ValueError(f"同じ名前の参加者が既に存在します: {name}")
+
+        self._reserve(self._size + 1)
+        i = self._size
+        self._names[i] = name
+        self._role_codes[i] = ROLE_CODES[role]
+        self._multipliers[i] = multiplier
+        self._added_at[i] = int(datetime.now().timestamp()) if added_at is None else added_at
+        self._added_by[i] = self._intern(added_by)
+        self._index[name] = i
+        self._size += 1
+
+    def remove(self, index: int):
+        """index 番目の参加者を削除"""
+        if not 0 <= index < self._size:
+            raise IndexError(index)
+        for column in (self._names, self._role_codes, self._multipliers, self._added_at, self._added_by):
+            column[index:self._size - 1] = column[index + 1:self._size]
+        self._size -= 1
+        self._names[self._size] = None
+        self._index = {name: i for i, name in enumerate(self._names[:self._size])}
+
+    def set_role(self, index: int, role: str):
+        """index 番目の参加者の役職を変更"""
+        if role not in ROLE_CODES:
+            raise ValueError(f"未対応の役職です: {role}")
+        self._role_codes[index] = ROLE_CODES[role]
+
+    def role_counts(self) -> Dict[str, int]:
+        """役職ごとの人数"""
+        counts = np.bincount(self.role_codes, minlength=len(ROLE_NAMES))
+        return {role: int(count) for role, count in zip(ROLE_NAMES, counts)}
+
+    def to_frame(self, start: int = 0, stop: Optional[int] = None,
+                 extra_columns: Optional[Dict[str, Sequence]] = None,
+                 include_meta: bool = False) -> pd.DataFrame:
+        """[start, stop) の範囲を DataFrame に変換（extra_columns は全体配列を渡す）"""
+        stop = self._size if stop is None else min(stop, self._size)
+        frame = pd.DataFrame({
+            '名前': self._names[start:stop],
+            '役職': np.asarray(ROLE_NAMES, dtype=object)[self._role_codes[start:stop]],
+            'カスタム倍率': self._multipliers[start:stop],
+        })
+        if include_meta:
+            frame['追加日時'] = [self.record(i)['追加日時'] for i in range(start, stop)]
+            frame['追加者'] = np.asarray(self._adders, dtype=object)[self._added_by[start:stop]]
+        for column, values in (extra_columns or {}).items():
+            frame[column] = np.asarray(values)[start:stop]
+        return frame
+
+    def to_records(self) -> List[Dict]:
+        """旧形式の辞書リストに変換（エクスポート用）"""
+        return [self.record(i) for i in range(self._size)]
+
+    def page(self, page: int, page_size: int = 100,
+             extra_columns: Optional[Dict[str, Sequence]] = None) -> pd.DataFrame:
+        """ページ単位で DataFrame に変換（page は 0 始まり）"""
+        start = page * page_size
+        frame = self.to_frame(start, start + page_size, extra_columns)
+        frame.index = pd.RangeIndex(start + 1, start + 1 + len(frame))
+        return frame
+
+    def _intern(self, value: str) -> int:
+        """追加者名を文字列表に登録してコードを返す"""
+        code = self._adder_codes.get(value)
+        if code is None:
+            code = len(self._adders)
+            self._adders.append(value)
+            self._adder_codes[value] = code
+        return code
+
+    def _reserve(self, capacity: int):
+        """容量を2倍ずつ拡張"""
+        if capacity <= len(self._names):
+            return
+        new_capacity = max(capacity, 2 * len(self._names))
+        for column in ('_names', '_role_codes', '_multipliers', '_added_at', '_added_by'):
+            setattr(self, column, _grow(getattr(self, column), new_capacity))
+
+
+def _grow(column: np.ndarray, capacity: int) -> np.ndarray:
+    grown = np.empty(capacity, dtype=column.dtype)
+    grown[:len(column)] = column
+    return grown
@@ -15,6 +15,7 @@ from datetime import datetime
 import random
 import json
 import hashlib
+import sqlite3
 from typing import Dict, Optional, List
 import time
 import base64
@@ -22,6 +23,18 @@ from io import BytesIO
 import os
 from pathlib import Path
 
+from warikan_engine import (
+    OptimizationTrace, throttle_progress,
+    AIWarikanOptimizer, OptimizationResultCache, IncrementalWarikan,
+    sweep_rounding_units, role_weight_sensitivity, RoleWeightEstimator
+)
+from multiplier_rules import (
+    CompiledMultiplierRules, RuleSnapshot, get_rule_store, normalize_name, normalize_pattern,
+    names_match, normalization_cache_stats, strip_normalized_patterns
+)
+from warikan_settlement import settle_event, EventLedger, SeasonLedger, get_season_backend
+from participant_store import ParticipantStore
+
 # ==== ページ設定 ====
 st.set_page_config(
     page_title="🍻 友達限定AI割り勘システム Pro",
@@ -187,8 +200,10 @@ class DataManager:
         self.templates_key = f"templates_{username}"
         self.history_key = f"history_{username}"
         self.session_key = f"session_{username}"
+        self.role_stats_key = f"role_stats_{username}"
+        self.season_key = f"season_{username}"
     
-    def save_template(self, template_name: str, participants: List[Dict]) -> bool:
+    def save_template(self, template_name: str, participants: ParticipantStore) -> bool:
         """参加者テンプレートを保存"""
         try:
             if self.templates_key not in st.session_state:
@@ -196,7 +211,7 @@ class DataManager:
             
             template_data = {
                 'name': template_name,
-                'participants': participants,
+                'participants': participants.copy(),
                 'created_at': datetime.now().isoformat(),
                 'created_by': self.username
             }
@@ -231,10 +246,12 @@ class DataManager:
                 'id': f"calc_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{random.randint(1000,9999)}",
                 'calculation_time': datetime.now().isoformat(),
                 'total_amount': calculation_data.get('total_amount'),
-                'participants': calculation_data.get('participants'),
+                'participants': ParticipantStore.coerce(calculation_data.get('participants')).copy(),
                 'results': calculation_data.get('results'),
                 'sum_warikan': calculation_data.get('sum_warikan'),
                 'diff': calculation_data.get('diff'),
+                'replay': calculation_data.get('replay'),
+                'trace': calculation_data.get('trace'),
                 'calculator': self.username
             }
             
@@ -243,6 +260,14 @@ class DataManager:
             if len(st.session_state[self.history_key]) > 10:
                 st.session_state[self.history_key] = st.session_state[self.history_key][:10]
             
+            # 役職比率の推定器を更新（履歴の再走査なし）
+            results = calculation_data.get('results')
+            if results:
+                df_results = pd.DataFrame(results)
+                estimator = self.load_role_weight_estimator()
+                estimator.update(df_results['役職'], df_results['負担額_丸め'], df_results.get('最終倍率'))
+                st.session_state[self.role_stats_key] = estimator
+            
             return True
         except Exception as e:
             st.error(f"履歴保存エラー: {str(e)}")
@@ -252,6 +277,48 @@ class DataManager:
         """計算履歴を読み込み"""
         return st.session_state.get(self.history_key, [])
     
+    def load_role_weight_estimator(self) -> RoleWeightEstimator:
+        """計算履歴から学習した役職比率の推定器を読み込み"""
+        estimator = st.session_state.get(self.role_stats_key)
+        return estimator if estimator is not None else RoleWeightEstimator()
+    
+    def load_season_ledger(self) -> SeasonLedger:
+        """シーズン台帳を読み込み（SQLite に保存済みならそこから、未作成なら新規作成）"""
+        if self.season_key not in st.session_state:
+            backend, _ = get_season_backend()
+            ledger = backend.load(self.username) if backend is not None else None
+            st.session_state[self.season_key] = ledger or SeasonLedger(datetime.now().strftime('%Y年%m月〜'))
+        return st.session_state[self.season_key]
+    
+    def record_season_event(self, source_id: str, names: List[str], balances, label: str = '') -> bool:
+        """記録元（計算・会計台帳）の収支をシーズン台帳に反映（前回記録からの差分のみ加算）"""
+        backend, _ = get_season_backend()
+        try:
+            if backend is None:
+                # SQLite を使えない場合はセッション内の台帳に加算
+                return self.load_season_ledger().record_source(source_id, names, balances, label)
+            # 読み込みから追記までを SQLite の1トランザクションで行い、別セッションの記録を取りこぼさない
+            recorded = backend.record(self.username, source_id, names, balances, label,
+                                      season_name=datetime.now().strftime('%Y年%m月〜'))
+            st.session_state.pop(self.season_key, None)
+            return recorded
+        except (ValueError, sqlite3.Error) as e:
+            st.error(f"シーズン台帳記録エラー: {str(e)}")
+            return False
+    
+    def close_season(self) -> List[Dict]:
+        """シーズンを締めて精算リストを返し、新しいシーズンを開始"""
+        next_name = datetime.now().strftime('%Y年%m月〜')
+        backend, _ = get_season_backend()
+        if backend is None:
+            transfers = self.load_season_ledger().settlement()
+            st.session_state[self.season_key] = SeasonLedger(next_name)
+            return transfers
+        # 精算リストは締める時点の最新の台帳から求める（セッション内の写しは使わない）
+        transfers = backend.close(self.username, next_name)
+        st.session_state.pop(self.season_key, None)
+        return transfers
+    
     def delete_history_item(self, item_id: str) -> bool:
         """履歴アイテムを削除"""
         try:
@@ -269,7 +336,7 @@ class DataManager:
         """作業中セッションデータを保存"""
         try:
             auto_save_data = {
-                'participants': session_data.get('participants', []),
+                'participants': ParticipantStore.coerce(session_data.get('participants')).copy(),
                 'total_amount': session_data.get('total_amount', 10000),
                 'last_saved': datetime.now().isoformat(),
                 'session_id': session_data.get('session_id'),
@@ -298,51 +365,30 @@ class DataManager:
 # ==== カスタム倍率管理クラスの追加 ====
 class CustomMultiplierManager:
     def __init__(self):
-        # Streamlit Cloud対応の永続化
-        self.global_key = "GLOBAL_CUSTOM_MULTIPLIERS"
-        self.backup_key = "multiplier_backup_store"
+        # プロセス内で共有するルールストア（全セッション・全ユーザー共通）
+        self.store = get_rule_store()
     
-    def save_multiplier_rules(self, rules: Dict) -> bool:
-        """倍率ルールを永続化保存（Streamlit Cloud対応）"""
+    def _current_user(self) -> str:
+        return st.session_state.user['username'] if st.session_state.get('user') else 'unknown'
+    
+    def update_multiplier_rules(self, mutate) -> bool:
+        """現在のルールを変更して保存（他の管理者の同時更新を上書きしない）"""
         try:
-            # 方法1: st.session_stateの特別なキーを使用
-            # このキーは異なるセッション間で共有される
-            for key in list(st.session_state.keys()):
-                if key.startswith('user_') or key.startswith('temp_'):
-                    continue  # ユーザー固有データはスキップ
-            
-            # グローバル共有ストレージとして使用
-            st.session_state[self.global_key] = {
-                'rules': rules,
-                'last_updated': datetime.now().isoformat(),
-                'updated_by': st.session_state.user['username'] if 'user' in st.session_state else 'unknown'
-            }
-            
-            # バックアップも保存
-            st.session_state[self.backup_key] = rules.copy()
-            
+            self.store.update(mutate, updated_by=self._current_user())
             return True
             
         except Exception as e:
             st.error(f"倍率ルール保存エラー: {str(e)}")
             return False
     
+    def get_snapshot(self) -> RuleSnapshot:
+        """現在のルールのスナップショットを取得（O(1)）"""
+        return self.store.current()
+    
     def load_multiplier_rules(self) -> Dict:
-        """倍率ルールを読み込み（Streamlit Cloud対応）"""
+        """倍率ルールを読み込み（編集用のコピー。変更は update_multiplier_rules で反映）"""
         try:
-            # メインストレージから読み込み
-            if self.global_key in st.session_state:
-                global_data = st.session_state[self.global_key]
-                if isinstance(global_data, dict) and 'rules' in global_data:
-                    return global_data['rules']
-            
-            # バックアップから読み込み
-            if self.backup_key in st.session_state:
-                return st.session_state[self.backup_key]
-            
-            # 初期値
-            return {}
-            
+            return self.get_snapshot().to_dict()
         except Exception as e:
             st.error(f"倍率ルール読み込みエラー: {str(e)}")
             return {}
@@ -350,82 +396,59 @@ class CustomMultiplierManager:
     def delete_multiplier_rule(self, rule_name: str) -> bool:
         """倍率ルールを削除"""
         try:
-            rules = self.load_multiplier_rules()
-            if rule_name in rules:
-                del rules[rule_name]
-                return self.save_multiplier_rules(rules)
-            return False
+            if rule_name not in self.get_snapshot().rules:
+                return False
+            return self.update_multiplier_rules(lambda rules: rules.pop(rule_name, None))
         except:
             return False
     
     def get_storage_info(self) -> Dict:
-        """ストレージ情報を取得"""
+        """ストレージ情報を取得（最終更新は変更履歴から）"""
         try:
+            snapshot = self.get_snapshot()
             info = {
-                'has_global_storage': self.global_key in st.session_state,
-                'has_backup_storage': self.backup_key in st.session_state,
-                'rules_count': len(self.load_multiplier_rules()),
-                'storage_type': 'Streamlit Session State (Global)',
-                'persistence_level': 'アプリ実行中は永続'
+                'has_global_storage': self.store.initialized,
+                'rules_count': len(snapshot),
+                'version': snapshot.version,
             }
             
-            if self.global_key in st.session_state:
-                global_data = st.session_state[self.global_key]
-                if isinstance(global_data, dict):
-                    info['last_updated'] = global_data.get('last_updated', '不明')
-                    info['updated_by'] = global_data.get('updated_by', '不明')
+            if self.store.backend is not None:
+                info['storage_type'] = f'SQLite (WAL): {self.store.backend.path}'
+                info['persistence_level'] = '再起動後も保持（全セッション共通）'
+            else:
+                info['storage_type'] = 'プロセス共有メモリ（全セッション共通）'
+                info['persistence_level'] = 'アプリ実行中は永続（再起動で消去）'
+                info['backend_error'] = self.store.backend_error
+            
+            last_change = self.store.last_change()
+            if last_change is not None:
+                info['last_updated'] = last_change['changed_at']
+                info['updated_by'] = last_change['changed_by']
             
             return info
         except:
             return {'error': True}
     
+    def get_compiled_rules(self) -> CompiledMultiplierRules:
+        """現在のスナップショットのコンパイル済みルールを取得（ルール保存時のみ再コンパイル）"""
+        return self.get_snapshot().compiled
+    
+    def resolve_multipliers(self, participant_names) -> np.ndarray:
+        """参加者名の並びを倍率ベクトルに一括変換"""
+        return self.get_compiled_rules().resolve(list(participant_names))
+    
     def find_matching_multiplier(self, participant_name: str) -> float:
         """参加者名に対応する倍率を検索（柔軟マッチング）"""
-        rules = self.load_multiplier_rules()
-        
-        for rule_name, rule_data in rules.items():
-            name_patterns = rule_data.get('name_patterns', [])
-            multiplier = rule_data.get('multiplier', 1.0)
-            
-            # 柔軟な名前マッチング
-            for pattern in name_patterns:
-                if self._flexible_name_match(participant_name, pattern):
-                    return multiplier
-        
-        return 1.0  # デフォルト倍率
+        return self.get_compiled_rules().find(participant_name)
     
     def _flexible_name_match(self, participant_name: str, pattern: str) -> bool:
         """柔軟な名前マッチング"""
         # 正規化：空白、「さん」「君」「ちゃん」などを除去
-        def normalize_name(name):
-            # よくある敬称を除去
-            suffixes = ['さん', 'くん', 'ちゃん', '君', '様', 'サン', 'クン']
-            normalized = name.strip()
-            for suffix in suffixes:
-                if normalized.endswith(suffix):
-                    normalized = normalized[:-len(suffix)]
-            return normalized.lower()
-        
-        normalized_participant = normalize_name(participant_name)
-        normalized_pattern = normalize_name(pattern)
-        
-        # 完全一致チェック
-        if normalized_participant == normalized_pattern:
-            return True
-        
-        # 部分一致チェック（パターンが参加者名に含まれる）
-        if normalized_pattern in normalized_participant:
-            return True
-        
-        # 参加者名がパターンに含まれる
-        if normalized_participant in normalized_pattern:
-            return True
-        
-        return False
+        return names_match(normalize_name(participant_name), normalize_pattern(pattern))
     
     def export_rules_for_sharing(self) -> str:
         """ルールを共有用形式でエクスポート"""
-        rules = self.load_multiplier_rules()
+        rules = strip_normalized_patterns(self.load_multiplier_rules())
         storage_info = self.get_storage_info()
         
         export_data = {
@@ -450,9 +473,9 @@ class CustomMultiplierManager:
             else:
                 imported_rules = imported_data
             
-            current_rules = self.load_multiplier_rules()
-            current_rules.update(imported_rules)
-            return self.save_multiplier_rules(current_rules)
+            # 正規化済みパターンは取り込まず、保存時に作り直す
+            imported_rules = strip_normalized_patterns(imported_rules)
+            return self.update_multiplier_rules(lambda rules: rules.update(imported_rules))
             
         except json.JSONDecodeError:
             st.error("❌ インポートデータの形式が正しくありません")
@@ -744,84 +767,58 @@ class SecureAuthSystem:
 auth_system = SecureAuthSystem()
 
 # ==== AI最適化エンジン ====
-class AIWarikanOptimizer:
-    def __init__(self):
-        self.default_params = {
-            '事業部長': 1.6, '部長': 1.4, '課長': 1.2, '主査': 1.1, '担当': 1.0
-        }
+MARUME_OPTIONS = [100, 500, 1000]
+
+CALC_METHODS = {
+    '厳密配分（最大剰余法）': 'exact',
+    'AI遺伝的アルゴリズム': 'genetic',
+    '公平性重視（最大偏差最小化）': 'minmax'
+}
+
+ROUNDING_OPTIONS = {
+    '最適配分（合計一致）': 'largest_remainder',
+    '四捨五入': 'half_up',
+    '切り上げ': 'ceil',
+    '切り捨て': 'floor',
+    '銀行丸め（偶数丸め）': 'bankers'
+}
+
+# 収束トレースの表示ラベル
+STOP_REASON_LABELS = {
+    'direct': '反復なし',
+    'converged': '収束（早期終了）',
+    'max_generations': '最大世代数に到達',
+    'bisection_converged': '二分探索が収束',
+    'cache_hit': 'キャッシュ',
+}
+PHASE_LABELS = {
+    'cache_lookup': 'キャッシュ照会',
+    'build': '比率計算',
+    'search': '探索',
+    'rounding': '丸め',
+    'bisection': '二分探索',
+    'distribution': '配分',
+}
+
+@st.cache_resource
+def get_result_cache() -> OptimizationResultCache:
+    """最適化結果キャッシュ（プロセス内で共有）"""
+    return OptimizationResultCache(maxsize=256)
+
+def make_progress_callback(min_interval: float = 0.1):
+    """最適化エンジン用の進捗コールバック（UI更新は min_interval 秒ごとに間引き）"""
+    progress_bar = st.progress(0)
+    status_text = st.empty()
     
-    def optimize_warikan(self, df_participants, total_amount, marume=500):
-        """AI遺伝的アルゴリズムによる最適化（自動倍率適用）"""
-        if df_participants.empty:
-            return None, None, None, None
-        
-        # カスタム倍率マネージャーを初期化
-        multiplier_manager = CustomMultiplierManager()
-        
-        best_params = self.default_params.copy()
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        
-        iterations = 25
-        
-        for iteration in range(iterations):
-            progress = (iteration + 1) / iterations
-            progress_bar.progress(progress)
-            status_text.text(f"🤖 AI最適化中... {iteration+1}/{iterations} 世代")
-            
-            df_calc = df_participants.copy()
-            
-            # 基本の役職比率を適用
-            df_calc['基本比率'] = df_calc['役職'].map(best_params)
-            
-            # 管理者設定のカスタム倍率を自動適用
-            df_calc['管理者設定倍率'] = df_calc['名前'].apply(
-                lambda name: multiplier_manager.find_matching_multiplier(name)
-            )
-            
-            # 参加者個別設定の倍率（既存機能との互換性）
-            df_calc['個別設定倍率'] = df_calc.get('カスタム倍率', 1.0)
-            
-            # 最終倍率 = 管理者設定倍率 × 個別設定倍率
-            df_calc['最終倍率'] = df_calc['管理者設定倍率'] * df_calc['個別設定倍率']
-            
-            # 最終比率 = 基本比率 × 最終倍率
-            df_calc['比率'] = df_calc['基本比率'] * df_calc['最終倍率']
-            
-            total_weight = df_calc['比率'].sum()
-            df_calc['負担額'] = df_calc['比率'] / total_weight * total_amount
-            df_calc['負担額_丸め'] = df_calc['負担額'].apply(
-                lambda x: marume * round(x / marume)
-            )
-            
-            sum_warikan = df_calc['負担額_丸め'].sum()
-            diff = sum_warikan - total_amount
-            
-            if abs(diff) <= marume:
-                progress_bar.progress(1.0)
-                status_text.success("✅ 最適解発見！")
-                break
-            
-            adjustment = 0.01 if abs(diff) > 1000 else 0.005
-            mutation_rate = 0.02
-            
-            if diff > 0:
-                for role in ['事業部長', '部長', '課長', '主査']:
-                    if role in best_params:
-                        best_params[role] *= (1 - adjustment)
-                        if random.random() < mutation_rate:
-                            best_params[role] *= random.uniform(0.95, 1.05)
-            else:
-                for role in ['事業部長', '部長', '課長', '主査']:
-                    if role in best_params:
-                        best_params[role] *= (1 + adjustment)
-                        if random.random() < mutation_rate:
-                            best_params[role] *= random.uniform(0.95, 1.05)
-        
+    def callback(step: int, total_steps: int, message: str):
+        progress_bar.progress(min(step / total_steps, 1.0))
+        status_text.text(message)
+    
+    def cleanup():
         progress_bar.empty()
         status_text.empty()
-        
-        return df_calc, sum_warikan, diff, best_params
+    
+    return throttle_progress(callback, min_interval), cleanup
 
 # ==== 可視化システム ====
 class AdvancedChartGenerator:
@@ -925,8 +922,8 @@ class AdvancedChartGenerator:
         return fig
 
 # ==== CSV出力機能 ====
-def generate_csv_output(df_result, total_amount, sum_warikan):
-    """CSV出力用データ生成"""
+def generate_csv_output(df_result, total_amount, sum_warikan, settlement=None):
+    """CSV出力用データ生成（settlement があれば精算内容の列を追加）"""
     csv_data = df_result.copy()
     csv_data['計算日時'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     csv_data['セッションID'] = st.session_state.session_id
@@ -934,6 +931,17 @@ def generate_csv_output(df_result, total_amount, sum_warikan):
     csv_data['計算後合計'] = sum_warikan
     csv_data['差額'] = sum_warikan - total_amount
     
+    if settlement is not None:
+        csv_data['支払額'] = settlement['paid']
+        csv_data['精算収支'] = settlement['balances']
+        
+        instructions: Dict[str, List[str]] = {}
+        for transfer in settlement['transfers']:
+            instructions.setdefault(transfer['支払者'], []).append(
+                f"{transfer['受取者']}へ{transfer['金額']:,}円"
+            )
+        csv_data['精算内容'] = [' / '.join(instructions.get(name, [])) for name in csv_data['名前']]
+    
     output = BytesIO()
     csv_data.to_csv(output, index=False, encoding='utf-8-sig')
     return output.getvalue()
@@ -948,7 +956,7 @@ def init_session_state():
         st.session_state.data_manager = None
     
     if 'participants' not in st.session_state:
-        st.session_state.participants = []
+        st.session_state.participants = ParticipantStore()
     
     if 'total_amount' not in st.session_state:
         st.session_state.total_amount = 10000
@@ -959,11 +967,25 @@ def init_session_state():
     if 'calculation_results' not in st.session_state:
         st.session_state.calculation_results = None
     
+    if 'participant_constraints' not in st.session_state:
+        st.session_state.participant_constraints = {}
+    
     if 'show_admin' not in st.session_state:
         st.session_state.show_admin = False
     
     if 'auto_save_enabled' not in st.session_state:
         st.session_state.auto_save_enabled = True
+    
+    if 'incremental_split' not in st.session_state:
+        st.session_state.incremental_split = None
+    
+    if 'ledger_receipts' not in st.session_state:
+        st.session_state.ledger_receipts = []
+        st.session_state.ledger_id = new_ledger_id()
+    
+    if 'large_group_store' not in st.session_state:
+        st.session_state.large_group_store = None
+        st.session_state.large_group_results = None
 
 # ==== 自動保存機能 ====
 def auto_save_session():
@@ -977,6 +999,32 @@ def auto_save_session():
         }
         st.session_state.data_manager.save_session_data(session_data)
 
+# ==== 増分再計算機能 ====
+def refresh_incremental_results():
+    """🔁 参加者の追加・削除・役職変更を増分計算で計算結果に反映"""
+    split = st.session_state.get('incremental_split')
+    results = st.session_state.calculation_results
+    if split is None or not results:
+        return
+    
+    # 参加者一覧と状態が一致しない場合は増分計算を打ち切り（再計算が必要）
+    if len(split) != len(st.session_state.participants):
+        st.session_state.incremental_split = None
+        return
+    
+    df_result = split.annotate(st.session_state.participants.to_frame())
+    sum_warikan = int(df_result['負担額_丸め'].sum())
+    results.update({
+        'df_result': df_result,
+        'sum_warikan': sum_warikan,
+        'diff': sum_warikan - split.total_amount,
+        'calculation_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    })
+
+def invalidate_incremental_results():
+    """参加者一覧を丸ごと置き換えた場合に増分計算の状態を破棄"""
+    st.session_state.incremental_split = None
+
 # ==== セッション復元機能 ====
 def show_session_restore():
     """🔄 セッション復元機能"""
@@ -1002,7 +1050,8 @@ def show_session_restore():
             
             with col_restore:
                 if st.button("🔄 前回の作業を復元", use_container_width=True, type="primary"):
-                    st.session_state.participants = saved_session.get('participants', [])
+                    st.session_state.participants = ParticipantStore.coerce(saved_session.get('participants')).copy()
+                    invalidate_incremental_results()
                     st.session_state.total_amount = saved_session.get('total_amount', 10000)
                     st.session_state.session_id = saved_session.get('session_id', st.session_state.session_id)
                     if saved_session.get('calculation_results'):
@@ -1185,8 +1234,8 @@ def show_template_management():
                 )
                 
                 st.markdown("**保存対象参加者:**")
-                for participant in st.session_state.participants:
-                    st.write(f"• {participant['名前']} ({participant['役職']})")
+                for name, role in zip(st.session_state.participants.names, st.session_state.participants.roles):
+                    st.write(f"• {name} ({role})")
                 
                 save_template_btn = st.form_submit_button("💾 テンプレート保存", use_container_width=True)
                 
@@ -1216,7 +1265,7 @@ def show_template_management():
                         <strong>📁 {template_name}</strong><br>
                         <small>👥 {len(template_data['participants'])}人 | 
                         📅 {template_data['created_at'][:10]}</small><br>
-                        <small>参加者: {', '.join([p['名前'] for p in template_data['participants'][:3]])}
+                        <small>参加者: {', '.join(ParticipantStore.coerce(template_data['participants']).names[:3])}
                         {'...' if len(template_data['participants']) > 3 else ''}</small>
                     </div>
                     """, unsafe_allow_html=True)
@@ -1225,7 +1274,8 @@ def show_template_management():
                     
                     with col_load:
                         if st.button(f"📥 読み込み", key=f"load_template_{template_name}", use_container_width=True):
-                            st.session_state.participants = template_data['participants'].copy()
+                            st.session_state.participants = ParticipantStore.coerce(template_data['participants']).copy()
+                            invalidate_incremental_results()
                             st.success(f"✅ テンプレート「{template_name}」を読み込みました")
                             auto_save_session()
                             st.rerun()
@@ -1240,6 +1290,34 @@ def show_template_management():
             st.info("📝 保存済みテンプレートがありません")
 
 # ==== 履歴管理機能 ====
+def replay_calculation(history_item: Dict) -> bool:
+    """履歴に記録された計算条件で再計算し、記録と一致するかを返す"""
+    replay = history_item['replay']
+    recorded = pd.DataFrame(history_item['results'])
+    
+    df_participants = ParticipantStore.coerce(history_item['participants']).to_frame()
+    if replay.get('constraints') is not None:
+        for column in ['固定額', '上限', '下限', '免除']:
+            df_participants[column] = [
+                replay['constraints'].get(name, {}).get(column) for name in df_participants['名前']
+            ]
+        df_participants['免除'] = df_participants['免除'].fillna(False).astype(bool)
+    
+    # 倍率は記録時点の値を使う（その後のルール変更の影響を受けない）
+    optimizer = AIWarikanOptimizer(role_params=replay['role_params'])
+    df_result, _, _, _ = optimizer.optimize_warikan(
+        df_participants, history_item['total_amount'], replay['marume'],
+        admin_multipliers=recorded['管理者設定倍率'].to_numpy(dtype=float),
+        method=replay['method'],
+        rounding=replay['rounding'],
+        **replay['options']
+    )
+    
+    return bool(np.array_equal(
+        df_result['負担額_丸め'].to_numpy(dtype=np.int64),
+        recorded['負担額_丸め'].to_numpy(dtype=np.int64)
+    ))
+
 def show_calculation_history():
     """💾 計算履歴管理機能"""
     st.subheader("📊 計算履歴")
@@ -1265,13 +1343,13 @@ def show_calculation_history():
                 </div>
                 """, unsafe_allow_html=True)
                 
-                col_detail, col_restore, col_delete = st.columns([2, 1, 1])
+                col_detail, col_restore, col_replay, col_delete = st.columns([2, 1, 1, 1])
                 
                 with col_detail:
                     with st.expander("📋 詳細を見る"):
                         # 参加者情報
                         st.markdown("**👥 参加者:**")
-                        participants_df = pd.DataFrame(history_item['participants'])
+                        participants_df = ParticipantStore.coerce(history_item['participants']).to_frame()
                         st.dataframe(participants_df[['名前', '役職']], hide_index=True)
                         
                         # 計算結果
@@ -1287,7 +1365,8 @@ def show_calculation_history():
                 with col_restore:
                     if st.button("🔄 復元", key=f"restore_history_{history_item['id']}", use_container_width=True):
                         # 参加者と設定を復元
-                        st.session_state.participants = history_item['participants'].copy()
+                        st.session_state.participants = ParticipantStore.coerce(history_item['participants']).copy()
+                        invalidate_incremental_results()
                         st.session_state.total_amount = history_item['total_amount']
                         
                         # 計算結果も復元（もしあれば）
@@ -1296,6 +1375,10 @@ def show_calculation_history():
                                 'df_result': pd.DataFrame(history_item['results']) if history_item['results'] else None,
                                 'sum_warikan': history_item['sum_warikan'],
                                 'diff': history_item['diff'],
+                                'replay': history_item.get('replay'),
+                                'trace': history_item.get('trace'),
+                                'total_amount': history_item['total_amount'],
+                                'calculation_id': history_item['id'],
                                 'calculation_time': history_item['calculation_time'],
                                 'calculator': history_item['calculator']
                             }
@@ -1304,6 +1387,19 @@ def show_calculation_history():
                         st.success("✅ 履歴から復元しました")
                         st.rerun()
                 
+                with col_replay:
+                    if st.button("🔁 再現", key=f"replay_history_{history_item['id']}",
+                                 disabled=not history_item.get('replay') or not history_item.get('results'),
+                                 help="記録された計算条件で再計算し、結果が一致するか確認します",
+                                 use_container_width=True):
+                        try:
+                            if replay_calculation(history_item):
+                                st.success("✅ 記録と完全に一致しました")
+                            else:
+                                st.warning("⚠️ 記録と異なる結果になりました")
+                        except ValueError as e:
+                            st.error(f"❌ 再現エラー: {str(e)}")
+                
                 with col_delete:
                     if st.button("🗑️", key=f"delete_history_{history_item['id']}", help="履歴削除"):
                         success = data_manager.delete_history_item(history_item['id'])
@@ -1313,6 +1409,270 @@ def show_calculation_history():
     else:
         st.info("📝 計算履歴がありません")
 
+def new_ledger_id() -> str:
+    """会計台帳の記録元ID（台帳をクリアするまで固定）"""
+    return f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{random.randint(1000,9999)}"
+
+def show_event_ledger(marume_unit: int, role_params: Optional[Dict[str, float]] = None):
+    """🧾 複数レシートの会計台帳（1次会・2次会・タクシー代など）"""
+    st.subheader("🧾 会計台帳")
+    st.caption("支払者と対象者が異なる複数のレシートをまとめて精算します")
+    
+    participants = st.session_state.participants
+    if not participants:
+        st.warning("⚠️ 先に参加者を追加してください")
+        return
+    
+    names = participants.names.tolist()
+    
+    # レシート追加フォーム
+    with st.form("add_receipt_form"):
+        col_label, col_payer, col_amount = st.columns([2, 1, 1])
+        
+        with col_label:
+            receipt_label = st.text_input("🧾 明細", placeholder="例: 1次会")
+        
+        with col_payer:
+            receipt_payer = st.selectbox("💳 支払者", options=names)
+        
+        with col_amount:
+            receipt_amount = st.number_input("💰 金額（円）", min_value=1, max_value=10000000, value=10000, step=100)
+        
+        receipt_members = st.multiselect("👥 対象者", options=names, default=names)
+        
+        if st.form_submit_button("➕ レシート追加", use_container_width=True):
+            if receipt_members:
+                st.session_state.ledger_receipts.append({
+                    '明細': receipt_label or f"レシート{len(st.session_state.ledger_receipts) + 1}",
+                    '支払者': receipt_payer,
+                    '金額': int(receipt_amount),
+                    '対象者': receipt_members
+                })
+                st.rerun()
+            else:
+                st.warning("⚠️ 対象者を1人以上選択してください")
+    
+    if not st.session_state.ledger_receipts:
+        st.info("📝 レシートがまだありません")
+        return
+    
+    # 現在の参加者で台帳を構築（削除済みの参加者は対象外）
+    multipliers = CustomMultiplierManager().resolve_multipliers(names) * participants.multipliers
+    ledger = EventLedger(names, participants.roles.tolist(), multipliers, marume_unit, role_params)
+    
+    for receipt in st.session_state.ledger_receipts:
+        members = [name for name in receipt['対象者'] if name in ledger]
+        if receipt['支払者'] not in ledger or not members:
+            st.warning(f"⚠️ {receipt['明細']}: 支払者または対象者が参加者にいないためスキップしました")
+            continue
+        ledger.add_receipt(receipt['明細'], receipt['支払者'], receipt['金額'], members)
+    
+    if len(ledger) == 0:
+        return
+    
+    result = ledger.compute()
+    
+    st.markdown("**🧾 レシート一覧**")
+    st.dataframe(
+        ledger.receipts_frame(result).style.format({'金額': '{:,}円'}),
+        hide_index=True,
+        use_container_width=True
+    )
+    
+    col_reset, _ = st.columns([1, 3])
+    with col_reset:
+        if st.button("🗑️ 台帳をクリア", use_container_width=True):
+            st.session_state.ledger_receipts = []
+            st.session_state.ledger_id = new_ledger_id()
+            st.rerun()
+    
+    col_balance, col_transfer = st.columns(2)
+    
+    with col_balance:
+        st.markdown("**⚖️ 参加者別の収支**")
+        st.dataframe(
+            ledger.to_frame(result).style.format({'支払額': '{:,}円', '負担額': '{:,}円', '収支': '{:+,}円'}),
+            hide_index=True,
+            use_container_width=True
+        )
+    
+    with col_transfer:
+        st.markdown("**💸 精算プラン**")
+        if result['transfers']:
+            st.dataframe(
+                pd.DataFrame(result['transfers']).style.format({'金額': '{:,}円'}),
+                hide_index=True,
+                use_container_width=True
+            )
+            st.caption(f"送金回数: {len(result['transfers'])}回")
+        else:
+            st.success("✅ 精算の必要はありません")
+    
+    if result['transfers']:
+        # 台帳ごとに固定の記録元ID（レシート追加後の再記録は差分のみ加算）
+        season_source_id = f"ledger_{st.session_state.ledger_id}"
+        season_ledger = st.session_state.data_manager.load_season_ledger()
+        if not season_ledger.pending_changes(season_source_id, names, result['balances']):
+            st.caption("📒 この台帳はシーズン台帳に記録済みです")
+        elif st.button("📒 シーズン台帳に記録", key="record_season_ledger",
+                       help="記録済みの場合は、前回の記録からの変更分だけを加算します"):
+            label = " / ".join(receipt['明細'] for receipt in st.session_state.ledger_receipts)
+            if st.session_state.data_manager.record_season_event(season_source_id, names, result['balances'], label):
+                st.success("✅ シーズン台帳に記録しました")
+                st.rerun()
+
+def show_season_ledger():
+    """📒 シーズン通算の収支と精算"""
+    data_manager = st.session_state.data_manager
+    season_ledger = data_manager.load_season_ledger()
+    
+    st.subheader(f"📒 シーズン台帳（{season_ledger.name}）")
+    
+    _, backend_error = get_season_backend()
+    if backend_error:
+        st.warning(f"⚠️ データベースを開けないため、シーズン台帳はこのセッション内のみで保持されます: {backend_error}")
+    
+    if len(season_ledger) == 0:
+        st.info("📝 シーズン台帳に記録されたイベントはありません（結果分析・会計台帳から記録できます）")
+        return
+    
+    col_events, col_members = st.columns(2)
+    with col_events:
+        st.metric("🗓️ 記録イベント数", len(season_ledger))
+    with col_members:
+        st.metric("👥 メンバー数", len(season_ledger.balances))
+    
+    # 任意時点の残高照会
+    query_date = st.date_input("📅 時点を指定して残高を表示", value=datetime.now().date(), key="season_query_date")
+    at = datetime.combine(query_date, datetime.max.time()).isoformat()
+    
+    st.dataframe(
+        season_ledger.to_frame(at).style.format({'累計収支': '{:+,}円'}),
+        hide_index=True,
+        use_container_width=True
+    )
+    
+    with st.expander("🗓️ 記録済みイベント"):
+        events_df = pd.DataFrame(season_ledger.events)[['timestamp', 'label', 'members', 'volume']]
+        events_df.columns = ['記録日時', '内容', '人数', '精算額']
+        st.dataframe(events_df, hide_index=True, use_container_width=True)
+    
+    transfers = season_ledger.settlement()
+    if transfers:
+        st.markdown("**💸 シーズン精算プラン**")
+        st.dataframe(
+            pd.DataFrame(transfers).style.format({'金額': '{:,}円'}),
+            hide_index=True,
+            use_container_width=True
+        )
+        
+        if st.button("🏁 シーズンを締める", help="現在の精算プランを確定し、新しいシーズンを開始します"):
+            st.session_state.closed_season_transfers = data_manager.close_season()
+            st.rerun()
+    else:
+        st.success("✅ シーズン内の収支はすべて精算済みです")
+
+# ==== 大人数モード ====
+LARGE_GROUP_PAGE_SIZE = 100
+
+def show_large_group_mode(user: Dict, marume_unit: int, rounding_mode: str,
+                          role_params: Optional[Dict[str, float]] = None):
+    """🏢 大人数モード（列指向ストア + 配列のみの最適化 + ページ表示）"""
+    st.subheader("🏢 大人数モード")
+    st.caption("参加者は列指向の配列で保持し、表示は1ページずつ行います")
+    
+    # CSV取り込み
+    if "create" in user['permissions']:
+        uploaded = st.file_uploader(
+            "📤 参加者CSVを取り込み（列: 名前, 役職, カスタム倍率（任意））",
+            type=['csv'],
+            key="large_group_csv"
+        )
+        if uploaded is not None and st.button("📥 取り込み", use_container_width=True):
+            try:
+                st.session_state.large_group_store = ParticipantStore.from_csv(uploaded)
+                st.session_state.large_group_results = None
+                st.success(f"✅ {len(st.session_state.large_group_store):,}人を取り込みました")
+            except ValueError as e:
+                st.error(f"❌ 取り込みエラー: {str(e)}")
+    
+    store = st.session_state.large_group_store
+    if store is None or len(store) == 0:
+        st.info("📝 参加者CSVを取り込んでください")
+        return
+    
+    # 役職別の人数
+    role_counts = store.role_counts()
+    role_columns = st.columns(len(role_counts) + 1)
+    role_columns[0].metric("👥 参加者数", f"{len(store):,}")
+    for column, (role, count) in zip(role_columns[1:], role_counts.items()):
+        column.metric(role, f"{count:,}")
+    
+    total_amount = st.number_input(
+        "💰 合計金額（円）",
+        min_value=100,
+        max_value=10_000_000_000,
+        value=max(len(store) * 5000, 100),
+        step=10000,
+        key="large_group_total"
+    )
+    
+    if "calculate" in user['permissions']:
+        if st.button("🤖 一括計算", type="primary", use_container_width=True):
+            start = time.perf_counter()
+            multipliers = CustomMultiplierManager().resolve_multipliers(store.names) * store.multipliers
+            try:
+                result = AIWarikanOptimizer(role_params=role_params).optimize_columns(
+                    store.role_codes, multipliers, total_amount, marume_unit, rounding_mode
+                )
+                result['elapsed'] = time.perf_counter() - start
+                result['total_amount'] = total_amount
+                st.session_state.large_group_results = result
+            except ValueError as e:
+                st.error(f"❌ 計算エラー: {str(e)}")
+    else:
+        st.error("❌ 計算権限がありません")
+    
+    results = st.session_state.large_group_results
+    if results is not None and len(results['amounts']) != len(store):
+        results = None
+    
+    if results is not None:
+        col_sum, col_diff, col_time = st.columns(3)
+        col_sum.metric("💰 計算後合計", f"{results['sum_warikan']:,}円")
+        col_diff.metric("📊 差額", f"{results['diff']:+,}円")
+        col_time.metric("⏱️ 計算時間", f"{results['elapsed'] * 1000:.0f}ms")
+        
+        # 役職別の平均負担額（配列から直接集計）
+        counts = np.bincount(store.role_codes, minlength=len(role_counts))
+        sums = np.bincount(store.role_codes, weights=results['amounts'], minlength=len(role_counts))
+        st.dataframe(pd.DataFrame({
+            '役職': list(role_counts.keys()),
+            '人数': counts,
+            '平均負担額': np.divide(sums, counts, out=np.zeros(len(counts)), where=counts > 0).round(0),
+            '合計負担額': sums.astype(np.int64)
+        }), hide_index=True, use_container_width=True)
+    
+    # ページ表示
+    n_pages = (len(store) - 1) // LARGE_GROUP_PAGE_SIZE + 1
+    page = st.number_input(f"📄 ページ（全{n_pages:,}ページ）", min_value=1, max_value=n_pages, value=1, step=1)
+    extra_columns = {'負担額_丸め': results['amounts']} if results is not None else None
+    st.dataframe(
+        store.page(page - 1, LARGE_GROUP_PAGE_SIZE, extra_columns),
+        use_container_width=True
+    )
+    
+    if results is not None and "export" in user['permissions']:
+        output = BytesIO()
+        store.to_frame(extra_columns=extra_columns).to_csv(output, index=False, encoding='utf-8-sig')
+        st.download_button(
+            label="📥 CSV形式でダウンロード",
+            data=output.getvalue(),
+            file_name=f"warikan_large_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+            mime="text/csv",
+            use_container_width=True
+        )
+
 # ==== 不足している機能の追加パッチ ====
 
 # 1. ユーザー詳細表示機能
@@ -1763,7 +2123,7 @@ def show_custom_multiplier_management():
     ✅ 役職によらず優先適用<br>
     ✅ 管理者のみ設定可能<br>
     ✅ <strong>全ユーザーに適用</strong><br>
-    ✅ <strong>アプリ実行中は永続</strong>
+    ✅ <strong>SQLiteに保存（再起動後も保持）</strong>
     </div>
     """, unsafe_allow_html=True)
     
@@ -1786,9 +2146,12 @@ def show_custom_multiplier_management():
                 
                 st.info(f"📊 保存ルール数: {storage_info['rules_count']}個")
                 st.info(f"💾 ストレージ方式: {storage_info['storage_type']}")
+                if storage_info.get('backend_error'):
+                    st.warning(f"⚠️ データベースを開けないためメモリのみで保持中: {storage_info['backend_error']}")
             
             with col_info2:
                 st.info(f"⏱️ 永続性: {storage_info['persistence_level']}")
+                st.info(f"🔖 ルールバージョン: v{storage_info['version']}")
                 
                 if 'last_updated' in storage_info:
                     st.info(f"🕒 最終更新: {storage_info['last_updated'][:16]}")
@@ -1801,8 +2164,8 @@ def show_custom_multiplier_management():
     st.markdown("""
     <div style="background: linear-gradient(135deg, #fff3cd 0%, #ffeaa7 100%); border: 1px solid #ffeaa7; border-radius: 10px; padding: 1rem; margin: 1rem 0;">
     <strong>📋 Streamlit Cloud使用時の注意:</strong><br>
-    • ルールは<strong>アプリ実行中のみ保持</strong>されます<br>
-    • アプリが再起動すると<strong>ルールはリセット</strong>されます<br>
+    • ルールはSQLiteファイル（環境変数 WARIKAN_RULES_DB で変更可能）に保存されます<br>
+    • コンテナが再作成されると<strong>ファイルごとリセット</strong>される場合があります<br>
     • 重要なルールは<strong>エクスポート機能で保存</strong>してください<br>
     • 定期的に<strong>バックアップを取得</strong>することをお勧めします
     </div>
@@ -1854,8 +2217,7 @@ def show_custom_multiplier_management():
             name_patterns = [pattern.strip() for pattern in name_patterns_input.split(',')]
             
             # 新しいルールを作成
-            rules = multiplier_manager.load_multiplier_rules()
-            rules[rule_name] = {
+            new_rule = {
                 'name_patterns': name_patterns,
                 'multiplier': multiplier,
                 'reason': reason,
@@ -1863,9 +2225,12 @@ def show_custom_multiplier_management():
                 'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             }
             
-            if multiplier_manager.save_multiplier_rules(rules):
+            if multiplier_manager.update_multiplier_rules(lambda rules: rules.update({rule_name: new_rule})):
                 st.success(f"✅ ルール「{rule_name}」をグローバル保存しました")
-                st.info("💡 このルールは全ユーザーに適用されます（アプリ実行中）")
+                if multiplier_manager.store.backend is not None:
+                    st.info("💡 このルールは全ユーザーに適用され、データベースに保存されます（再起動後も保持）")
+                else:
+                    st.info("💡 このルールは全ユーザーに適用されます（データベースを開けないため、アプリ実行中のみ保持）")
                 st.rerun()
             else:
                 st.error("❌ ルール追加に失敗しました")
@@ -2116,7 +2481,7 @@ def show_custom_multiplier_management():
     ✅ 役職によらず優先適用<br>
     ✅ 管理者のみ設定可能<br>
     ✅ <strong>全ユーザーに適用</strong><br>
-    ✅ <strong>アプリ実行中は永続</strong>
+    ✅ <strong>SQLiteに保存（再起動後も保持）</strong>
     </div>
     """, unsafe_allow_html=True)
     
@@ -2139,9 +2504,12 @@ def show_custom_multiplier_management():
                 
                 st.info(f"📊 保存ルール数: {storage_info['rules_count']}個")
                 st.info(f"💾 ストレージ方式: {storage_info['storage_type']}")
+                if storage_info.get('backend_error'):
+                    st.warning(f"⚠️ データベースを開けないためメモリのみで保持中: {storage_info['backend_error']}")
             
             with col_info2:
                 st.info(f"⏱️ 永続性: {storage_info['persistence_level']}")
+                st.info(f"🔖 ルールバージョン: v{storage_info['version']}")
                 
                 if 'last_updated' in storage_info:
                     st.info(f"🕒 最終更新: {storage_info['last_updated'][:16]}")
@@ -2150,12 +2518,21 @@ def show_custom_multiplier_management():
     except Exception as e:
         st.error(f"ストレージ情報表示エラー: {str(e)}")
     
+    # 名前正規化キャッシュの状況
+    st.markdown("#### ⚡ 名前正規化キャッシュ")
+    cache_stats = normalization_cache_stats()
+    col_hits, col_misses, col_rate, col_size = st.columns(4)
+    col_hits.metric("ヒット", f"{cache_stats['hits']:,}")
+    col_misses.metric("ミス", f"{cache_stats['misses']:,}")
+    col_rate.metric("ヒット率", f"{cache_stats['hit_rate']:.1%}")
+    col_size.metric("保持件数", f"{cache_stats['size']:,}/{cache_stats['maxsize']:,}")
+    
     # Streamlit Cloud使用時の注意事項
     st.markdown("""
     <div style="background: linear-gradient(135deg, #fff3cd 0%, #ffeaa7 100%); border: 1px solid #ffeaa7; border-radius: 10px; padding: 1rem; margin: 1rem 0;">
     <strong>📋 Streamlit Cloud使用時の注意:</strong><br>
-    • ルールは<strong>アプリ実行中のみ保持</strong>されます<br>
-    • アプリが再起動すると<strong>ルールはリセット</strong>されます<br>
+    • ルールはSQLiteファイル（環境変数 WARIKAN_RULES_DB で変更可能）に保存されます<br>
+    • コンテナが再作成されると<strong>ファイルごとリセット</strong>される場合があります<br>
     • 重要なルールは<strong>エクスポート機能で保存</strong>してください<br>
     • 定期的に<strong>バックアップを取得</strong>することをお勧めします
     </div>
@@ -2207,8 +2584,7 @@ def show_custom_multiplier_management():
             name_patterns = [pattern.strip() for pattern in name_patterns_input.split(',')]
             
             # 新しいルールを作成
-            rules = multiplier_manager.load_multiplier_rules()
-            rules[rule_name] = {
+            new_rule = {
                 'name_patterns': name_patterns,
                 'multiplier': multiplier,
                 'reason': reason,
@@ -2216,9 +2592,12 @@ def show_custom_multiplier_management():
                 'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             }
             
-            if multiplier_manager.save_multiplier_rules(rules):
+            if multiplier_manager.update_multiplier_rules(lambda rules: rules.update({rule_name: new_rule})):
                 st.success(f"✅ ルール「{rule_name}」をグローバル保存しました")
-                st.info("💡 このルールは全ユーザーに適用されます（アプリ実行中）")
+                if multiplier_manager.store.backend is not None:
+                    st.info("💡 このルールは全ユーザーに適用され、データベースに保存されます（再起動後も保持）")
+                else:
+                    st.info("💡 このルールは全ユーザーに適用されます（データベースを開けないため、アプリ実行中のみ保持）")
                 st.rerun()
             else:
                 st.error("❌ ルール追加に失敗しました")
@@ -2390,11 +2769,56 @@ def main():
         
         marume_unit = st.selectbox(
             "🔢 丸め単位（円）",
-            options=[100, 500, 1000],
+            options=MARUME_OPTIONS,
             index=1,
             help="支払い金額を丸める単位"
         )
         
+        calc_method_label = st.selectbox(
+            "🧬 計算モード",
+            options=list(CALC_METHODS.keys()),
+            index=0,
+            help="厳密配分は合計金額に必ず一致、遺伝的アルゴリズムは役職比率を調整して各人を個別に丸めます"
+        )
+        calc_method = CALC_METHODS[calc_method_label]
+        
+        rounding_label = st.selectbox(
+            "✂️ 端数処理",
+            options=list(ROUNDING_OPTIONS.keys()),
+            index=0,
+            help="最適配分は合計金額に必ず一致します。その他は各人を個別に丸めるため差額が出ることがあります"
+        )
+        rounding_mode = ROUNDING_OPTIONS[rounding_label]
+        
+        # 履歴から学習した役職比率
+        learned_params = None
+        if st.session_state.data_manager:
+            estimator = st.session_state.data_manager.load_role_weight_estimator()
+            use_learned = st.checkbox(
+                "📚 履歴から学習した役職比率を使う",
+                value=False,
+                disabled=estimator.n_events == 0,
+                help=f"過去の計算 {estimator.n_events}件（{estimator.n_observations}人分）から推定"
+            )
+            if use_learned:
+                learned_params = estimator.propose()
+                st.caption(" / ".join(f"{role} {ratio:.2f}" for role, ratio in learned_params.items()))
+        
+        large_group_mode = st.checkbox(
+            "🏢 大人数モード",
+            key="large_group_mode",
+            help="数千〜数万人規模のイベント向け。参加者はCSVで取り込み、厳密配分で一括計算します"
+        )
+        
+        genetic_options = {}
+        if calc_method == 'genetic':
+            with st.expander("🧬 遺伝的アルゴリズム設定"):
+                genetic_options['population_size'] = st.slider("👥 集団サイズ", 8, 256, 64, step=8)
+                genetic_options['generations'] = st.slider("🔁 最大世代数", 5, 200, 50, step=5)
+                genetic_options['patience'] = st.slider("⏹️ 早期終了（改善なし世代数）", 1, 50, 10)
+                if st.checkbox("🎲 乱数シードを固定", value=False, help="同じシードなら同じ入力に対して常に同じ結果になります"):
+                    genetic_options['seed'] = int(st.number_input("シード値", min_value=0, max_value=2**32 - 1, value=42, step=1))
+        
         # Pro機能設定
         st.subheader("✨ Pro機能設定")
         
@@ -2441,8 +2865,9 @@ def main():
             st.session_state.authenticated = False
             st.session_state.user = None
             st.session_state.git_status = None
-            st.session_state.participants = []
+            st.session_state.participants = ParticipantStore()
             st.session_state.calculation_results = None
+            st.session_state.incremental_split = None
             st.success("✅ ログアウトしました")
             time.sleep(1)
             st.rerun()
@@ -2452,12 +2877,18 @@ def main():
         show_admin_dashboard()
         return
     
+    # 大人数モード（参加者ごとのウィジェットを作らない専用画面）
+    if large_group_mode:
+        show_large_group_mode(user, marume_unit, rounding_mode, learned_params)
+        return
+    
     # メインコンテンツ
-    tab1, tab2, tab3, tab4, tab5 = st.tabs([
+    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs([
         "👥 参加者管理", 
         "📁 テンプレート", 
         "🧮 AI計算", 
         "📊 結果分析", 
+        "🧾 会計台帳", 
         "📈 履歴"
     ])
     
@@ -2492,13 +2923,12 @@ def main():
                 if add_button and new_name:
                     if "create" in user['permissions']:
                         # 重複チェック
-                        if not any(p['名前'] == new_name for p in st.session_state.participants):
-                            st.session_state.participants.append({
-                                '名前': new_name,
-                                '役職': new_role,
-                                '追加日時': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                                '追加者': user['display_name']
-                            })
+                        if new_name not in st.session_state.participants:
+                            st.session_state.participants.append(new_name, new_role, added_by=user['display_name'])
+                            split = st.session_state.incremental_split
+                            if split is not None:
+                                split.add(new_name, new_role, CustomMultiplierManager().find_matching_multiplier(new_name))
+                                refresh_incremental_results()
                             st.success(f"✅ {new_name}さん（{new_role}）を追加しました")
                             auto_save_session()  # 自動保存
                             st.rerun()
@@ -2516,7 +2946,8 @@ def main():
         if st.session_state.participants:
             st.subheader("📋 参加者一覧")
             
-            for i, participant in enumerate(st.session_state.participants):
+            for i in range(len(st.session_state.participants)):
+                participant = st.session_state.participants.record(i)
                 col_info, col_delete = st.columns([4, 1])
                 
                 with col_info:
@@ -2529,10 +2960,45 @@ def main():
                 with col_delete:
                     if "create" in user['permissions']:
                         if st.button("🗑️", key=f"delete_{i}", help=f"{participant['名前']}さんを削除"):
-                            st.session_state.participants.pop(i)
+                            st.session_state.participants.remove(i)
+                            split = st.session_state.incremental_split
+                            if split is not None and participant['名前'] in split:
+                                split.remove(participant['名前'])
+                                refresh_incremental_results()
                             st.success(f"✅ {participant['名前']}さんを削除しました")
                             auto_save_session()
                             st.rerun()
+            
+            # 役職変更
+            if "create" in user['permissions']:
+                with st.form("change_role_form"):
+                    col_target, col_new_role, col_change = st.columns([2, 1, 1])
+                    
+                    with col_target:
+                        target_name = st.selectbox(
+                            "👤 対象者",
+                            options=st.session_state.participants.names.tolist()
+                        )
+                    
+                    with col_new_role:
+                        changed_role = st.selectbox(
+                            "💼 新しい役職",
+                            options=['担当', '主査', '課長', '部長', '事業部長']
+                        )
+                    
+                    with col_change:
+                        change_button = st.form_submit_button("🔁 役職変更", use_container_width=True)
+                    
+                    if change_button:
+                        participants = st.session_state.participants
+                        participants.set_role(participants.index_of(target_name), changed_role)
+                        split = st.session_state.incremental_split
+                        if split is not None and target_name in split:
+                            split.change_role(target_name, changed_role)
+                            refresh_incremental_results()
+                        st.success(f"✅ {target_name}さんの役職を{changed_role}に変更しました")
+                        auto_save_session()
+                        st.rerun()
         else:
             st.info("👆 まずは参加者を追加してください")
     
@@ -2544,167 +3010,453 @@ def main():
     with tab3:
         st.subheader("🧮 AI遺伝的アルゴリズム計算")
         
-        # 権限チェック
+        # 権限チェック（他のタブは表示を続けるため return しない）
         if "calculate" not in user['permissions']:
             st.error("❌ 計算権限がありません")
-            return
-        
-        if not st.session_state.participants:
+        elif not st.session_state.participants:
             st.warning("⚠️ 参加者を先に追加してください")
-            return
-        
-        # 計算設定
-        col_calc1, col_calc2, col_calc3 = st.columns(3)
-        
-        with col_calc1:
-            st.metric("💰 合計金額", f"{total_amount:,}円")
-        
-        with col_calc2:
-            st.metric("👥 参加者数", len(st.session_state.participants))
-        
-        with col_calc3:
-            avg_amount = total_amount / len(st.session_state.participants)
-            st.metric("📊 平均負担額", f"{avg_amount:,.0f}円")
+        else:
+            # 計算設定
+            col_calc1, col_calc2, col_calc3 = st.columns(3)
+        
+            with col_calc1:
+                st.metric("💰 合計金額", f"{total_amount:,}円")
+        
+            with col_calc2:
+                st.metric("👥 参加者数", len(st.session_state.participants))
+        
+            with col_calc3:
+                avg_amount = total_amount / len(st.session_state.participants)
+                st.metric("📊 平均負担額", f"{avg_amount:,.0f}円")
+        
+            # 参加者別制約（公平性重視モード）
+            if calc_method == 'minmax':
+                st.markdown("#### 🎯 参加者別の制約")
+                st.caption("固定額・上限・下限は円単位（空欄は制約なし）。免除の人は負担0円になります（主賓など）")
+            
+                constraints = st.session_state.participant_constraints
+                df_constraints = pd.DataFrame([
+                    {
+                        '名前': name,
+                        '固定額': constraints.get(name, {}).get('固定額'),
+                        '上限': constraints.get(name, {}).get('上限'),
+                        '下限': constraints.get(name, {}).get('下限'),
+                        '免除': constraints.get(name, {}).get('免除', False)
+                    }
+                    for name in st.session_state.participants.names
+                ])
+                edited_constraints = st.data_editor(
+                    df_constraints,
+                    disabled=['名前'],
+                    hide_index=True,
+                    use_container_width=True,
+                    column_config={
+                        '固定額': st.column_config.NumberColumn(min_value=0, step=100),
+                        '上限': st.column_config.NumberColumn(min_value=0, step=100),
+                        '下限': st.column_config.NumberColumn(min_value=0, step=100),
+                        '免除': st.column_config.CheckboxColumn()
+                    },
+                    key="constraint_editor"
+                )
+                st.session_state.participant_constraints = {
+                    row['名前']: {
+                        '固定額': None if pd.isna(row['固定額']) else row['固定額'],
+                        '上限': None if pd.isna(row['上限']) else row['上限'],
+                        '下限': None if pd.isna(row['下限']) else row['下限'],
+                        '免除': bool(row['免除'])
+                    }
+                    for row in edited_constraints.to_dict('records')
+                }
         
-        # AI計算実行
-        if st.button("🤖 AI最適化実行", type="primary", use_container_width=True):
-            with st.spinner("AI遺伝的アルゴリズムで最適化中..."):
-                # データフレーム作成
-                df_participants = pd.DataFrame(st.session_state.participants)
+            # AI計算実行
+            if st.button("🤖 AI最適化実行", type="primary", use_container_width=True):
+                with st.spinner("AI遺伝的アルゴリズムで最適化中..."):
+                    # データフレーム作成
+                    df_participants = st.session_state.participants.to_frame()
                 
-                # AI最適化実行
-                optimizer = AIWarikanOptimizer()
-                df_result, sum_warikan, diff, best_params = optimizer.optimize_warikan(
-                    df_participants, total_amount, marume_unit
-                )
+                    if calc_method == 'minmax':
+                        constraints = st.session_state.participant_constraints
+                        for column in ['固定額', '上限', '下限', '免除']:
+                            df_participants[column] = [
+                                constraints.get(name, {}).get(column) for name in df_participants['名前']
+                            ]
+                        df_participants['免除'] = df_participants['免除'].fillna(False).astype(bool)
                 
-                if df_result is not None:
-                    # 結果保存
-                    st.session_state.calculation_results = {
-                        'df_result': df_result,
-                        'sum_warikan': sum_warikan,
-                        'diff': diff,
-                        'best_params': best_params,
-                        'calculation_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                        'calculator': user['display_name']
-                    }
+                    # 遺伝的アルゴリズムは毎回シードを決めて記録（履歴から同じ結果を再現できる）
+                    run_options = dict(genetic_options)
+                    if calc_method == 'genetic' and run_options.get('seed') is None:
+                        run_options['seed'] = random.randrange(2**32)
+                
+                    # AI最適化実行
+                    optimizer = AIWarikanOptimizer(role_params=learned_params)
+                    multiplier_manager = CustomMultiplierManager()
+                    progress_callback, clear_progress = make_progress_callback()
+                    trace = OptimizationTrace()
+                    try:
+                        df_result, sum_warikan, diff, best_params = optimizer.optimize_warikan(
+                            df_participants, total_amount, marume_unit,
+                            admin_multipliers=multiplier_manager.resolve_multipliers(df_participants['名前']),
+                            progress_callback=progress_callback,
+                            method=calc_method,
+                            rounding=rounding_mode,
+                            cache=get_result_cache(),
+                            rules_version=multiplier_manager.get_snapshot().version,
+                            trace=trace,
+                            **run_options
+                        )
+                    except ValueError as e:
+                        st.error(f"❌ 計算エラー: {str(e)}")
+                        df_result = None
+                    finally:
+                        clear_progress()
+                
+                    if df_result is not None:
+                        # 厳密配分の結果は参加者の増減に合わせて増分更新できる
+                        if calc_method == 'exact' and rounding_mode == 'largest_remainder':
+                            st.session_state.incremental_split = IncrementalWarikan.from_frame(
+                                df_result, total_amount, marume_unit, best_params
+                            )
+                        else:
+                            st.session_state.incremental_split = None
                     
-                    # 履歴保存
-                    calculation_data = {
-                        'total_amount': total_amount,
-                        'participants': st.session_state.participants,
-                        'results': df_result.to_dict('records'),
-                        'sum_warikan': sum_warikan,
-                        'diff': diff
-                    }
-                    st.session_state.data_manager.save_calculation_history(calculation_data)
+                        # 再現用の計算条件
+                        replay = {
+                            'method': calc_method,
+                            'rounding': rounding_mode,
+                            'marume': marume_unit,
+                            'role_params': optimizer.default_params,
+                            'options': run_options,
+                            'rules_version': multiplier_manager.get_snapshot().version,
+                            'constraints': st.session_state.participant_constraints.copy() if calc_method == 'minmax' else None
+                        }
                     
-                    auto_save_session()  # 自動保存
-                    st.success("✅ 最適化完了！履歴に保存しました")
-                    time.sleep(0.5)
-                    st.rerun()
+                        # 結果保存
+                        st.session_state.calculation_results = {
+                            'df_result': df_result,
+                            'sum_warikan': sum_warikan,
+                            'diff': diff,
+                            'best_params': best_params,
+                            'replay': replay,
+                            'trace': trace.to_dict(),
+                            'total_amount': total_amount,
+                            'calculation_id': f"{st.session_state.session_id}_{datetime.now().strftime('%Y%m%d%H%M%S%f')}",
+                            'calculation_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                            'calculator': user['display_name']
+                        }
+                    
+                        # 履歴保存
+                        calculation_data = {
+                            'total_amount': total_amount,
+                            'participants': st.session_state.participants,
+                            'results': df_result.to_dict('records'),
+                            'sum_warikan': sum_warikan,
+                            'diff': diff,
+                            'replay': replay,
+                            'trace': trace.to_dict()
+                        }
+                        st.session_state.data_manager.save_calculation_history(calculation_data)
+                    
+                        auto_save_session()  # 自動保存
+                        st.success("✅ 最適化完了！履歴に保存しました")
+                        time.sleep(0.5)
+                        st.rerun()
         
-        # 計算結果表示
-        if st.session_state.calculation_results:
-            results = st.session_state.calculation_results
-            df_result = results['df_result']
-            sum_warikan = results['sum_warikan']
-            diff = results['diff']
+            # 計算結果表示
+            if st.session_state.calculation_results:
+                results = st.session_state.calculation_results
+                df_result = results['df_result']
+                sum_warikan = results['sum_warikan']
+                diff = results['diff']
             
-            st.markdown(f"""
-            <div class="result-highlight">
-                <h3>🎯 計算結果</h3>
-                <p><strong>計算時刻:</strong> {results['calculation_time']}</p>
-                <p><strong>計算者:</strong> {results['calculator']}</p>
-                <p><strong>合計金額:</strong> {sum_warikan:,}円 (目標: {total_amount:,}円)</p>
-                <p><strong>差額:</strong> {diff:+,}円</p>
-            </div>
-            """, unsafe_allow_html=True)
+                st.markdown(f"""
+                <div class="result-highlight">
+                    <h3>🎯 計算結果</h3>
+                    <p><strong>計算時刻:</strong> {results['calculation_time']}</p>
+                    <p><strong>計算者:</strong> {results['calculator']}</p>
+                    <p><strong>合計金額:</strong> {sum_warikan:,}円 (目標: {total_amount:,}円)</p>
+                    <p><strong>差額:</strong> {diff:+,}円</p>
+                </div>
+                """, unsafe_allow_html=True)
             
-            # 結果テーブル
-            st.subheader("💰 個人別負担額")
+                # 結果テーブル
+                st.subheader("💰 個人別負担額")
             
-            display_df = df_result[['名前', '役職', '負担額_丸め']].copy()
-            display_df['負担額_丸め'] = display_df['負担額_丸め'].astype(int)
-            display_df.columns = ['名前', '役職', '負担額（円）']
+                display_df = df_result[['名前', '役職', '負担額_丸め']].copy()
+                display_df['負担額_丸め'] = display_df['負担額_丸め'].astype(int)
+                display_df.columns = ['名前', '役職', '負担額（円）']
             
-            st.dataframe(
-                display_df,
-                use_container_width=True,
-                hide_index=True
-            )
+                st.dataframe(
+                    display_df,
+                    use_container_width=True,
+                    hide_index=True
+                )
             
-            # 最適化パラメータ表示
-            with st.expander("🔧 AI最適化パラメータ"):
-                params_df = pd.DataFrame([
-                    {'役職': role, '比率': f"{ratio:.3f}"}
-                    for role, ratio in results['best_params'].items()
-                ])
-                st.dataframe(params_df, hide_index=True)
-    
+                if '理想との差' in df_result.columns:
+                    st.caption(f"🎯 理想負担額からの最大偏差: {df_result['理想との差'].abs().max():,.0f}円")
+            
+                # 最適化パラメータ表示
+                with st.expander("🔧 AI最適化パラメータ"):
+                    params_df = pd.DataFrame([
+                        {'役職': role, '比率': f"{ratio:.3f}"}
+                        for role, ratio in results['best_params'].items()
+                    ])
+                    st.dataframe(params_df, hide_index=True)
+                
+                    replay = results.get('replay')
+                    if replay and replay['options'].get('seed') is not None:
+                        st.caption(f"🎲 乱数シード: {replay['options']['seed']}（履歴から同じ結果を再現できます）")
+                
+                    # 収束トレース
+                    trace = results.get('trace')
+                    if trace:
+                        st.markdown("**📉 収束トレース**")
+                        col_reason, col_steps, col_total = st.columns(3)
+                        col_reason.metric("終了理由", STOP_REASON_LABELS.get(trace['stop_reason'], trace['stop_reason'] or '-'))
+                        col_steps.metric("反復回数", len(trace['iterations']))
+                        col_total.metric("計算時間", f"{trace['total_ms'] or 0:,.1f}ms")
+                    
+                        if trace['phases']:
+                            st.caption("⏱️ " + " / ".join(
+                                f"{PHASE_LABELS.get(phase, phase)} {elapsed:,.1f}ms" for phase, elapsed in trace['phases'].items()
+                            ))
+                    
+                        if len(trace['iterations']) > 1:
+                            df_trace = pd.DataFrame(trace['iterations']).set_index('step')
+                            value_column = 'diff' if 'diff' in df_trace else 'max_deviation'
+                            st.line_chart(df_trace[[value_column]].rename(columns={
+                                'diff': '差額（円）', 'max_deviation': '最大偏差の上界（円）'
+                            }))
+                        
+                            if 'params' in df_trace:
+                                st.caption("🧬 世代ごとの役職比率")
+                                st.dataframe(
+                                    pd.DataFrame(df_trace['params'].tolist(), index=df_trace.index).round(3),
+                                    use_container_width=True,
+                                    height=200
+                                )
+                
+                    cache_stats = get_result_cache().stats()
+                    st.caption(
+                        f"⚡ 結果キャッシュ: ヒット {cache_stats['hits']}回 / ミス {cache_stats['misses']}回 "
+                        f"（ヒット率 {cache_stats['hit_rate']:.0%}、{cache_stats['size']}/{cache_stats['maxsize']}件）"
+                    )
+            
+                # 比較・感度分析は表示中の結果を計算した条件で行う（サイドバーの現在値ではなく）
+                result_replay = results.get('replay') or {}
+                result_total = results.get('total_amount', total_amount)
+                result_marume = result_replay.get('marume', marume_unit)
+                result_rounding = result_replay.get('rounding', rounding_mode)
+            
+                # 最小最大化は固定額・上限・下限・免除を含むため、比率だけの再配分とは比較できない
+                if result_replay.get('method') == 'minmax':
+                    st.caption("ℹ️ 最小最大化（制約付き）の結果では、丸め単位の比較・感度分析は表示されません")
+                else:
+                    # 丸め単位ごとのトレードオフ（再計算なしで一括比較）
+                    with st.expander("🔢 丸め単位の比較"):
+                        sweep = sweep_rounding_units(df_result, result_total, MARUME_OPTIONS, result_rounding)
+                    
+                        sweep_df = pd.DataFrame({
+                            '丸め単位': [f"{unit:,}円" for unit in sweep['units']],
+                            '合計誤差': [f"{error:,.0f}円" for error in sweep['total_error']],
+                            '最大偏差': [f"{delta:,.0f}円" for delta in sweep['max_abs_delta']],
+                            '最大負担額': [f"{burden:,}円" for burden in sweep['max_burden']],
+                            '差額': [f"{d:+,}円" for d in sweep['diff']]
+                        })
+                        st.dataframe(sweep_df, hide_index=True, use_container_width=True)
+                    
+                        st.markdown("**👥 個人別の理想額との差（円）**")
+                        delta_df = pd.DataFrame(
+                            np.rint(sweep['deltas'].T).astype(int),
+                            columns=[f"{unit:,}円単位" for unit in sweep['units']]
+                        )
+                        delta_df.insert(0, '名前', df_result['名前'].to_numpy())
+                        st.dataframe(delta_df, hide_index=True, use_container_width=True)
+                
+                    # 役職比率・カスタム倍率の感度分析（グリッド全体を一括評価）
+                    with st.expander("🎛️ 役職比率の感度分析"):
+                        col_range, col_steps, col_scales = st.columns(3)
+                    
+                        with col_range:
+                            sensitivity_range = st.slider("📏 比率の変動幅（±%）", 5, 50, 20, step=5)
+                        with col_steps:
+                            sensitivity_steps = st.selectbox("🔢 分割数", options=[3, 5, 7], index=1)
+                        with col_scales:
+                            multiplier_scales = st.multiselect(
+                                "🎯 カスタム倍率の効き",
+                                options=[0.0, 0.5, 1.0, 1.5, 2.0],
+                                default=[0.0, 1.0, 2.0],
+                                help="0 = ルールなし、1 = 現在の設定、2 = 倍率の差を2倍"
+                            ) or [1.0]
+                    
+                        factors = np.linspace(1 - sensitivity_range / 100, 1 + sensitivity_range / 100, sensitivity_steps)
+                        current_params = results['best_params']
+                        role_grid = {
+                            role: current_params[role] * factors
+                            for role in df_result['役職'].unique()
+                            if role != '担当' and role in current_params
+                        }
+                    
+                        try:
+                            started = time.perf_counter()
+                            sensitivity = role_weight_sensitivity(
+                                df_result, result_total, result_marume, role_grid, multiplier_scales, result_rounding
+                            )
+                            elapsed_ms = (time.perf_counter() - started) * 1000
+                        
+                            st.caption(f"⚡ {len(sensitivity['amounts']):,}通りの組合せを {elapsed_ms:.0f}ms で評価")
+                        
+                            sensitivity_df = pd.DataFrame({
+                                '名前': df_result['名前'].to_numpy(),
+                                '役職': df_result['役職'].to_numpy(),
+                                '現在（円）': df_result['負担額_丸め'].astype(int).to_numpy(),
+                                '最小（円）': sensitivity['min'],
+                                '最大（円）': sensitivity['max'],
+                                '変動幅（円）': sensitivity['spread']
+                            })
+                            st.dataframe(sensitivity_df, hide_index=True, use_container_width=True)
+                        except Exception as e:
+                            st.error(f"❌ 感度分析エラー: {str(e)}")
+
     # ==== タブ4: 結果分析 ====
     with tab4:
         st.subheader("📊 結果分析・可視化")
         
         if not st.session_state.calculation_results:
             st.warning("⚠️ 先にAI計算を実行してください")
-            return
-        
-        results = st.session_state.calculation_results
-        df_result = results['df_result']
-        sum_warikan = results['sum_warikan']
+        else:
+            results = st.session_state.calculation_results
+            df_result = results['df_result']
+            sum_warikan = results['sum_warikan']
         
-        # インタラクティブチャート生成
-        chart_generator = AdvancedChartGenerator()
-        fig = chart_generator.create_interactive_charts(df_result, total_amount, sum_warikan)
+            # インタラクティブチャート生成
+            chart_generator = AdvancedChartGenerator()
+            fig = chart_generator.create_interactive_charts(df_result, total_amount, sum_warikan)
         
-        st.plotly_chart(fig, use_container_width=True)
+            st.plotly_chart(fig, use_container_width=True)
         
-        # 統計分析
-        col_stats1, col_stats2 = st.columns(2)
+            # 統計分析
+            col_stats1, col_stats2 = st.columns(2)
         
-        with col_stats1:
-            st.subheader("📈 統計サマリー")
+            with col_stats1:
+                st.subheader("📈 統計サマリー")
             
-            stats_data = {
-                "平均負担額": f"{df_result['負担額_丸め'].mean():.0f}円",
-                "標準偏差": f"{df_result['負担額_丸め'].std():.0f}円",
-                "最大負担額": f"{df_result['負担額_丸め'].max():.0f}円",
-                "最小負担額": f"{df_result['負担額_丸め'].min():.0f}円",
-                "負担額範囲": f"{df_result['負担額_丸め'].max() - df_result['負担額_丸め'].min():.0f}円"
-            }
+                stats_data = {
+                    "平均負担額": f"{df_result['負担額_丸め'].mean():.0f}円",
+                    "標準偏差": f"{df_result['負担額_丸め'].std():.0f}円",
+                    "最大負担額": f"{df_result['負担額_丸め'].max():.0f}円",
+                    "最小負担額": f"{df_result['負担額_丸め'].min():.0f}円",
+                    "負担額範囲": f"{df_result['負担額_丸め'].max() - df_result['負担額_丸め'].min():.0f}円"
+                }
             
-            for key, value in stats_data.items():
-                st.metric(key, value)
+                for key, value in stats_data.items():
+                    st.metric(key, value)
         
-        with col_stats2:
-            st.subheader("💼 役職別分析")
+            with col_stats2:
+                st.subheader("💼 役職別分析")
             
-            role_analysis = df_result.groupby('役職').agg({
-                '負担額_丸め': ['count', 'mean', 'sum']
-            }).round(0)
+                role_analysis = df_result.groupby('役職').agg({
+                    '負担額_丸め': ['count', 'mean', 'sum']
+                }).round(0)
             
-            role_analysis.columns = ['人数', '平均負担額', '合計負担額']
-            st.dataframe(role_analysis)
+                role_analysis.columns = ['人数', '平均負担額', '合計負担額']
+                st.dataframe(role_analysis)
+        
+            # 精算プラン
+            st.subheader("💸 精算プラン")
+            st.caption("実際に支払った人と金額を入力すると、誰が誰にいくら払えばよいかを計算します")
+        
+            payment_input = pd.DataFrame({
+                '名前': df_result['名前'],
+                '支払額': [total_amount if i == 0 else 0 for i in range(len(df_result))]
+            })
+            edited_payments = st.data_editor(
+                payment_input,
+                column_config={
+                    '名前': st.column_config.TextColumn('名前', disabled=True),
+                    '支払額': st.column_config.NumberColumn('支払額（円）', min_value=0, step=100, format="%d")
+                },
+                hide_index=True,
+                use_container_width=True,
+                key="settlement_payments"
+            )
         
-        # CSV出力
-        if "export" in user['permissions']:
-            st.subheader("📥 データ出力")
+            names = df_result['名前'].tolist()
+            settlement = settle_event(
+                names,
+                df_result['負担額_丸め'].to_numpy(),
+                dict(zip(edited_payments['名前'], edited_payments['支払額'].fillna(0).astype(int)))
+            )
+        
+            if settlement['transfers']:
+                transfers_df = pd.DataFrame(settlement['transfers'])
+                st.dataframe(
+                    transfers_df.style.format({'金額': '{:,}円'}),
+                    hide_index=True,
+                    use_container_width=True
+                )
+                st.caption(f"送金回数: {len(settlement['transfers'])}回")
+            else:
+                st.success("✅ 精算の必要はありません")
+        
+            if settlement['unsettled'] > 0:
+                st.warning(f"⚠️ 支払額が負担額の合計を{settlement['unsettled']:,}円上回っています")
+            elif settlement['unsettled'] < 0:
+                st.warning(f"⚠️ 支払額が負担額の合計に{-settlement['unsettled']:,}円不足しています")
+            elif settlement['transfers']:
+                # 計算ごとに固定の記録元ID（参加者の編集後の再記録は差分のみ加算）
+                season_source_id = f"calc_{results.get('calculation_id', results['calculation_time'])}"
+                season_ledger = st.session_state.data_manager.load_season_ledger()
+                if not season_ledger.pending_changes(season_source_id, names, settlement['balances']):
+                    st.caption("📒 この計算はシーズン台帳に記録済みです")
+                elif st.button("📒 シーズン台帳に記録", key="record_season_calc",
+                               help="記録済みの場合は、前回の記録からの変更分だけを加算します"):
+                    if st.session_state.data_manager.record_season_event(
+                        season_source_id, names, settlement['balances'], f"割り勘 {total_amount:,}円"
+                    ):
+                        st.success("✅ シーズン台帳に記録しました")
+                        st.rerun()
+        
+            # CSV出力
+            if "export" in user['permissions']:
+                st.subheader("📥 データ出力")
             
-            csv_data = generate_csv_output(df_result, total_amount, sum_warikan)
+                csv_data = generate_csv_output(df_result, total_amount, sum_warikan, settlement)
             
-            st.download_button(
-                label="📥 CSV形式でダウンロード",
-                data=csv_data,
-                file_name=f"warikan_result_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                mime="text/csv",
-                use_container_width=True
-            )
-        else:
-            st.info("ℹ️ CSV出力権限がありません")
+                st.download_button(
+                    label="📥 CSV形式でダウンロード",
+                    data=csv_data,
+                    file_name=f"warikan_result_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                    mime="text/csv",
+                    use_container_width=True
+                )
+            
+                if settlement['transfers']:
+                    settlement_output = BytesIO()
+                    pd.DataFrame(settlement['transfers']).to_csv(settlement_output, index=False, encoding='utf-8-sig')
+                
+                    st.download_button(
+                        label="💸 精算プランをCSVでダウンロード",
+                        data=settlement_output.getvalue(),
+                        file_name=f"warikan_settlement_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                        mime="text/csv",
+                        use_container_width=True
+                    )
+            else:
+                st.info("ℹ️ CSV出力権限がありません")
     
-    # ==== タブ5: 履歴 ====
+    # ==== タブ5: 会計台帳 ====
     with tab5:
+        show_event_ledger(marume_unit, learned_params)
+    
+    # ==== タブ6: 履歴 ====
+    with tab6:
+        closed_transfers = st.session_state.pop('closed_season_transfers', None)
+        if closed_transfers:
+            st.success("🏁 シーズンを締めました。以下の精算を行ってください")
+            st.dataframe(pd.DataFrame(closed_transfers), hide_index=True, use_container_width=True)
+        
+        show_season_ledger()
+        st.divider()
         show_calculation_history()
 
 # ==== アプリケーション実行 ====
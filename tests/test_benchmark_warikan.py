@@ -0,0 +1,31 @@
+from benchmark_warikan import case_key, compare_results
+
+
+def make_result(p50, diff=0, method='exact', participants=10):
+    return {
+        'method': method,
+        'participants': participants,
+        'distribution': 'uniform',
+        'marume': 500,
+        'rules': 0,
+        'latency_ms': {'p50': p50},
+        'diff': diff,
+    }
+
+
+def test_compare_results_reports_slowdowns_and_changed_diffs():
+    baseline = {'results': [make_result(10.0), make_result(10.0, participants=100), make_result(10.0, method='minmax')]}
+    current = {'results': [
+        make_result(11.0),  # 閾値未満
+        make_result(12.0, participants=100),  # 1.2倍で回帰
+        make_result(5.0, diff=100, method='minmax'),  # 速くなっても結果が変われば回帰
+        make_result(50.0, method='genetic'),  # 比較対象なし
+    ]}
+
+    regressions = compare_results(baseline, current)
+    assert [regression['case'] for regression in regressions] == [
+        case_key(make_result(0, participants=100)), case_key(make_result(0, method='minmax'))
+    ]
+    assert regressions[0]['ratio'] == 1.2
+    assert regressions[1]['diff_after'] == 100
+    assert compare_results({}, current) == []
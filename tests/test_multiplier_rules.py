@@ -0,0 +1,181 @@
+import random
+import sqlite3
+import threading
+
+import numpy as np
+import pytest
+
+import multiplier_rules
+from multiplier_rules import (
+    CompiledMultiplierRules, PatternMatcher, RuleStore, SQLiteRuleBackend, names_match, normalize_name, normalize_pattern,
+    strip_normalized_patterns, with_normalized_patterns
+)
+
+ALPHABET = 'abあい '
+
+
+def reference_find(rules, participant_name):
+    """ルールを定義順に1件ずつ照合する従来の実装"""
+    normalized = normalize_name(participant_name)
+    for rule_data in rules.values():
+        for pattern in rule_data.get('name_patterns', []):
+            if names_match(normalized, normalize_pattern(pattern)):
+                return rule_data.get('multiplier', 1.0)
+    return 1.0
+
+
+def random_text(rng, max_length):
+    text = ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(0, max_length)))
+    return text + rng.choice(['', '', 'さん', '君'])
+
+
+def test_matcher_matches_rule_by_rule_loop():
+    rng = random.Random(20240601)
+    for _ in range(3000):
+        rules = {
+            f"rule_{r}": {
+                'name_patterns': [random_text(rng, 4) for _ in range(rng.randint(0, 3))],
+                'multiplier': float(r + 2),
+            }
+            for r in range(rng.randint(0, 6))
+        }
+        compiled = CompiledMultiplierRules(with_normalized_patterns(rules))
+        names = [random_text(rng, 6) for _ in range(5)]
+        expected = [reference_find(rules, name) for name in names]
+        assert [compiled.find(name) for name in names] == expected, rules
+        assert compiled.resolve(names).tolist() == expected, rules
+
+
+def test_matcher_returns_first_matching_rule():
+    matcher = PatternMatcher([['山田太郎'], ['山田'], ['太郎']])
+    assert matcher.match('山田太郎') == 0
+    assert matcher.match('山田花子') == 1
+    assert matcher.match('太') == 0
+    assert matcher.match('佐藤') is None
+
+
+def test_resolve_returns_ones_without_rules():
+    assert np.array_equal(CompiledMultiplierRules({}).resolve(['a', 'b']), np.ones(2))
+
+
+def test_patterns_do_not_use_participant_name_cache():
+    normalize_name.cache_clear()
+    rules = {f"rule_{i}": {'name_patterns': [f"pattern{i}"], 'multiplier': 2.0} for i in range(100)}
+    CompiledMultiplierRules(with_normalized_patterns(rules))
+    assert multiplier_rules.normalization_cache_stats()['misses'] == 0
+
+
+def test_strip_removes_normalized_patterns():
+    rules = {'rule': {'name_patterns': ['山田さん'], 'multiplier': 2.0}}
+    normalized = with_normalized_patterns(rules)
+    assert normalized['rule']['normalized_patterns'] == [normalize_pattern('山田さん')]
+    assert strip_normalized_patterns(normalized) == rules
+
+
+def test_rule_snapshot_is_immutable():
+    store = RuleStore()
+    snapshot = store.publish({'a': {'name_patterns': ['x'], 'multiplier': 2.0}})
+    with pytest.raises(AttributeError):
+        snapshot.version = 0
+    with pytest.raises(TypeError):
+        snapshot.rules['b'] = {}
+
+    edited = snapshot.to_dict()
+    edited['a']['multiplier'] = 3.0
+    assert store.current().compiled.find('x') == 2.0
+
+
+class BlockingBackend(SQLiteRuleBackend):
+    """保存中に止めて、その間の読み取りを確認するための保存先"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.saving = threading.Event()
+        self.release = threading.Event()
+
+    def save_rules(self, *args):
+        self.saving.set()
+        assert self.release.wait(5)
+        super().save_rules(*args)
+
+
+def test_rule_store_reads_are_not_blocked_by_publish(tmp_path):
+    backend = BlockingBackend(str(tmp_path / 'rules.db'))
+    store = RuleStore(backend)
+    before = store.current()
+
+    writer = threading.Thread(target=store.publish, args=({'a': {'name_patterns': ['x'], 'multiplier': 2.0}},))
+    writer.start()
+    assert backend.saving.wait(5)
+    # 保存中も現在のスナップショットを待たずに読める
+    assert store.current() is before
+    backend.release.set()
+    writer.join()
+    assert store.current().compiled.find('x') == 2.0
+
+
+def test_concurrent_rule_updates_are_not_lost():
+    store = RuleStore()
+    versions = []
+    done = threading.Event()
+
+    def read():
+        while not done.is_set():
+            versions.append(store.current().version)
+
+    def write(worker):
+        for i in range(20):
+            store.update(lambda rules: rules.update({f"rule_{worker}_{i}": {'name_patterns': [f"{worker}-{i}"]}}))
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    writers = [threading.Thread(target=write, args=(worker,)) for worker in range(4)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    done.set()
+    reader.join()
+
+    assert len(store.current()) == 80
+    assert versions == sorted(versions)
+
+
+def test_with_normalized_patterns_reuses_keys_of_current_version():
+    stored = {'name_patterns': ['山田さん'], 'normalized_patterns': ['stored'], 'multiplier': 2.0}
+    current = dict(stored, normalization_version=multiplier_rules.NORMALIZATION_VERSION)
+    outdated = dict(stored, normalization_version=multiplier_rules.NORMALIZATION_VERSION - 1)
+
+    assert with_normalized_patterns({'rule': current})['rule']['normalized_patterns'] == ['stored']
+    assert with_normalized_patterns({'rule': outdated})['rule']['normalized_patterns'] == ['山田']
+    assert with_normalized_patterns({'rule': stored})['rule']['normalized_patterns'] == ['山田']
+    assert strip_normalized_patterns({'rule': current}) == {'rule': {'name_patterns': ['山田さん'], 'multiplier': 2.0}}
+
+
+def test_rule_store_persists_to_sqlite(tmp_path):
+    path = str(tmp_path / 'rules.db')
+    store = RuleStore(SQLiteRuleBackend(path))
+    store.publish({'a': {'name_patterns': ['田中さん'], 'multiplier': 2.0}}, updated_by='admin')
+    store.update(lambda rules: rules.update({'b': {'name_patterns': ['鈴木'], 'multiplier': 0.5}}), updated_by='other')
+    store.update(lambda rules: rules.pop('a'), updated_by='admin')
+
+    reopened = RuleStore(SQLiteRuleBackend(path))
+    assert reopened.current().to_dict() == store.current().to_dict()
+    assert reopened.current().compiled.find('鈴木くん') == 0.5
+    assert reopened.last_change()['changed_by'] == 'admin'
+    assert [entry['action'] for entry in reopened.backend.change_log()] == ['delete', 'add', 'add']
+    assert reopened.backend.rules_for_pattern('鈴木さん') == ['b']
+
+
+def test_sqlite_backend_renormalizes_keys_of_other_version(tmp_path):
+    path = str(tmp_path / 'rules.db')
+    RuleStore(SQLiteRuleBackend(path)).publish({'a': {'name_patterns': ['田中さん'], 'multiplier': 2.0}})
+    # 以前の版で正規化されたキーを再現
+    with sqlite3.connect(path) as connection:
+        connection.execute("UPDATE rule_patterns SET normalized = '田中さん'")
+        connection.execute('PRAGMA user_version = 0')
+
+    reopened = RuleStore(SQLiteRuleBackend(path))
+    assert reopened.current().rules['a']['normalized_patterns'] == ('田中',)
+    assert reopened.current().compiled.find('田中くん') == 2.0
+    assert reopened.backend.rules_for_pattern('田中') == ['a']
@@ -0,0 +1,61 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from participant_store import TIMESTAMP_FORMAT, ParticipantStore
+from warikan_engine import ROLE_NAMES
+
+
+def test_store_matches_list_of_records():
+    rng = np.random.default_rng(19)
+    store = ParticipantStore()
+    expected = []
+    added_at = int(datetime.strptime('2024-01-02 03:04:05', TIMESTAMP_FORMAT).timestamp())
+    for step in range(500):
+        action = rng.integers(0, 3) if expected else 0
+        if action == 0:
+            record = {
+                '名前': f"参加者{step}",
+                '役職': str(rng.choice(ROLE_NAMES)),
+                'カスタム倍率': float(rng.choice([0.5, 1.0, 1.5])),
+                '追加日時': '2024-01-02 03:04:05',
+                '追加者': str(rng.choice(['admin', 'user'])),
+            }
+            store.append(record['名前'], record['役職'], record['カスタム倍率'],
+                         added_at=added_at, added_by=record['追加者'])
+            expected.append(record)
+        elif action == 1:
+            index = int(rng.integers(len(expected)))
+            store.remove(index)
+            expected.pop(index)
+        else:
+            index, role = int(rng.integers(len(expected))), str(rng.choice(ROLE_NAMES))
+            store.set_role(index, role)
+            expected[index]['役職'] = role
+
+        assert len(store) == len(expected)
+
+    assert store.to_records() == expected
+    assert all(record['名前'] in store for record in expected)
+    pd.testing.assert_frame_equal(
+        store.to_frame(include_meta=True), pd.DataFrame(expected, columns=list(expected[0])),
+        check_dtype=False
+    )
+    assert ParticipantStore.from_records(store.to_records()).to_records() == expected
+
+    copied = store.copy()
+    copied.remove(0)
+    assert len(store) == len(expected)
+
+
+def test_store_rejects_duplicates_and_unknown_roles():
+    store = ParticipantStore()
+    store.append('a', ROLE_NAMES[0])
+    with pytest.raises(ValueError):
+        store.append('a', ROLE_NAMES[0])
+    with pytest.raises(ValueError):
+        store.append('b', '社長')
+    with pytest.raises(ValueError):
+        ParticipantStore.from_frame(pd.DataFrame({'名前': ['a', 'a'], '役職': [ROLE_NAMES[0]] * 2}))
@@ -0,0 +1,426 @@
+import itertools
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from warikan_engine import (
+    DEFAULT_ROLE_PARAMS, ROLE_CODES, ROLE_NAMES, ROUNDING_MODES, AIWarikanOptimizer, IncrementalWarikan,
+    OptimizationResultCache, OptimizationTrace, RoleWeightEstimator,
+    role_weight_sensitivity, sweep_rounding_units, throttle_progress
+)
+
+
+def random_participants(rng, n):
+    return pd.DataFrame({
+        '名前': [f"参加者{i}" for i in range(n)],
+        '役職': rng.choice(ROLE_NAMES, size=n),
+        'カスタム倍率': rng.choice([1.0, 1.0, 0.5, 1.5, 2.0], size=n),
+    })
+
+
+def random_case(rng, max_participants=8):
+    n = int(rng.integers(1, max_participants + 1))
+    return random_participants(rng, n), int(rng.integers(1_000, 100_000)), int(rng.choice([100, 500, 1000]))
+
+
+def test_exact_allocation_sums_to_total():
+    rng = np.random.default_rng(1)
+    optimizer = AIWarikanOptimizer()
+    for _ in range(500):
+        df, total, marume = random_case(rng)
+        df_calc, sum_warikan, diff, _ = optimizer.optimize_warikan(df, total, marume)
+        assert sum_warikan == total and diff == 0
+        assert df_calc['負担額_丸め'].sum() == total
+
+
+def test_exact_allocation_is_within_one_unit_of_ideal():
+    rng = np.random.default_rng(12)
+    optimizer = AIWarikanOptimizer()
+    for _ in range(300):
+        df, total, marume = random_case(rng)
+        df_calc = optimizer.optimize_warikan(df, total, marume)[0]
+        deviation = np.abs(df_calc['負担額_丸め'] - df_calc['負担額'])
+        # 丸め単位未満の端数を負担する1人を除き、理想額との差は丸め単位未満
+        assert (deviation < marume).sum() >= len(df) - 1
+        assert deviation.max() < marume + total % marume + 1e-6
+
+
+
+def test_optimizer_reports_progress_through_callback():
+    calls = []
+    df = random_participants(np.random.default_rng(13), 5)
+    AIWarikanOptimizer().optimize_warikan(df, 10_000, 100, progress_callback=lambda *args: calls.append(args))
+    assert calls and calls[-1][0] == calls[-1][1]
+
+
+def test_throttled_progress_skips_updates_within_interval():
+    now = [0.0]
+    calls = []
+    callback = throttle_progress(lambda *args: calls.append(args), min_interval=0.1, clock=lambda: now[0])
+
+    for step in range(1, 11):
+        now[0] = step * 0.03
+        callback(step, 10, f"step {step}")
+
+    # 最初の通知、0.1秒以上経過した通知、最終ステップの通知のみ
+    assert [step for step, _, _ in calls] == [1, 5, 9, 10]
+
+
+def test_batch_matches_single_event():
+    rng = np.random.default_rng(4)
+    optimizer = AIWarikanOptimizer()
+    events = [(random_participants(rng, int(rng.integers(1, 9))), int(rng.integers(1_000, 100_000)))
+              for _ in range(400)]
+
+    results = optimizer.optimize_events(events, 500)
+    for (df, total), result in zip(events, results):
+        df_calc, sum_warikan, diff, _ = optimizer.optimize_warikan(df, total, 500)
+        assert np.array_equal(result['df_result']['負担額_丸め'], df_calc['負担額_丸め'])
+        assert result['sum_warikan'] == sum_warikan and result['diff'] == diff
+
+
+def test_exact_allocation_does_not_depend_on_row_order():
+    rng = np.random.default_rng(3)
+    optimizer = AIWarikanOptimizer()
+    for _ in range(150):
+        df, total, marume = random_case(rng)
+        shuffled = df.sample(frac=1, random_state=int(rng.integers(1 << 31))).reset_index(drop=True)
+        first = optimizer.optimize_warikan(df, total, marume)[0]
+        second = optimizer.optimize_warikan(shuffled, total, marume)[0]
+        # 同じ (役職, 倍率) の参加者同士の入れ替えを除き、各人の負担額は一致
+        key = ['役職', 'カスタム倍率']
+        assert (
+            first.groupby(key)['負担額_丸め'].apply(sorted).to_dict()
+            == second.groupby(key)['負担額_丸め'].apply(sorted).to_dict()
+        )
+
+
+def test_cache_hit_returns_same_result():
+    df = random_participants(np.random.default_rng(14), 6)
+    optimizer = AIWarikanOptimizer()
+    cache = OptimizationResultCache()
+
+    first = optimizer.optimize_warikan(df, 23_456, 500, cache=cache)
+    trace = OptimizationTrace()
+    second = optimizer.optimize_warikan(df.iloc[::-1].reset_index(drop=True), 23_456, 500, cache=cache, trace=trace)
+
+    assert trace.stop_reason == 'cache_hit'
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+    assert dict(zip(first[0]['名前'], first[0]['負担額_丸め'])) == dict(zip(second[0]['名前'], second[0]['負担額_丸め']))
+
+
+def test_cache_key_depends_on_conditions():
+    df = random_participants(np.random.default_rng(15), 4)
+    optimizer = AIWarikanOptimizer()
+    cache = OptimizationResultCache()
+    optimizer.optimize_warikan(df, 10_000, 500, cache=cache)
+    optimizer.optimize_warikan(df, 10_000, 100, cache=cache)
+    optimizer.optimize_warikan(df, 10_000, 500, cache=cache, rules_version=2)
+    assert cache.stats()['hits'] == 0 and cache.stats()['size'] == 3
+
+
+def test_cache_evicts_least_recently_used():
+    cache = OptimizationResultCache(maxsize=2)
+    cache.put('a', {'value': 1})
+    cache.put('b', {'value': 2})
+    assert cache.get('a') == {'value': 1}
+    cache.put('c', {'value': 3})
+
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    assert cache.stats()['size'] == 2
+
+
+def test_cache_is_safe_under_concurrent_access():
+    cache = OptimizationResultCache(maxsize=8)
+    errors = []
+
+    def worker(seed):
+        rng = np.random.default_rng(seed)
+        try:
+            for _ in range(5_000):
+                key = str(int(rng.integers(32)))
+                if cache.get(key) is None:
+                    cache.put(key, {'key': key})
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = cache.stats()
+    assert not errors
+    assert stats['hits'] + stats['misses'] == 8 * 5_000
+    assert stats['size'] <= 8
+
+
+def apply_random_edit(rng, split, df, next_id, multipliers=(1.0,)):
+    """増分状態と参加者DataFrameに同じ編集（追加・削除・役職変更）を適用"""
+    operation = rng.choice(['add', 'remove', 'change_role'])
+    if operation == 'add' or len(df) <= 1:
+        row = {'名前': f"参加者{next_id}", '役職': rng.choice(ROLE_NAMES), 'カスタム倍率': float(rng.choice(multipliers))}
+        split.add(row['名前'], row['役職'], row['カスタム倍率'])
+        return pd.concat([df, pd.DataFrame([row])], ignore_index=True), next_id + 1
+    index = int(rng.integers(len(df)))
+    if operation == 'remove':
+        split.remove(df['名前'][index])
+        return df.drop(index).reset_index(drop=True), next_id
+    role = rng.choice(ROLE_NAMES)
+    split.change_role(df['名前'][index], role)
+    df.loc[index, '役職'] = role
+    return df, next_id
+
+
+def test_incremental_matches_full_recalculation():
+    rng = np.random.default_rng(6)
+    optimizer = AIWarikanOptimizer()
+    for _ in range(40):
+        df, total, marume = random_case(rng)
+        df_calc, _, _, best_params = optimizer.optimize_warikan(df, total, marume)
+        split = IncrementalWarikan.from_frame(df_calc, total, marume, best_params)
+        next_id = len(df)
+
+        for _ in range(6):
+            df, next_id = apply_random_edit(rng, split, df, next_id, (1.0, 0.5, 2.0, 0.0))
+            expected = optimizer.optimize_warikan(df, total, marume)[0]
+            assert np.array_equal(split.annotate(df)['負担額_丸め'], expected['負担額_丸め'])
+
+
+def test_incremental_handles_zero_total_weight():
+    df = pd.DataFrame({'名前': ['a', 'b'], '役職': ['担当', '課長'], 'カスタム倍率': [0.0, 0.0]})
+    optimizer = AIWarikanOptimizer()
+    df_calc, _, _, best_params = optimizer.optimize_warikan(df, 10_000, 500)
+    split = IncrementalWarikan.from_frame(df_calc, 10_000, 500, best_params)
+
+    annotated = split.annotate(df)
+    assert np.array_equal(annotated['負担額_丸め'], df_calc['負担額_丸め'])
+
+    split.add('c', '担当', 0.0)
+    df = pd.concat([df, pd.DataFrame([{'名前': 'c', '役職': '担当', 'カスタム倍率': 0.0}])], ignore_index=True)
+    expected = optimizer.optimize_warikan(df, 10_000, 500)[0]
+    assert np.array_equal(split.annotate(df)['負担額_丸め'], expected['負担額_丸め'])
+
+    split.remove('a')
+    split.remove('b')
+    assert split.annotate(df[df['名前'] == 'c'])['負担額_丸め'].tolist() == [10_000]
+
+
+@pytest.mark.parametrize('rounding', ROUNDING_MODES)
+def test_rounding_modes_report_consistent_sums(rounding):
+    rng = np.random.default_rng(2)
+    optimizer = AIWarikanOptimizer()
+    for _ in range(200):
+        df, total, marume = random_case(rng)
+        df_calc, sum_warikan, diff, _ = optimizer.optimize_warikan(df, total, marume, rounding=rounding)
+        amounts = df_calc['負担額_丸め'].to_numpy()
+        assert amounts.dtype.kind == 'i'
+        assert sum_warikan == int(amounts.sum()) and diff == sum_warikan - total
+        if rounding != 'largest_remainder':
+            # 個別に丸める方式は各人が丸め単位の倍数
+            assert (amounts % marume == 0).all()
+
+
+def test_individual_rounding_directions():
+    df = pd.DataFrame({'名前': ['a', 'b', 'c'], '役職': ['担当', '担当', '担当']})
+    optimizer = AIWarikanOptimizer()
+    # 1人あたり 3,333.33... 円
+    assert optimizer.optimize_warikan(df, 10_000, 1000, rounding='ceil')[0]['負担額_丸め'].tolist() == [4000] * 3
+    assert optimizer.optimize_warikan(df, 10_000, 1000, rounding='floor')[0]['負担額_丸め'].tolist() == [3000] * 3
+    assert optimizer.optimize_warikan(df, 10_000, 1000, rounding='half_up')[0]['負担額_丸め'].tolist() == [3000] * 3
+
+
+def test_batch_matches_single_event_with_individual_rounding():
+    rng = np.random.default_rng(16)
+    optimizer = AIWarikanOptimizer()
+    events = [(random_participants(rng, int(rng.integers(1, 9))), int(rng.integers(1_000, 100_000)))
+              for _ in range(200)]
+    results = optimizer.optimize_events(events, 500, rounding='half_up')
+    for (df, total), result in zip(events, results):
+        df_calc = optimizer.optimize_warikan(df, total, 500, rounding='half_up')[0]
+        assert np.array_equal(result['df_result']['負担額_丸め'], df_calc['負担額_丸め'])
+
+
+def brute_force_max_deviation(ideal, total_units, marume, low, high):
+    """全ての単位配分を列挙して最大偏差の最小値を求める"""
+    best = np.inf
+    for units in itertools.product(*(range(lo, hi + 1) for lo, hi in zip(low, high))):
+        if sum(units) == total_units:
+            best = min(best, float(np.max(np.abs(np.array(units) * marume - ideal))))
+    return best
+
+
+def test_minmax_is_optimal_on_small_cases():
+    rng = np.random.default_rng(8)
+    optimizer = AIWarikanOptimizer()
+    for _ in range(150):
+        n = int(rng.integers(1, 5))
+        marume = int(rng.choice([100, 500]))
+        total = int(rng.integers(1, 16)) * marume
+        df = random_participants(rng, n)
+        df['上限'] = np.where(rng.random(n) < 0.3, rng.integers(1, 10, size=n) * marume, np.nan)
+
+        try:
+            df_calc, sum_warikan, _, _ = optimizer.optimize_warikan(df, total, marume, method='minmax')
+        except ValueError:
+            continue
+
+        assert sum_warikan == total
+        cap = df['上限'].to_numpy()
+        assert (np.isnan(cap) | (df_calc['負担額_丸め'].to_numpy() <= cap)).all()
+
+        ideal = df_calc['負担額'].to_numpy()
+        high = np.where(np.isnan(cap), total // marume, np.floor(cap / marume)).astype(int)
+        best = brute_force_max_deviation(ideal, total // marume, marume, [0] * n, high)
+        achieved = float(np.max(np.abs(df_calc['負担額_丸め'].to_numpy() - ideal)))
+        assert achieved <= best + 1e-6
+
+
+def test_minmax_respects_fixed_and_exempt():
+    df = pd.DataFrame({
+        '名前': ['a', 'b', 'c', 'd'],
+        '役職': ['部長', '担当', '担当', '担当'],
+        '固定額': [np.nan, 3000, np.nan, np.nan],
+        '免除': [False, False, True, False],
+    })
+    df_calc, sum_warikan, _, _ = AIWarikanOptimizer().optimize_warikan(df, 12_345, 500, method='minmax')
+    amounts = df_calc['負担額_丸め'].tolist()
+    assert sum_warikan == 12_345
+    assert amounts[1] == 3000 and amounts[2] == 0
+
+
+def test_minmax_rejects_infeasible_constraints():
+    df = pd.DataFrame({'名前': ['a', 'b'], '役職': ['担当', '担当'], '上限': [1000, 1000]})
+    with pytest.raises(ValueError):
+        AIWarikanOptimizer().optimize_warikan(df, 5000, 500, method='minmax')
+
+
+def test_rounding_sweep_matches_optimizer():
+    rng = np.random.default_rng(7)
+    optimizer = AIWarikanOptimizer()
+    units = (100, 500, 1000)
+    for _ in range(200):
+        df, total, _ = random_case(rng)
+        df_calc = optimizer.optimize_warikan(df, total, 100)[0]
+        sweep = sweep_rounding_units(df_calc, total, units)
+        assert (sweep['sum_warikan'] == total).all()
+        for row, marume in enumerate(units):
+            expected = optimizer.optimize_warikan(df, total, marume)[0]
+            assert np.array_equal(sweep['amounts'][row], expected['負担額_丸め'])
+
+
+def test_rounding_sweep_breaks_ties_like_optimizer():
+    df = pd.DataFrame({'名前': ['a', 'b', 'c'], '役職': ['事業部長', '担当', '担当']})
+    df_calc = AIWarikanOptimizer().optimize_warikan(df, 19_200, 100)[0]
+    assert df_calc['負担額_丸め'].tolist() == [8500, 5400, 5300]
+    assert sweep_rounding_units(df_calc, 19_200, (100,))['amounts'][0].tolist() == [8500, 5400, 5300]
+
+
+def test_sensitivity_grid_contains_current_allocation():
+    rng = np.random.default_rng(17)
+    optimizer = AIWarikanOptimizer()
+    for _ in range(100):
+        df, total, marume = random_case(rng)
+        df_calc, _, _, best_params = optimizer.optimize_warikan(df, total, marume)
+        role_grid = {'課長': [best_params['課長'], best_params['課長'] * 1.2]}
+        sensitivity = role_weight_sensitivity(df_calc, total, marume, role_grid, (1.0, 0.0))
+
+        assert sensitivity['amounts'].shape == (4, len(df))
+        assert (sensitivity['amounts'].sum(axis=1) == total).all()
+        # 現在の比率・倍率の組合せは最適化の結果と一致
+        assert np.array_equal(sensitivity['amounts'][0], df_calc['負担額_丸め'])
+        assert (sensitivity['min'] <= df_calc['負担額_丸め']).all()
+        assert (df_calc['負担額_丸め'] <= sensitivity['max']).all()
+
+
+def test_sensitivity_works_after_incremental_update():
+    rng = np.random.default_rng(18)
+    optimizer = AIWarikanOptimizer()
+    df, total, marume = random_case(rng)
+    df_calc, _, _, best_params = optimizer.optimize_warikan(df, total, marume)
+    split = IncrementalWarikan.from_frame(df_calc, total, marume, best_params)
+
+    df, _ = apply_random_edit(rng, split, df, len(df))
+    annotated = split.annotate(df)
+    sensitivity = role_weight_sensitivity(annotated, total, marume, {'部長': [1.2, 1.4, 1.6]}, (0.0, 1.0))
+    assert (sensitivity['amounts'].sum(axis=1) == total).all()
+
+
+def test_role_weight_estimator_recovers_known_weights():
+    true_params = {'担当': 1.0, '主査': 1.15, '課長': 1.3, '部長': 1.5, '事業部長': 1.9}
+    rng = np.random.default_rng(19)
+    estimator = RoleWeightEstimator(prior_strength=1e-3)
+
+    for _ in range(200):
+        n = int(rng.integers(3, 12))
+        roles = rng.choice(ROLE_NAMES, size=n)
+        multipliers = rng.choice([1.0, 1.0, 0.5, 1.5], size=n)
+        unit_price = rng.uniform(2_000, 6_000)
+        noise = np.exp(rng.normal(0, 0.01, size=n))
+        amounts = unit_price * np.array([true_params[role] for role in roles]) * multipliers * noise
+        estimator.update(roles, amounts, multipliers)
+
+    proposed = estimator.propose()
+    for role, weight in true_params.items():
+        assert proposed[role] == pytest.approx(weight, rel=0.02)
+
+
+def test_role_weight_estimator_falls_back_to_prior_and_round_trips():
+    estimator = RoleWeightEstimator()
+    assert estimator.propose() == pytest.approx(DEFAULT_ROLE_PARAMS)
+
+    # 0円（免除）の参加者しかいないイベントは無視
+    estimator.update(['担当', '課長'], [0, 0])
+    assert estimator.n_events == 0
+
+    estimator.update(['担当', '課長', '部長'], [3000, 3600, 4200])
+    restored = RoleWeightEstimator.from_dict(estimator.to_dict())
+    assert restored.propose() == pytest.approx(estimator.propose())
+
+
+def test_genetic_is_reproducible_with_seed():
+    rng = np.random.default_rng(9)
+    df, total, marume = random_case(rng)
+    optimizer = AIWarikanOptimizer()
+    first = optimizer.optimize_warikan(df, total, marume, method='genetic', seed=42, generations=10)
+    second = optimizer.optimize_warikan(df, total, marume, method='genetic', seed=42, generations=10)
+    assert np.array_equal(first[0]['負担額_丸め'], second[0]['負担額_丸め'])
+    assert first[3] == second[3]
+
+
+def test_columns_match_frame_optimizer():
+    rng = np.random.default_rng(5)
+    optimizer = AIWarikanOptimizer()
+    for _ in range(100):
+        df, total, marume = random_case(rng)
+        codes = df['役職'].map(ROLE_CODES).to_numpy()
+        for rounding in ROUNDING_MODES:
+            result = optimizer.optimize_columns(codes, df['カスタム倍率'].to_numpy(), total, marume, rounding=rounding)
+            df_calc = optimizer.optimize_warikan(df, total, marume, rounding=rounding)[0]
+            assert np.array_equal(result['amounts'], df_calc['負担額_丸め'])
+
+
+def test_trace_records_stop_reason():
+    df = random_participants(np.random.default_rng(20), 6)
+    optimizer = AIWarikanOptimizer()
+
+    def run(method, **options):
+        trace = OptimizationTrace()
+        optimizer.optimize_warikan(df, 23_456, 500, method=method, trace=trace, seed=0, **options)
+        assert trace.method == method and trace.total_ms is not None
+        return trace
+
+    assert run('exact').stop_reason == 'direct'
+    assert run('minmax').stop_reason == 'bisection_converged'
+
+    trace = run('genetic', generations=3, patience=100)
+    assert trace.stop_reason == 'max_generations'
+    assert [iteration['step'] for iteration in trace.iterations] == list(range(len(trace.iterations)))
+
+    trace = run('genetic', generations=500, patience=1)
+    assert trace.stop_reason == 'converged'
+    assert len(trace.iterations) < 500
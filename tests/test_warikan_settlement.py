@@ -0,0 +1,120 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from warikan_engine import ROLE_NAMES, AIWarikanOptimizer
+from warikan_settlement import EventLedger, SeasonLedger, SQLiteSeasonBackend, plan_settlement, settle_event
+
+
+def test_single_receipt_matches_optimizer():
+    rng = np.random.default_rng(10)
+    optimizer = AIWarikanOptimizer()
+    for _ in range(200):
+        n = int(rng.integers(1, 9))
+        df = pd.DataFrame({'名前': [f"参加者{i}" for i in range(n)], '役職': rng.choice(ROLE_NAMES, size=n)})
+        total, marume = int(rng.integers(1_000, 100_000)), int(rng.choice([100, 500]))
+        df_calc = optimizer.optimize_warikan(df, total, marume)[0]
+
+        ledger = EventLedger.from_frame(df_calc, marume)
+        ledger.add_receipt('会計', df['名前'][0], total)
+        assert np.array_equal(ledger.compute()['burdens'], df_calc['負担額_丸め'])
+
+
+def test_transfers_settle_all_balances():
+    rng = np.random.default_rng(11)
+    for _ in range(200):
+        n = int(rng.integers(2, 30))
+        balances = rng.integers(-10_000, 10_000, size=n)
+        balances[-1] -= balances.sum()
+        names = [f"m{i}" for i in range(n)]
+
+        settled = dict(zip(names, balances.tolist()))
+        transfers = plan_settlement(names, balances)
+        for transfer in transfers:
+            assert transfer['金額'] > 0
+            settled[transfer['支払者']] += transfer['金額']
+            settled[transfer['受取者']] -= transfer['金額']
+        assert set(settled.values()) == {0}
+        # 貪欲マッチングは1回の送金で少なくとも1人を清算する
+        assert len(transfers) <= np.count_nonzero(balances) - 1 or not transfers
+
+
+def test_matching_amounts_settle_in_one_transfer():
+    transfers = plan_settlement(['a', 'b', 'c', 'd'], [3000, -3000, 500, -500])
+    assert len(transfers) == 2
+
+
+def test_settle_event_reports_unsettled_amount():
+    result = settle_event(['a', 'b'], [1000, 1000], {'a': 2500})
+    assert result['unsettled'] == 500
+    assert settle_event(['a', 'b'], [1000, 1000], {'a': 2000})['transfers'] == [
+        {'支払者': 'b', '受取者': 'a', '金額': 1000}
+    ]
+
+
+def test_season_records_only_changes_since_last_recording():
+    season = SeasonLedger('test')
+    assert season.record_source('calc_1', ['a', 'b'], [1000, -1000])
+    assert not season.record_source('calc_1', ['a', 'b'], [1000, -1000])
+
+    # 参加者が増えた後の再記録は差分のみ加算
+    assert season.record_source('calc_1', ['a', 'b', 'c'], [1500, -1000, -500])
+    assert season.balances == {'a': 1500, 'b': -1000, 'c': -500}
+    assert [event['id'] for event in season.events] == ['calc_1', 'calc_1#2']
+
+    restored = SeasonLedger.from_dict(season.to_dict())
+    assert restored.record_source('calc_1', ['a', 'b'], [0, 0])
+    assert restored.events[-1]['id'] == 'calc_1#3'
+    assert set(restored.balances.values()) == {0}
+
+
+def test_season_rejects_unbalanced_event():
+    with pytest.raises(ValueError):
+        SeasonLedger().record_event('e', ['a', 'b'], [100, -50])
+
+
+def test_season_ledger_persists_to_sqlite(tmp_path):
+    backend = SQLiteSeasonBackend(str(tmp_path / 'seasons.db'))
+    season = SeasonLedger('test')
+    for source_id, names, balances in [('calc_1', ['a', 'b'], [1000, -1000]),
+                                       ('calc_2', ['b', 'c'], [300, -300]),
+                                       ('calc_1', ['a', 'b', 'c'], [1500, -1000, -500])]:
+        assert backend.record('user', source_id, names, balances, season_name='test')
+        season.record_source(source_id, names, balances)
+    assert not backend.record('user', 'calc_2', ['b', 'c'], [300, -300])
+
+    restored = SQLiteSeasonBackend(backend.path).load('user')
+    assert restored.name == 'test'
+    assert restored.balances == season.balances
+    assert [event['id'] for event in restored.events] == ['calc_1', 'calc_2', 'calc_1#2']
+    assert not restored.pending_changes('calc_1', ['a', 'b', 'c'], [1500, -1000, -500])
+    assert backend.load('someone_else') is None
+
+    assert backend.close('user', 'next') == season.settlement()
+    assert backend.load('user').name == 'next'
+    assert len(backend.load('user')) == 0
+
+
+def test_concurrent_season_records_are_not_lost(tmp_path):
+    backend = SQLiteSeasonBackend(str(tmp_path / 'seasons.db'))
+    errors = []
+
+    def record(worker):
+        try:
+            for i in range(10):
+                backend.record('user', f"calc_{worker}_{i}", ['a', f"m{worker}"], [100, -100])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=record, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    ledger = backend.load('user')
+    assert len(ledger) == 40
+    assert ledger.balances['a'] == 4000
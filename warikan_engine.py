@@ -0,0 +1,1198 @@
+# ==== AI割り勘 最適化エンジン（Streamlit非依存） ====
+# Webアプリ・バッチ処理・ベンチマークから共通で利用するヘッドレスAPI
+
+import bisect
+import hashlib
+import heapq
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# 進捗コールバック: (現在ステップ, 総ステップ数, メッセージ)
+ProgressCallback = Callable[[int, int, str], None]
+
+# 役職コード（バッチ処理用の配列表現）。-1 はパディング
+ROLE_NAMES = ('担当', '主査', '課長', '部長', '事業部長')
+ROLE_CODES = {role: code for code, role in enumerate(ROLE_NAMES)}
+PAD_CODE = -1
+
+# 比率を整数化する際の倍率（小数点以下4桁まで保持）
+WEIGHT_SCALE = 10_000
+
+# 端数処理モード（largest_remainder 以外は各人を個別に丸める）
+ROUNDING_MODES = ('largest_remainder', 'half_up', 'ceil', 'floor', 'bankers')
+
+# 公平性重視モードの参加者別制約列（NaN / False は制約なし）
+CONSTRAINT_COLUMNS = ('固定額', '上限', '下限', '免除')
+
+
+DEFAULT_ROLE_PARAMS = {
+    '事業部長': 1.6, '部長': 1.4, '課長': 1.2, '主査': 1.1, '担当': 1.0
+}
+
+
+class AIWarikanOptimizer:
+    def __init__(self, role_params: Optional[Dict[str, float]] = None):
+        self.default_params = dict(role_params) if role_params else DEFAULT_ROLE_PARAMS.copy()
+
+    def optimize_warikan(self, df_participants, total_amount, marume=500,
+                         multiplier_lookup: Optional[Callable[[str], float]] = None,
+                         progress_callback: Optional[ProgressCallback] = None,
+                         method: str = 'exact', admin_multipliers: Optional[np.ndarray] = None,
+                         cache: Optional['OptimizationResultCache'] = None, rules_version=None,
+                         rounding: str = 'largest_remainder',
+                         trace: Optional['OptimizationTrace'] = None, **genetic_options):
+        """割り勘最適化
+
+        method: 'exact' = 最大剰余法による厳密配分, 'genetic' = 遺伝的アルゴリズム,
+        'minmax' = 参加者別制約付きの最大偏差最小化
+        trace を渡すと反復ごとの差額・比率・経過時間と終了理由が記録される。
+        """
+        trace = trace if trace is not None else OptimizationTrace()
+        trace.start(method)
+
+        # DataFrame 以外（ParticipantStore など）はここで一度だけ変換
+        if not isinstance(df_participants, pd.DataFrame):
+            df_participants = df_participants.to_frame()
+
+        if df_participants.empty:
+            return None, None, None, None
+
+        if method == 'minmax':
+            # 参加者ごとの制約を含むためキャッシュ対象外
+            return self.optimize_minmax(
+                df_participants, total_amount, marume,
+                multiplier_lookup=multiplier_lookup,
+                progress_callback=progress_callback,
+                admin_multipliers=admin_multipliers,
+                trace=trace
+            )
+        if method not in ('exact', 'genetic'):
+            raise ValueError(f"未対応の計算モードです: {method}")
+        if rounding not in ROUNDING_MODES:
+            raise ValueError(f"未対応の端数処理です: {rounding}")
+
+        # キャッシュ照会（シードなしの遺伝的アルゴリズムや乱数生成器の直接指定は再現できないため対象外）
+        reproducible = 'rng' not in genetic_options and (
+            method != 'genetic' or genetic_options.get('seed') is not None
+        )
+        cache_key = None
+        if cache is not None and reproducible:
+            df_base = self._build_calc_frame(df_participants, self.default_params, multiplier_lookup, admin_multipliers)
+            order = canonical_order(df_base)
+            cache_key = cache.fingerprint(
+                df_base, order, total_amount, marume, rules_version, method,
+                dict(genetic_options, rounding=rounding, role_params=tuple(sorted(self.default_params.items())))
+            )
+            cached = cache.get(cache_key)
+            trace.mark('cache_lookup')
+            if cached is not None:
+                _notify(progress_callback, 1, 1, "⚡ キャッシュから復元しました")
+                result = self._result_from_cache(df_base, order, cached, total_amount)
+                trace.finish('cache_hit')
+                return result
+
+        if method == 'genetic':
+            result = self.optimize_genetic(
+                df_participants, total_amount, marume,
+                multiplier_lookup=multiplier_lookup,
+                progress_callback=progress_callback,
+                admin_multipliers=admin_multipliers,
+                rounding=rounding,
+                trace=trace,
+                **genetic_options
+            )
+        else:
+            result = self._optimize_exact(
+                df_participants, total_amount, marume,
+                multiplier_lookup, progress_callback, admin_multipliers, rounding, trace
+            )
+
+        if cache_key is not None:
+            df_calc, _, _, best_params = result
+            cache.put(cache_key, {
+                'amounts': df_calc['負担額_丸め'].to_numpy()[order],
+                'best_params': best_params
+            })
+
+        return result
+
+    def _optimize_exact(self, df_participants, total_amount, marume,
+                        multiplier_lookup: Optional[Callable[[str], float]] = None,
+                        progress_callback: Optional[ProgressCallback] = None,
+                        admin_multipliers: Optional[np.ndarray] = None,
+                        rounding: str = 'largest_remainder',
+                        trace: Optional['OptimizationTrace'] = None):
+        """既定比率による配分（正規順序・整数演算で計算し、同じ構成なら常に同じ結果）"""
+        trace = trace if trace is not None else OptimizationTrace('exact')
+        total_steps = 2
+        best_params = self.default_params.copy()
+
+        df_calc = self._build_calc_frame(df_participants, best_params, multiplier_lookup, admin_multipliers)
+        trace.mark('build')
+
+        _notify(progress_callback, 1, total_steps, "⚖️ 負担比率を計算しました")
+
+        total_weight = df_calc['比率'].sum()
+        df_calc['負担額'] = df_calc['比率'] / total_weight * total_amount
+
+        order = canonical_order(df_calc)
+        weights = scale_weights(df_calc['比率'].to_numpy(dtype=float))
+        amounts = np.empty(len(df_calc), dtype=np.int64)
+        amounts[order] = round_burdens(
+            weights[order][np.newaxis, :], np.array([total_amount]), np.array([marume]), rounding
+        )[0]
+        df_calc['負担額_丸め'] = amounts
+
+        sum_warikan = int(df_calc['負担額_丸め'].sum())
+        diff = sum_warikan - total_amount
+        trace.mark('rounding')
+        trace.record(diff=diff, params=best_params)
+        trace.finish('direct')
+
+        _notify(progress_callback, total_steps, total_steps, "✅ 最適解発見！")
+
+        return df_calc, sum_warikan, diff, best_params
+
+    def _result_from_cache(self, df_calc, order: np.ndarray, cached: Dict, total_amount):
+        """キャッシュ済みの正規順序の結果を参加者名に割り当て直す"""
+        best_params = dict(cached['best_params'])
+
+        df_calc['基本比率'] = df_calc['役職'].map(best_params)
+        df_calc['比率'] = df_calc['基本比率'] * df_calc['最終倍率']
+        total_weight = df_calc['比率'].sum()
+        df_calc['負担額'] = df_calc['比率'] / total_weight * total_amount
+
+        amounts = np.empty(len(df_calc), dtype=np.int64)
+        amounts[order] = cached['amounts']
+        df_calc['負担額_丸め'] = amounts
+
+        sum_warikan = int(df_calc['負担額_丸め'].sum())
+        diff = sum_warikan - total_amount
+
+        return df_calc, sum_warikan, diff, best_params
+
+    def optimize_genetic(self, df_participants, total_amount, marume=500,
+                         multiplier_lookup: Optional[Callable[[str], float]] = None,
+                         progress_callback: Optional[ProgressCallback] = None,
+                         admin_multipliers: Optional[np.ndarray] = None,
+                         population_size: int = 64, generations: int = 50, patience: int = 10,
+                         crossover_rate: float = 0.8, mutation_rate: float = 0.2,
+                         mutation_scale: float = 0.05, elite_size: int = 2,
+                         deviation_penalty: float = 10.0, rounding: str = 'half_up',
+                         rng: Optional[np.random.Generator] = None, seed: Optional[int] = None,
+                         trace: Optional['OptimizationTrace'] = None):
+        """集団ベースの遺伝的アルゴリズムで役職比率を最適化（各人は個別に丸め）
+
+        rounding='largest_remainder' の場合は四捨五入で比率を探索し、
+        最終結果のみ最大剰余法で合計金額に一致させる。
+        seed を指定すると同じ入力に対して常に同じ結果を返す（rng 指定時はそちらを優先）。
+        """
+        if df_participants.empty:
+            return None, None, None, None
+
+        rng = rng if rng is not None else np.random.default_rng(seed)
+        trace = trace if trace is not None else OptimizationTrace('genetic')
+
+        df_calc = self._build_calc_frame(df_participants, self.default_params, multiplier_lookup, admin_multipliers)
+        trace.mark('build')
+
+        # 同じ (役職, 倍率) の参加者は負担額も同じなのでグループに圧縮して評価
+        codes = role_codes_of(df_calc)
+        multipliers = df_calc['最終倍率'].to_numpy(dtype=float)
+        group_keys, group_counts = np.unique(
+            np.stack([codes.astype(float), multipliers], axis=1), axis=0, return_counts=True
+        )
+        group_codes = group_keys[:, 0].astype(np.int64)
+        group_multipliers = group_keys[:, 1]
+
+        # 個体 = ROLE_NAMES 順の役職比率ベクトル（担当は基準として固定）
+        base = self.role_param_vector()
+        population = base * np.exp(rng.normal(0.0, mutation_scale, (population_size, len(ROLE_NAMES))))
+        population[0] = base
+        population[:, ROLE_CODES['担当']] = base[ROLE_CODES['担当']]
+
+        def evaluate(pop: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+            """集団全体の適応度（コスト）を行列演算で一括評価"""
+            weights = pop[:, group_codes] * group_multipliers
+            total_weight = weights @ group_counts
+            shares = weights / total_weight[:, np.newaxis] * total_amount
+            rounded = marume * _round_units_float(shares / marume, rounding)
+            diffs = rounded @ group_counts - total_amount
+
+            # 差額 + 既定比率からの乖離 + 役職順序の逆転ペナルティ
+            deviation = np.square(np.log(pop / base)).sum(axis=1)
+            inversion = np.clip(pop[:, :-1] - pop[:, 1:], 0.0, None).sum(axis=1)
+            costs = np.abs(diffs) / marume + deviation_penalty * deviation + 100.0 * inversion
+            return costs, diffs
+
+        costs, diffs = evaluate(population)
+        best_idx = int(np.argmin(costs))
+        best_cost, best_genome = costs[best_idx], population[best_idx].copy()
+        best_diff = int(diffs[best_idx])
+        stale = 0
+        stop_reason = 'max_generations'
+        trace.record(diff=best_diff, cost=float(best_cost), params=_params_of(best_genome))
+
+        for generation in range(generations):
+            # エリート保存
+            elite = population[np.argsort(costs, kind='stable')[:elite_size]]
+
+            # トーナメント選択（3個体）
+            contenders = rng.integers(0, population_size, (population_size, 3))
+            winners = contenders[np.arange(population_size), np.argmin(costs[contenders], axis=1)]
+            parents_a = population[winners]
+            parents_b = population[rng.permutation(winners)]
+
+            # ブレンド交叉
+            alpha = rng.random(parents_a.shape)
+            do_cross = rng.random((population_size, 1)) < crossover_rate
+            children = np.where(do_cross, alpha * parents_a + (1 - alpha) * parents_b, parents_a)
+
+            # 対数正規の突然変異
+            mutate = rng.random(children.shape) < mutation_rate
+            children = children * np.exp(np.where(mutate, rng.normal(0.0, mutation_scale, children.shape), 0.0))
+
+            children[:elite_size] = elite
+            children[:, ROLE_CODES['担当']] = base[ROLE_CODES['担当']]
+            population = children
+
+            costs, diffs = evaluate(population)
+            best_idx = int(np.argmin(costs))
+
+            if costs[best_idx] < best_cost - 1e-12:
+                best_cost, best_genome = costs[best_idx], population[best_idx].copy()
+                best_diff = int(diffs[best_idx])
+                stale = 0
+            else:
+                stale += 1
+
+            trace.record(diff=best_diff, cost=float(best_cost), params=_params_of(best_genome))
+            _notify(progress_callback, generation + 1, generations,
+                    f"🤖 AI最適化中... {generation + 1}/{generations} 世代")
+
+            # 早期終了
+            if stale >= patience:
+                stop_reason = 'converged'
+                break
+
+        trace.mark('search')
+        best_params = _params_of(best_genome)
+
+        df_calc['基本比率'] = df_calc['役職'].map(best_params)
+        df_calc['比率'] = df_calc['基本比率'] * df_calc['最終倍率']
+        total_weight = df_calc['比率'].sum()
+        df_calc['負担額'] = df_calc['比率'] / total_weight * total_amount
+        weights = scale_weights(df_calc['比率'].to_numpy(dtype=float))
+        df_calc['負担額_丸め'] = round_burdens(
+            weights[np.newaxis, :], np.array([total_amount]), np.array([marume]), rounding
+        )[0]
+
+        sum_warikan = int(df_calc['負担額_丸め'].sum())
+        diff = sum_warikan - total_amount
+        trace.mark('rounding')
+        trace.finish(stop_reason)
+
+        _notify(progress_callback, generations, generations, "✅ 最適化完了！")
+
+        return df_calc, sum_warikan, diff, best_params
+
+    def optimize_minmax(self, df_participants, total_amount, marume=500,
+                        multiplier_lookup: Optional[Callable[[str], float]] = None,
+                        progress_callback: Optional[ProgressCallback] = None,
+                        admin_multipliers: Optional[np.ndarray] = None,
+                        tolerance: float = 1e-6, trace: Optional['OptimizationTrace'] = None):
+        """理想負担額からの最大偏差を最小化（固定額・上限・下限・免除の制約付き）
+
+        固定額・免除の参加者を除いた残額を比率で按分した額を理想とし、
+        丸め単位の倍数で「最大偏差 D 以内に収まる割当が存在するか」を二分探索する。
+        判定は各人の割当区間の和が残りの単位数を挟むかどうかで O(n) のため、
+        200人規模でも数ミリ秒で最適な D が求まる。
+        """
+        if df_participants.empty:
+            return None, None, None, None
+
+        trace = trace if trace is not None else OptimizationTrace('minmax')
+        total_steps = 3
+        best_params = self.default_params.copy()
+        total_amount = int(total_amount)
+
+        df_calc = self._build_calc_frame(df_participants, best_params, multiplier_lookup, admin_multipliers)
+        n = len(df_calc)
+        trace.mark('build')
+
+        fixed = _constraint_column(df_calc, '固定額')
+        cap = _constraint_column(df_calc, '上限')
+        floor_amount = _constraint_column(df_calc, '下限')
+        exempt = df_calc['免除'].fillna(False).to_numpy(dtype=bool) if '免除' in df_calc else np.zeros(n, dtype=bool)
+
+        is_fixed = ~np.isnan(fixed) & ~exempt
+        free = ~is_fixed & ~exempt
+
+        amounts = np.zeros(n, dtype=np.int64)
+        amounts[is_fixed] = np.rint(fixed[is_fixed]).astype(np.int64)
+        remaining_amount = total_amount - int(amounts.sum())
+
+        if remaining_amount < 0:
+            raise ValueError("固定額の合計が合計金額を超えています")
+        if not free.any():
+            if remaining_amount != 0:
+                raise ValueError("固定額・免除以外の参加者がいないため合計金額に一致させられません")
+            trace.finish('direct')
+            return self._minmax_result(df_calc, amounts.astype(float), amounts, total_amount, best_params)
+
+        # 理想負担額（固定・免除を除いた残額を比率で按分）
+        weights = df_calc['比率'].to_numpy(dtype=float)
+        ideal = np.zeros(n, dtype=float)
+        ideal[is_fixed] = amounts[is_fixed]
+        ideal[free] = weights[free] / weights[free].sum() * remaining_amount
+
+        _notify(progress_callback, 1, total_steps, "⚖️ 理想負担額を計算しました")
+
+        # 単位数での下限・上限
+        ideal_units = ideal[free] / marume
+        total_units = remaining_amount // marume
+        low = np.where(np.isnan(floor_amount[free]), 0, np.ceil(floor_amount[free] / marume)).astype(np.int64)
+        high = np.where(np.isnan(cap[free]), total_units, np.floor(cap[free] / marume)).astype(np.int64)
+        high = np.minimum(high, total_units)
+
+        if (low > high).any() or low.sum() > total_units or high.sum() < total_units:
+            raise ValueError("上限・下限の制約を満たす割り勘が存在しません")
+
+        def bounds(max_deviation: float) -> Tuple[np.ndarray, np.ndarray]:
+            """最大偏差 max_deviation 以内に収まる各人の単位数の区間"""
+            lo = np.maximum(low, np.ceil(ideal_units - max_deviation / marume - 1e-12)).astype(np.int64)
+            hi = np.minimum(high, np.floor(ideal_units + max_deviation / marume + 1e-12)).astype(np.int64)
+            return lo, hi
+
+        def feasible(max_deviation: float) -> bool:
+            lo, hi = bounds(max_deviation)
+            return bool((lo <= hi).all() and lo.sum() <= total_units <= hi.sum())
+
+        # 最大偏差の二分探索
+        d_low = 0.0
+        d_high = float(np.max(np.maximum(np.abs(low - ideal_units), np.abs(high - ideal_units)))) * marume
+        if feasible(d_low):
+            d_high = d_low
+        while d_high - d_low > tolerance:
+            d_mid = (d_low + d_high) / 2
+            if feasible(d_mid):
+                d_high = d_mid
+            else:
+                d_low = d_mid
+            trace.record(max_deviation=d_high, lower_bound=d_low)
+        trace.mark('bisection')
+
+        _notify(progress_callback, 2, total_steps, f"🎯 最大偏差 {d_high:,.0f}円以内で配分します")
+
+        # 下限から開始し、残りの単位を理想額との差が大きい人から順に配分
+        lo, hi = bounds(d_high)
+        units = lo.copy()
+        extra_units = total_units - int(units.sum())
+        heap = [(-(ideal_units[i] - units[i]), i) for i in range(len(units)) if units[i] < hi[i]]
+        heapq.heapify(heap)
+        while extra_units > 0:
+            _, i = heapq.heappop(heap)
+            units[i] += 1
+            extra_units -= 1
+            if units[i] < hi[i]:
+                heapq.heappush(heap, (-(ideal_units[i] - units[i]), i))
+
+        free_amounts = units * marume
+
+        # 丸め単位未満の端数は上限に余裕があり理想額との差が最大の人が負担
+        leftover = remaining_amount - int(free_amounts.sum())
+        if leftover > 0:
+            room = np.isnan(cap[free]) | (free_amounts + leftover <= cap[free])
+            if not room.any():
+                raise ValueError("端数を負担できる参加者がいません（上限を見直してください）")
+            shortfall = np.where(room, ideal[free] - free_amounts, -np.inf)
+            free_amounts[int(np.argmax(shortfall))] += leftover
+
+        amounts[free] = free_amounts
+        trace.mark('distribution')
+        trace.finish('bisection_converged')
+
+        _notify(progress_callback, total_steps, total_steps, "✅ 最適解発見！")
+
+        return self._minmax_result(df_calc, ideal, amounts, total_amount, best_params)
+
+    def _minmax_result(self, df_calc, ideal: np.ndarray, amounts: np.ndarray, total_amount, best_params):
+        """公平性重視モードの結果を組み立て"""
+        df_calc['負担額'] = ideal
+        df_calc['負担額_丸め'] = amounts
+        df_calc['理想との差'] = amounts - ideal
+
+        sum_warikan = int(df_calc['負担額_丸め'].sum())
+        diff = sum_warikan - total_amount
+
+        return df_calc, sum_warikan, diff, best_params
+
+    def _build_calc_frame(self, df_participants, role_params: Dict[str, float],
+                          multiplier_lookup: Optional[Callable[[str], float]] = None,
+                          admin_multipliers: Optional[np.ndarray] = None):
+        """役職比率と倍率を適用した計算用DataFrameを作成"""
+        df_calc = df_participants.copy()
+
+        # 基本の役職比率を適用
+        df_calc['基本比率'] = df_calc['役職'].map(role_params)
+
+        # 管理者設定のカスタム倍率を自動適用（コンパイル済みベクトルを優先）
+        if admin_multipliers is not None:
+            df_calc['管理者設定倍率'] = np.asarray(admin_multipliers, dtype=float)
+        elif multiplier_lookup is not None:
+            df_calc['管理者設定倍率'] = df_calc['名前'].apply(multiplier_lookup)
+        else:
+            df_calc['管理者設定倍率'] = 1.0
+
+        # 参加者個別設定の倍率（既存機能との互換性）
+        df_calc['個別設定倍率'] = df_calc.get('カスタム倍率', 1.0)
+
+        # 最終倍率 = 管理者設定倍率 × 個別設定倍率
+        df_calc['最終倍率'] = df_calc['管理者設定倍率'] * df_calc['個別設定倍率']
+
+        # 最終比率 = 基本比率 × 最終倍率
+        df_calc['比率'] = df_calc['基本比率'] * df_calc['最終倍率']
+
+        return df_calc
+
+    @staticmethod
+    def allocate_largest_remainder(weights: np.ndarray, total_amount: int, marume: int) -> np.ndarray:
+        """最大剰余法で丸め単位ごとに配分（合計は必ず total_amount に一致）"""
+        return allocate_largest_remainder_batch(
+            scale_weights(weights)[np.newaxis, :], np.array([total_amount]), np.array([marume])
+        )[0]
+
+    def role_param_vector(self, role_params: Optional[Dict[str, float]] = None) -> np.ndarray:
+        """役職比率を ROLE_NAMES 順の配列に変換"""
+        params = role_params or self.default_params
+        return np.array([params.get(role, np.nan) for role in ROLE_NAMES], dtype=float)
+
+    def optimize_batch(self, role_codes: np.ndarray, multipliers: np.ndarray, totals: np.ndarray,
+                       marume=500, role_params: Optional[Dict[str, float]] = None,
+                       rounding: str = 'largest_remainder') -> Dict:
+        """複数イベントを一括最適化（パディング済み配列をブロードキャストで1パス計算）"""
+        role_codes = np.asarray(role_codes)
+        multipliers = np.asarray(multipliers, dtype=float)
+        totals = np.asarray(totals, dtype=np.int64)
+        marume = np.broadcast_to(np.asarray(marume, dtype=np.int64), totals.shape)
+
+        mask = role_codes != PAD_CODE
+        param_vec = self.role_param_vector(role_params)
+
+        # 比率 = 役職比率 × 倍率（パディングは0）
+        weights = np.where(mask, param_vec[np.where(mask, role_codes, 0)] * multipliers, 0.0)
+        total_weight = weights.sum(axis=1)
+        safe_weight = np.where(total_weight > 0, total_weight, 1.0)
+        ideal = weights / safe_weight[:, np.newaxis] * totals[:, np.newaxis]
+
+        # 行ごとに正規順序（役職コード, 倍率、パディングは末尾）へ並べ替えて配分し、元の並びに戻す
+        order = np.lexsort((np.round(multipliers, 9), role_codes, ~mask), axis=-1)
+        sorted_amounts = round_burdens(
+            np.take_along_axis(scale_weights(weights), order, axis=1), totals, marume, rounding,
+            np.take_along_axis(mask, order, axis=1)
+        )
+        amounts = np.empty_like(sorted_amounts)
+        np.put_along_axis(amounts, order, sorted_amounts, axis=1)
+        sum_warikan = amounts.sum(axis=1)
+
+        return {
+            'amounts': amounts,
+            'ideal': ideal,
+            'sum_warikan': sum_warikan,
+            'diff': sum_warikan - totals,
+            'counts': mask.sum(axis=1),
+        }
+
+    def optimize_events(self, events: Sequence[Tuple[pd.DataFrame, int]], marume=500,
+                        multiplier_lookup: Optional[Callable[[str], float]] = None,
+                        rounding: str = 'largest_remainder') -> List[Dict]:
+        """(参加者DataFrame, 合計金額) のリストを一括計算し、イベントごとの結果を返す"""
+        role_codes, multipliers, totals = pack_events(events, multiplier_lookup)
+        batch = self.optimize_batch(role_codes, multipliers, totals, marume, rounding=rounding)
+
+        results = []
+        for i, (df_participants, total_amount) in enumerate(events):
+            n = int(batch['counts'][i])
+            df_calc = df_participants.copy()
+            df_calc['負担額'] = batch['ideal'][i, :n]
+            df_calc['負担額_丸め'] = batch['amounts'][i, :n]
+            results.append({
+                'df_result': df_calc,
+                'sum_warikan': int(batch['sum_warikan'][i]),
+                'diff': int(batch['diff'][i]),
+            })
+        return results
+
+    def optimize_columns(self, role_codes: np.ndarray, multipliers: np.ndarray, total_amount, marume=500,
+                         rounding: str = 'largest_remainder') -> Dict:
+        """列指向の配列のみで厳密配分（大人数モード用、DataFrame を作らない）
+
+        role_codes は ROLE_NAMES のコード、multipliers は最終倍率。
+        結果は optimize_warikan(method='exact') と同じ。
+        """
+        if rounding not in ROUNDING_MODES:
+            raise ValueError(f"未対応の端数処理です: {rounding}")
+
+        role_codes = np.asarray(role_codes, dtype=np.int64)
+        multipliers = np.asarray(multipliers, dtype=float)
+        param_vec = self.role_param_vector()
+
+        weights = param_vec[role_codes] * multipliers
+        total_weight = weights.sum()
+        ideal = weights / total_weight * total_amount if total_weight > 0 else np.zeros(len(weights))
+
+        order = np.lexsort((np.round(multipliers, 9), role_codes))
+        amounts = np.empty(len(weights), dtype=np.int64)
+        amounts[order] = round_burdens(
+            scale_weights(weights)[order][np.newaxis, :], np.array([total_amount]), np.array([marume]), rounding
+        )[0]
+
+        sum_warikan = int(amounts.sum())
+        return {
+            'amounts': amounts,
+            'ideal': ideal,
+            'sum_warikan': sum_warikan,
+            'diff': sum_warikan - int(total_amount),
+            'best_params': self.default_params.copy(),
+        }
+
+
+def sweep_rounding_units(df_calc, total_amount, units: Sequence[int] = (100, 500, 1000),
+                         rounding: str = 'largest_remainder') -> Dict:
+    """計算済みの比率で全ての丸め単位の配分を1パスで計算（行 = 丸め単位、列 = 参加者）"""
+    units = np.asarray(units, dtype=np.int64)
+    weights = scale_weights(df_calc['比率'].to_numpy(dtype=float))
+    ratio = df_calc['比率'].to_numpy(dtype=float)
+    ideal = ratio / ratio.sum() * total_amount
+
+    # 最適化本体と同じ正規順序で配分（剰余が同じ場合の割り当てを一致させる）
+    order = canonical_order(df_calc)
+    totals = np.full(len(units), int(total_amount), dtype=np.int64)
+    amounts = np.empty((len(units), len(weights)), dtype=np.int64)
+    amounts[:, order] = round_burdens(
+        np.broadcast_to(weights[order], (len(units), len(weights))), totals, units, rounding
+    )
+    deltas = amounts - ideal[np.newaxis, :]
+    sum_warikan = amounts.sum(axis=1)
+
+    return {
+        'units': units,
+        'amounts': amounts,
+        'ideal': ideal,
+        'deltas': deltas,
+        'total_error': np.abs(deltas).sum(axis=1),
+        'max_abs_delta': np.abs(deltas).max(axis=1),
+        'max_burden': amounts.max(axis=1),
+        'sum_warikan': sum_warikan,
+        'diff': sum_warikan - totals,
+    }
+
+
+def role_weight_sensitivity(df_calc, total_amount, marume: int, role_grid: Dict[str, Sequence[float]],
+                            multiplier_scales: Sequence[float] = (1.0,),
+                            rounding: str = 'largest_remainder') -> Dict:
+    """役職比率とカスタム倍率のグリッド全体で丸め後負担額を一括評価
+
+    role_grid に含まれない役職は現在の基本比率のまま。multiplier_scales は
+    管理者設定倍率の効き具合（0 = ルールなし, 1 = 現在, 2 = 1.0 からの差を2倍）。
+    """
+    codes = role_codes_of(df_calc)
+    current = {role: float(ratio) for role, ratio in zip(df_calc['役職'], df_calc['基本比率'])}
+
+    # 役職比率のグリッド（組合せ × ROLE_NAMES）
+    axes = [
+        np.asarray(role_grid.get(role, [current.get(role, np.nan)]), dtype=float)
+        for role in ROLE_NAMES
+    ]
+    mesh = np.meshgrid(*axes, indexing='ij')
+    role_params = np.stack([axis.ravel() for axis in mesh], axis=1)
+
+    # カスタム倍率のグリッド（スケール × 参加者）
+    scales = np.asarray(multiplier_scales, dtype=float)
+    individual, admin = _split_multipliers(df_calc)
+    multipliers = (1.0 + scales[:, np.newaxis] * (admin - 1.0)) * individual
+
+    # (役職比率の組合せ × スケール × 参加者) をブロードキャストで計算
+    weights = role_params[:, np.newaxis, codes] * multipliers[np.newaxis, :, :]
+    weights = weights.reshape(-1, len(codes))
+    n_grid = weights.shape[0]
+
+    # 最適化本体と同じ正規順序で配分
+    order = canonical_order(df_calc)
+    amounts = np.empty(weights.shape, dtype=np.int64)
+    amounts[:, order] = round_burdens(
+        scale_weights(weights[:, order]),
+        np.full(n_grid, int(total_amount), dtype=np.int64),
+        np.full(n_grid, int(marume), dtype=np.int64),
+        rounding
+    )
+
+    return {
+        'role_params': np.repeat(role_params, len(scales), axis=0),
+        'multiplier_scales': np.tile(scales, len(role_params)),
+        'amounts': amounts,
+        'min': amounts.min(axis=0),
+        'max': amounts.max(axis=0),
+        'spread': amounts.max(axis=0) - amounts.min(axis=0),
+        'mean': amounts.mean(axis=0),
+    }
+
+
+class RoleWeightEstimator:
+    """計算履歴から役職比率を推定するオンライン最小二乗
+
+    各人の log(負担額 / 倍率) = log(イベント単価) + log(役職比率) とみなし、
+    イベント内で平均を引いて単価を消去する。担当を基準 (1.0) に固定し、
+    既定比率への ridge 事前分布付きの正規方程式 (XᵀX + λI)β = Xᵀy + λβ₀ を解く。
+    十分統計量 XᵀX・Xᵀy だけを保持するため、1件の追加は O(役職数²) で済み
+    過去の履歴を読み直す必要はない。
+    """
+
+    def __init__(self, prior_params: Optional[Dict[str, float]] = None, prior_strength: float = 1.0):
+        self.prior_params = dict(prior_params or DEFAULT_ROLE_PARAMS)
+        self.prior_strength = prior_strength
+
+        k = len(ROLE_NAMES) - 1
+        self.xtx = np.zeros((k, k))
+        self.xty = np.zeros(k)
+        self.n_events = 0
+        self.n_observations = 0
+
+    def update(self, roles: Sequence[str], amounts: Sequence[float],
+               multipliers: Optional[Sequence[float]] = None):
+        """確定した1イベント分の割り勘結果で十分統計量を更新"""
+        codes = pd.Series(list(roles)).map(ROLE_CODES).to_numpy(dtype=float)
+        amounts = np.asarray(amounts, dtype=float)
+        multipliers = np.ones_like(amounts) if multipliers is None else np.asarray(multipliers, dtype=float)
+
+        # 免除（0円）や未知の役職は除外
+        valid = ~np.isnan(codes) & (amounts > 0) & (multipliers > 0)
+        n = int(valid.sum())
+        if n < 2:
+            return
+
+        codes = codes[valid].astype(np.int64)
+        y = np.log(amounts[valid] / multipliers[valid])
+
+        # 役職ごとの人数と y の合計（担当 = 基準列は除く）
+        counts = np.bincount(codes, minlength=len(ROLE_NAMES))[1:].astype(float)
+        y_sums = np.bincount(codes, weights=y, minlength=len(ROLE_NAMES))[1:]
+        x_mean = counts / n
+
+        # イベント内で中心化した特徴量の XᵀX・Xᵀy
+        self.xtx += np.diag(counts) - n * np.outer(x_mean, x_mean)
+        self.xty += y_sums - counts * y.mean()
+        self.n_events += 1
+        self.n_observations += n
+
+    def propose(self) -> Dict[str, float]:
+        """推定した役職比率（担当 = 1.0）"""
+        baseline = self.prior_params[ROLE_NAMES[0]]
+        prior = np.log([self.prior_params[role] / baseline for role in ROLE_NAMES[1:]])
+
+        k = len(prior)
+        beta = np.linalg.solve(
+            self.xtx + self.prior_strength * np.eye(k),
+            self.xty + self.prior_strength * prior
+        )
+
+        params = {ROLE_NAMES[0]: 1.0}
+        params.update({role: float(np.exp(b)) for role, b in zip(ROLE_NAMES[1:], beta)})
+        return params
+
+    def to_dict(self) -> Dict:
+        """保存用の辞書に変換"""
+        return {
+            'prior_params': self.prior_params,
+            'prior_strength': self.prior_strength,
+            'xtx': self.xtx.tolist(),
+            'xty': self.xty.tolist(),
+            'n_events': self.n_events,
+            'n_observations': self.n_observations,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'RoleWeightEstimator':
+        """保存済みの辞書から復元"""
+        estimator = cls(data.get('prior_params'), data.get('prior_strength', 1.0))
+        estimator.xtx = np.array(data['xtx'], dtype=float)
+        estimator.xty = np.array(data['xty'], dtype=float)
+        estimator.n_events = data.get('n_events', 0)
+        estimator.n_observations = data.get('n_observations', 0)
+        return estimator
+
+
+class OptimizationTrace:
+    """最適化の収束トレース（反復ごとの差額・比率・経過時間、フェーズ別の所要時間、終了理由）
+
+    stop_reason: 'direct' = 反復なし, 'converged' = 改善なしで早期終了,
+    'max_generations' = 最大世代数に到達, 'bisection_converged' = 二分探索が収束,
+    'cache_hit' = 結果キャッシュから復元
+    """
+
+    def __init__(self, method: Optional[str] = None):
+        self.start(method)
+
+    def start(self, method: Optional[str] = None):
+        self.method = method
+        self.stop_reason: Optional[str] = None
+        self.iterations: List[Dict] = []
+        self.phases: Dict[str, float] = {}
+        self.total_ms: Optional[float] = None
+        self._started = time.perf_counter()
+        self._last_mark = self._started
+
+    def mark(self, phase: str):
+        """直前の区切りからの経過時間をフェーズの所要時間（ms）として記録"""
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + (now - self._last_mark) * 1000
+        self._last_mark = now
+
+    def record(self, **values):
+        """1反復分の値を記録（経過時間は開始からの ms）"""
+        values['step'] = len(self.iterations)
+        values['elapsed_ms'] = (time.perf_counter() - self._started) * 1000
+        self.iterations.append(values)
+
+    def finish(self, stop_reason: str):
+        self.stop_reason = stop_reason
+        self.total_ms = (time.perf_counter() - self._started) * 1000
+
+    def to_dict(self) -> Dict:
+        return {
+            'method': self.method,
+            'stop_reason': self.stop_reason,
+            'total_ms': self.total_ms,
+            'phases': dict(self.phases),
+            'iterations': list(self.iterations),
+        }
+
+
+class OptimizationResultCache:
+    """最適化結果のLRUキャッシュ（役職・倍率の多重集合によるフィンガープリントで管理）
+
+    Webアプリではセッション間で共有されるため、参照・登録・統計はロック下で行う。
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[str, Dict]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(df_calc, order: np.ndarray, total_amount, marume, rules_version=None,
+                    method: str = 'exact', options: Optional[Dict] = None) -> str:
+        """正規順序に並べた (役職, 最終倍率) と計算条件からキーを生成"""
+        codes = role_codes_of(df_calc)[order]
+        multipliers = np.round(df_calc['最終倍率'].to_numpy(dtype=float)[order], 9)
+
+        digest = hashlib.sha1(codes.tobytes())
+        digest.update(multipliers.tobytes())
+        digest.update(repr((
+            int(total_amount), int(marume), rules_version, method,
+            sorted((options or {}).items())
+        )).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """キャッシュを参照（ヒット時は最新扱いに更新）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, value: Dict):
+        """結果を登録（上限を超えたら最も古いものを破棄）"""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """キャッシュと統計をクリア"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict:
+        """ヒット・ミス統計を取得"""
+        with self._lock:
+            hits, misses, size = self.hits, self.misses, len(self._entries)
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'size': size,
+            'maxsize': self.maxsize,
+            'hit_rate': hits / lookups if lookups else 0.0
+        }
+
+
+class IncrementalWarikan:
+    """参加者の追加・削除・役職変更を増分で反映する厳密配分の状態
+
+    同じ (役職, 最終倍率) の参加者は理想負担額が等しいため、グループ単位で
+    人数・合計比率・端数を保持する。1人の変更は O(log n) のグループ更新と、
+    グループ数 G に対する O(G log G) の再配分だけで済む（参加者数 n に依存しない）。
+    配分結果は _optimize_exact の正規順序による最大剰余法と一致する。
+    """
+
+    def __init__(self, total_amount, marume=500, role_params: Optional[Dict[str, float]] = None):
+        self.total_amount = int(total_amount)
+        self.marume = int(marume)
+        self.role_params = dict(role_params or DEFAULT_ROLE_PARAMS)
+
+        self.total_weight = 0
+        self.role_counts: Dict[str, int] = {}
+        self._members: Dict[str, Tuple[Tuple[int, float], int]] = {}
+        self._groups: Dict[Tuple[int, float], List[int]] = {}
+        self._next_seq = 0
+        self._allocation: Optional[Dict] = None
+
+    @classmethod
+    def from_frame(cls, df_calc, total_amount, marume=500,
+                   role_params: Optional[Dict[str, float]] = None) -> 'IncrementalWarikan':
+        """計算済みDataFrame（名前・役職・最終倍率）から状態を構築"""
+        split = cls(total_amount, marume, role_params)
+        for name, role, multiplier in zip(df_calc['名前'], df_calc['役職'], df_calc['最終倍率']):
+            split.add(name, role, multiplier)
+        return split
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._members
+
+    def add(self, name: str, role: str, multiplier: float = 1.0):
+        """参加者を追加"""
+        if name in self._members:
+            raise ValueError(f"同じ名前の参加者が既に存在します: {name}")
+        if role not in ROLE_CODES:
+            raise ValueError(f"未対応の役職です: {role}")
+
+        key = (ROLE_CODES[role], round(float(multiplier), 9))
+        seq = self._next_seq
+        self._next_seq += 1
+
+        # グループ内は追加順（= 元の並び順）で保持
+        bisect.insort(self._groups.setdefault(key, []), seq)
+        self._members[name] = (key, seq)
+        self.total_weight += self._weight(key)
+        self.role_counts[role] = self.role_counts.get(role, 0) + 1
+        self._allocation = None
+
+    def remove(self, name: str):
+        """参加者を削除"""
+        key, seq = self._members.pop(name)
+        group = self._groups[key]
+        del group[bisect.bisect_left(group, seq)]
+        if not group:
+            del self._groups[key]
+
+        role = ROLE_NAMES[key[0]]
+        self.total_weight -= self._weight(key)
+        self.role_counts[role] -= 1
+        if self.role_counts[role] == 0:
+            del self.role_counts[role]
+        self._allocation = None
+
+    def change_role(self, name: str, role: str):
+        """参加者の役職を変更（並び順は維持）"""
+        if role not in ROLE_CODES:
+            raise ValueError(f"未対応の役職です: {role}")
+
+        old_key, seq = self._members[name]
+        new_key = (ROLE_CODES[role], old_key[1])
+        if new_key == old_key:
+            return
+
+        group = self._groups[old_key]
+        del group[bisect.bisect_left(group, seq)]
+        if not group:
+            del self._groups[old_key]
+        bisect.insort(self._groups.setdefault(new_key, []), seq)
+        self._members[name] = (new_key, seq)
+
+        old_role = ROLE_NAMES[old_key[0]]
+        self.role_counts[old_role] -= 1
+        if self.role_counts[old_role] == 0:
+            del self.role_counts[old_role]
+        self.role_counts[role] = self.role_counts.get(role, 0) + 1
+        self.total_weight += self._weight(new_key) - self._weight(old_key)
+        self._allocation = None
+
+    def set_total(self, total_amount):
+        """合計金額を変更"""
+        self.total_amount = int(total_amount)
+        self._allocation = None
+
+    def amount_of(self, name: str) -> int:
+        """参加者の丸め後負担額"""
+        allocation = self._allocate()
+        key, seq = self._members[name]
+        base_units, extra = allocation['groups'][key]
+
+        rank = bisect.bisect_left(self._groups[key], seq)
+        amount = (base_units + (1 if rank < extra else 0)) * self.marume
+        if key == allocation['leftover_group'] and rank == allocation['leftover_rank']:
+            amount += allocation['leftover']
+        return amount
+
+    def ideal_of(self, name: str) -> float:
+        """参加者の理想負担額（丸め前）"""
+        key, _ = self._members[name]
+        if self.total_weight == 0:
+            return 0.0  # 全員の比率が0（_quota_fraction と同様に按分額は0とみなす）
+        return self.role_params[ROLE_NAMES[key[0]]] * key[1] / (self.total_weight / WEIGHT_SCALE) * self.total_amount
+
+    def annotate(self, df_participants):
+        """参加者DataFrameに現在の配分結果を付与"""
+        df_calc = df_participants.copy()
+        df_calc['基本比率'] = df_calc['役職'].map(self.role_params)
+        df_calc['最終倍率'] = [self._members[name][0][1] for name in df_calc['名前']]
+        df_calc['個別設定倍率'], df_calc['管理者設定倍率'] = _split_multipliers(df_calc)
+        df_calc['比率'] = df_calc['基本比率'] * df_calc['最終倍率']
+        df_calc['負担額'] = [self.ideal_of(name) for name in df_calc['名前']]
+
+        if self.total_weight == 0:
+            # 全員の比率が0の場合はグループ単位の配分に頼らず全体を再計算（_optimize_exact と同じ配分）
+            order = canonical_order(df_calc)
+            weights = scale_weights(df_calc['比率'].to_numpy(dtype=float))
+            amounts = np.empty(len(df_calc), dtype=np.int64)
+            amounts[order] = round_burdens(
+                weights[order][np.newaxis, :], np.array([self.total_amount]), np.array([self.marume])
+            )[0]
+            df_calc['負担額_丸め'] = amounts
+        else:
+            df_calc['負担額_丸め'] = np.array([self.amount_of(name) for name in df_calc['名前']], dtype=np.int64)
+        return df_calc
+
+    def _weight(self, key: Tuple[int, float]) -> int:
+        """グループの整数化比率（scale_weights と同じ丸め）"""
+        return int(scale_weights(np.array([self.role_params[ROLE_NAMES[key[0]]] * key[1]]))[0])
+
+    def _allocate(self) -> Dict:
+        """グループ単位の最大剰余法（結果は次の変更まで保持）"""
+        if self._allocation is not None:
+            return self._allocation
+
+        keys = sorted(self._groups)  # 正規順序（役職コード, 倍率）
+        counts = np.array([len(self._groups[key]) for key in keys], dtype=np.int64)
+        weights = np.array([self._weight(key) for key in keys], dtype=np.int64)
+
+        # 1人あたりの割当数 = weight * total / (total_weight * marume) を商と剰余に分解
+        numer = weights * self.total_amount
+        denom = max(self.total_weight, 1) * self.marume
+        base_units = numer // denom
+        remainders = numer % denom
+        remaining = max(self.total_amount // self.marume - int((base_units * counts).sum()), 0)
+
+        # 端数の大きいグループから順に、グループ内の並び順で1単位ずつ配分
+        extra = np.zeros(len(keys), dtype=np.int64)
+        for g in np.argsort(-remainders, kind='stable'):
+            if remaining <= 0:
+                break
+            extra[g] = min(counts[g], remaining)
+            remaining -= extra[g]
+
+        # 丸め単位未満の端数は理想額との差が最大の人（正規順序で最初の人）が負担
+        leftover = self.total_amount - int(((base_units * counts + extra) * self.marume).sum())
+        leftover_group, leftover_rank = None, 0
+        if keys:
+            has_plain = extra < counts
+            shortfall = numer - (base_units + np.where(has_plain, 0, 1)) * self.marume * max(self.total_weight, 1)
+            g = int(np.argmax(shortfall))
+            leftover_group = keys[g]
+            leftover_rank = int(extra[g]) if has_plain[g] else 0
+
+        self._allocation = {
+            'groups': {key: (int(base_units[g]), int(extra[g])) for g, key in enumerate(keys)},
+            'leftover': leftover,
+            'leftover_group': leftover_group,
+            'leftover_rank': leftover_rank,
+        }
+        return self._allocation
+
+
+def _constraint_column(df_calc, column: str) -> np.ndarray:
+    """制約列を float 配列で取得（列がなければすべて NaN）"""
+    if column not in df_calc:
+        return np.full(len(df_calc), np.nan)
+    return pd.to_numeric(df_calc[column], errors='coerce').to_numpy(dtype=float)
+
+
+def _split_multipliers(df_calc) -> Tuple[np.ndarray, np.ndarray]:
+    """(個別設定倍率, 管理者設定倍率) の配列（列がなければ最終倍率・カスタム倍率から復元）"""
+    final = df_calc['最終倍率'].to_numpy(dtype=float)
+    individual = df_calc.get('個別設定倍率', df_calc.get('カスタム倍率', 1.0))
+    individual = np.broadcast_to(np.asarray(individual, dtype=float), final.shape).copy()
+    if '管理者設定倍率' in df_calc:
+        admin = df_calc['管理者設定倍率'].to_numpy(dtype=float)
+    else:
+        # 個別設定倍率が 0 の参加者は最終倍率も 0 のため、管理者設定倍率は 1.0 とみなす
+        admin = np.divide(final, individual, out=np.ones_like(final), where=individual != 0)
+    return individual, admin
+
+
+def role_codes_of(df_calc) -> np.ndarray:
+    """役職列を役職コード配列に変換（未知の役職は PAD_CODE）"""
+    return df_calc['役職'].map(ROLE_CODES).fillna(PAD_CODE).to_numpy(dtype=np.int64)
+
+
+def canonical_order(df_calc) -> np.ndarray:
+    """(役職コード, 最終倍率) 順の正規順序（同順位は元の並び順）"""
+    multipliers = np.round(df_calc['最終倍率'].to_numpy(dtype=float), 9)
+    return np.lexsort((multipliers, role_codes_of(df_calc)))
+
+
+def pack_events(events: Sequence[Tuple[pd.DataFrame, int]],
+                multiplier_lookup: Optional[Callable[[str], float]] = None
+                ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """イベント一覧をパディング済みの (役職コード, 倍率, 合計金額) 配列に変換"""
+    n_events = len(events)
+    width = max((len(df) for df, _ in events), default=0)
+
+    role_codes = np.full((n_events, width), PAD_CODE, dtype=np.int8)
+    multipliers = np.zeros((n_events, width), dtype=float)
+    totals = np.zeros(n_events, dtype=np.int64)
+
+    for i, (df_participants, total_amount) in enumerate(events):
+        n = len(df_participants)
+        totals[i] = total_amount
+        if n == 0:
+            continue
+        role_codes[i, :n] = df_participants['役職'].map(ROLE_CODES).to_numpy()
+        individual = df_participants.get('カスタム倍率', 1.0)
+        if multiplier_lookup is not None:
+            admin = df_participants['名前'].map(multiplier_lookup).to_numpy(dtype=float)
+        else:
+            admin = 1.0
+        multipliers[i, :n] = admin * np.asarray(individual, dtype=float)
+
+    return role_codes, multipliers, totals
+
+
+def scale_weights(weights: np.ndarray) -> np.ndarray:
+    """比率を WEIGHT_SCALE 倍の int64 に変換（以降の配分は整数演算のみ）"""
+    return np.rint(np.asarray(weights, dtype=float) * WEIGHT_SCALE).astype(np.int64)
+
+
+def round_burdens(weights: np.ndarray, totals: np.ndarray, marume: np.ndarray,
+                  rounding: str = 'largest_remainder', mask: Optional[np.ndarray] = None) -> np.ndarray:
+    """整数化比率から丸め後負担額（int64 円）を一括計算（行 = イベント、列 = 参加者）"""
+    if rounding == 'largest_remainder':
+        return allocate_largest_remainder_batch(weights, totals, marume, mask)
+
+    numer, denom, mask = _quota_fraction(weights, totals, marume, mask)
+    units = numer // denom
+    remainders = numer % denom
+
+    if rounding == 'half_up':
+        units += 2 * remainders >= denom
+    elif rounding == 'ceil':
+        units += remainders > 0
+    elif rounding == 'bankers':
+        units += (2 * remainders > denom) | ((2 * remainders == denom) & (units % 2 == 1))
+    elif rounding != 'floor':
+        raise ValueError(f"未対応の端数処理です: {rounding}")
+
+    return np.where(mask, units, 0) * np.asarray(marume, dtype=np.int64)[:, np.newaxis]
+
+
+def allocate_largest_remainder_batch(weights: np.ndarray, totals: np.ndarray, marume: np.ndarray,
+                                     mask: Optional[np.ndarray] = None) -> np.ndarray:
+    """最大剰余法の一括版（行 = イベント、列 = 参加者、整数演算のみ）"""
+    n_events, width = weights.shape
+    totals = np.asarray(totals, dtype=np.int64)
+    marume = np.asarray(marume, dtype=np.int64)
+
+    numer, denom, mask = _quota_fraction(weights, totals, marume, mask)
+    units = numer // denom
+    remainders = np.where(mask, numer % denom, -1)
+
+    # 行ごとに剰余の大きい順の順位を求め、余り単位数より上位に1単位ずつ配分
+    remaining = np.clip(totals // marume - units.sum(axis=1), 0, mask.sum(axis=1))
+    order = np.argsort(-remainders, axis=1, kind='stable')
+    rank = np.empty_like(order)
+    np.put_along_axis(rank, order, np.arange(width)[np.newaxis, :].repeat(n_events, axis=0), axis=1)
+    units += (rank < remaining[:, np.newaxis]) & mask
+
+    amounts = units * marume[:, np.newaxis]
+
+    # 丸め単位未満の端数は理想額との差が最大の人が負担（差は total_weight 倍の整数で比較）
+    leftover = totals - amounts.sum(axis=1)
+    if width > 0:
+        total_weight = denom // marume[:, np.newaxis]
+        shortfall = np.where(mask, numer - amounts * total_weight, np.iinfo(np.int64).min)
+        target = np.argmax(shortfall, axis=1)
+        has_member = mask.any(axis=1)
+        amounts[np.arange(n_events)[has_member], target[has_member]] += leftover[has_member]
+
+    return amounts
+
+
+def _quota_fraction(weights: np.ndarray, totals: np.ndarray, marume: np.ndarray,
+                    mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """割当数 = weight × total / (total_weight × marume) の分子・分母を整数で返す"""
+    weights = np.asarray(weights, dtype=np.int64)
+    if mask is None:
+        mask = np.ones(weights.shape, dtype=bool)
+    weights = np.where(mask, weights, 0)
+
+    total_weight = weights.sum(axis=1)
+    total_weight = np.where(total_weight > 0, total_weight, 1)
+
+    numer = weights * np.asarray(totals, dtype=np.int64)[:, np.newaxis]
+    denom = (total_weight * np.asarray(marume, dtype=np.int64))[:, np.newaxis]
+    return numer, denom, mask
+
+
+def _round_units_float(quotas: np.ndarray, rounding: str) -> np.ndarray:
+    """適応度評価用の浮動小数点版の丸め（largest_remainder は四捨五入で近似）"""
+    if rounding == 'ceil':
+        return np.ceil(quotas)
+    if rounding == 'floor':
+        return np.floor(quotas)
+    if rounding == 'bankers':
+        return np.round(quotas)
+    return np.floor(quotas + 0.5)
+
+
+def _params_of(genome: np.ndarray) -> Dict[str, float]:
+    """ROLE_NAMES 順の比率ベクトルを役職比率の辞書に変換"""
+    return {role: float(genome[code]) for role, code in ROLE_CODES.items()}
+
+
+def throttle_progress(callback: ProgressCallback, min_interval: float = 0.1,
+                      clock: Callable[[], float] = time.monotonic) -> ProgressCallback:
+    """callback を min_interval 秒ごとに間引く進捗コールバック（最終ステップは必ず通知）"""
+    last_update = [None]
+
+    def throttled(step: int, total_steps: int, message: str):
+        now = clock()
+        if step < total_steps and last_update[0] is not None and now - last_update[0] < min_interval:
+            return
+        last_update[0] = now
+        callback(step, total_steps, message)
+
+    return throttled
+
+
+def _notify(progress_callback: Optional[ProgressCallback], step: int, total_steps: int, message: str):
+    """進捗コールバックを安全に呼び出し"""
+    if progress_callback is not None:
+        progress_callback(step, total_steps, message)
@@ -0,0 +1,592 @@
+# ==== 精算エンジン（Streamlit非依存） ====
+# 割り勘結果と実際の支払いから「誰が誰にいくら払うか」を求める
+
+import bisect
+import heapq
+import json
+import os
+import sqlite3
+import threading
+from contextlib import closing
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from warikan_engine import DEFAULT_ROLE_PARAMS, ROLE_CODES, scale_weights
+
+
+def compute_net_balances(burdens: Sequence[int], payments: Sequence[int]) -> np.ndarray:
+    """各人の収支（支払額 - 負担額）。正なら受け取り、負なら支払い"""
+    return np.asarray(payments, dtype=np.int64) - np.asarray(burdens, dtype=np.int64)
+
+
+def plan_settlement(names: Sequence[str], balances: Sequence[int]) -> List[Dict]:
+    """収支を清算する送金リストを作成（ヒープによる貪欲マッチングで送金回数をほぼ最小化）
+
+    1. 受取額と支払額がちょうど一致する組を先に1回の送金で清算
+    2. 残りは最大の債権者と最大の債務者を組み合わせ、小さい方を清算して繰り返す
+    どちらも O(n log n) のため1万人規模でも数十ミリ秒で完了する。
+    """
+    balances = np.asarray(balances, dtype=np.int64)
+    transfers: List[Dict] = []
+
+    creditors = [(-int(balances[i]), i) for i in np.flatnonzero(balances > 0)]
+    debtors = [(int(balances[i]), i) for i in np.flatnonzero(balances < 0)]
+
+    # 同額の債権者・債務者を先に組み合わせる
+    creditors_by_amount: Dict[int, List[int]] = {}
+    for neg_amount, i in creditors:
+        creditors_by_amount.setdefault(-neg_amount, []).append(i)
+
+    matched = set()
+    remaining_debtors = []
+    for neg_amount, i in debtors:
+        candidates = creditors_by_amount.get(-neg_amount)
+        if candidates:
+            j = candidates.pop()
+            matched.add(j)
+            transfers.append(_transfer(names, i, j, -neg_amount))
+        else:
+            remaining_debtors.append((neg_amount, i))
+
+    creditor_heap = [(neg_amount, i) for neg_amount, i in creditors if i not in matched]
+    debtor_heap = remaining_debtors
+    heapq.heapify(creditor_heap)
+    heapq.heapify(debtor_heap)
+
+    # 最大債権者と最大債務者を貪欲に清算
+    while creditor_heap and debtor_heap:
+        neg_credit, j = heapq.heappop(creditor_heap)
+        neg_debt, i = heapq.heappop(debtor_heap)
+        credit, debt = -neg_credit, -neg_debt
+
+        amount = min(credit, debt)
+        transfers.append(_transfer(names, i, j, amount))
+
+        if credit > amount:
+            heapq.heappush(creditor_heap, (-(credit - amount), j))
+        if debt > amount:
+            heapq.heappush(debtor_heap, (-(debt - amount), i))
+
+    return transfers
+
+
+def settle_event(names: Sequence[str], burdens: Sequence[int],
+                 payments: Optional[Dict[str, int]] = None) -> Dict:
+    """1イベント分の精算（payments は 名前 → 実際に支払った額）"""
+    payments = payments or {}
+    paid = np.array([int(payments.get(name, 0)) for name in names], dtype=np.int64)
+    balances = compute_net_balances(burdens, paid)
+
+    return {
+        'paid': paid,
+        'balances': balances,
+        'transfers': plan_settlement(names, balances),
+        # 支払総額と負担総額の差（丸めによる過不足）
+        'unsettled': int(balances.sum()),
+    }
+
+
+class EventLedger:
+    """複数レシート・複数支払者の会計台帳（1イベント分）
+
+    レシートごとの対象者は CSR 形式（indptr / indices）の疎な所属配列で保持し、
+    全レシートの配分・収支を一度のベクトル演算で計算する。
+    各レシートは対象者の 役職比率 × 倍率 で最大剰余法により配分する。
+    """
+
+    def __init__(self, names: Sequence[str], roles: Sequence[str],
+                 multipliers: Optional[Sequence[float]] = None, marume: int = 100,
+                 role_params: Optional[Dict[str, float]] = None):
+        self.names = list(names)
+        self.roles = list(roles)
+        self.marume = int(marume)
+        self._index = {name: i for i, name in enumerate(self.names)}
+
+        if multipliers is None:
+            multipliers = np.ones(len(self.names))
+        self.multipliers = np.asarray(multipliers, dtype=float)
+
+        params = role_params or DEFAULT_ROLE_PARAMS
+        self.weights = scale_weights(
+            np.array([params[role] for role in self.roles], dtype=float) * self.multipliers
+        )
+
+        # 同順位の剰余は (役職コード, 倍率) の正規順序で優先（AIWarikanOptimizer と同じ）
+        role_codes = np.array([ROLE_CODES[role] for role in self.roles], dtype=np.int64)
+        order = np.lexsort((np.round(self.multipliers, 9), role_codes))
+        self._rank = np.empty(len(self.names), dtype=np.int64)
+        self._rank[order] = np.arange(len(self.names))
+
+        # レシート（CSR 形式）
+        self.labels: List[str] = []
+        self.payers: List[int] = []
+        self.amounts: List[int] = []
+        self.indptr: List[int] = [0]
+        self.indices: List[int] = []
+
+    @classmethod
+    def from_frame(cls, df_calc, marume: int = 100,
+                   role_params: Optional[Dict[str, float]] = None) -> 'EventLedger':
+        """参加者DataFrame（名前・役職・任意で最終倍率）から作成"""
+        multipliers = df_calc['最終倍率'] if '最終倍率' in df_calc else None
+        return cls(df_calc['名前'].tolist(), df_calc['役職'].tolist(), multipliers, marume, role_params)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._index
+
+    def add_receipt(self, label: str, payer: str, amount: int,
+                    participants: Optional[Sequence[str]] = None):
+        """レシートを追加（participants 省略時は全員が対象）"""
+        if payer not in self._index:
+            raise ValueError(f"支払者が参加者に含まれていません: {payer}")
+
+        if participants is None:
+            members = list(range(len(self.names)))
+        else:
+            unknown = [name for name in participants if name not in self._index]
+            if unknown:
+                raise ValueError(f"参加者に含まれていない対象者がいます: {', '.join(unknown)}")
+            members = sorted({self._index[name] for name in participants})
+        if not members:
+            raise ValueError(f"対象者がいないレシートは追加できません: {label}")
+
+        self.labels.append(label)
+        self.payers.append(self._index[payer])
+        self.amounts.append(int(amount))
+        self.indices.extend(members)
+        self.indptr.append(len(self.indices))
+
+    def remove_receipt(self, position: int):
+        """レシートを削除"""
+        start, end = self.indptr[position], self.indptr[position + 1]
+        del self.indices[start:end]
+        self.indptr = self.indptr[:position + 1] + [p - (end - start) for p in self.indptr[position + 2:]]
+        del self.labels[position]
+        del self.payers[position]
+        del self.amounts[position]
+
+    def allocate(self) -> np.ndarray:
+        """全レシートの所属エントリごとの負担額（indices と同じ並び、int64 円）"""
+        indptr = np.asarray(self.indptr, dtype=np.int64)
+        indices = np.asarray(self.indices, dtype=np.int64)
+        totals = np.asarray(self.amounts, dtype=np.int64)
+        n_receipts = len(totals)
+        if len(indices) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        counts = np.diff(indptr)
+        segment = np.repeat(np.arange(n_receipts), counts)
+        weights = self.weights[indices]
+        rank = self._rank[indices]
+
+        # レシートごとの割当数 = weight × total / (total_weight × marume)
+        total_weight = np.bincount(segment, weights=weights, minlength=n_receipts).astype(np.int64)
+        total_weight = np.where(total_weight > 0, total_weight, 1)
+        numer = weights * totals[segment]
+        denom = total_weight[segment] * self.marume
+        units = numer // denom
+        remainders = numer % denom
+
+        # 剰余の大きい順に、レシートごとの余り単位数だけ1単位ずつ配分
+        remaining = totals // self.marume - np.bincount(segment, weights=units, minlength=n_receipts).astype(np.int64)
+        order = np.lexsort((rank, -remainders, segment))
+        position = np.empty_like(order)
+        position[order] = np.arange(len(order)) - indptr[segment[order]]
+        units += position < remaining[segment]
+
+        allocations = units * self.marume
+
+        # 丸め単位未満の端数は理想額との差が最大の人が負担
+        leftover = totals - np.bincount(segment, weights=allocations, minlength=n_receipts).astype(np.int64)
+        shortfall = numer - allocations * total_weight[segment]
+        order = np.lexsort((rank, -shortfall, segment))
+        has_member = counts > 0
+        allocations[order[indptr[:-1][has_member]]] += leftover[has_member]
+
+        return allocations
+
+    def compute(self) -> Dict:
+        """全員の支払額・負担額・収支を一括計算"""
+        n = len(self.names)
+        allocations = self.allocate()
+        paid = np.bincount(
+            np.asarray(self.payers, dtype=np.int64), weights=self.amounts, minlength=n
+        ).astype(np.int64)
+        burdens = np.bincount(
+            np.asarray(self.indices, dtype=np.int64), weights=allocations, minlength=n
+        ).astype(np.int64)
+        balances = compute_net_balances(burdens, paid)
+
+        return {
+            'allocations': allocations,
+            'paid': paid,
+            'burdens': burdens,
+            'balances': balances,
+            'transfers': plan_settlement(self.names, balances),
+        }
+
+    def to_frame(self, result: Optional[Dict] = None) -> pd.DataFrame:
+        """参加者ごとの収支表"""
+        result = result or self.compute()
+        return pd.DataFrame({
+            '名前': self.names,
+            '役職': self.roles,
+            '支払額': result['paid'],
+            '負担額': result['burdens'],
+            '収支': result['balances'],
+        })
+
+    def receipts_frame(self, result: Optional[Dict] = None) -> pd.DataFrame:
+        """レシート一覧（対象者と各人の負担額つき）"""
+        result = result or self.compute()
+        allocations = result['allocations']
+        rows = []
+        for r, label in enumerate(self.labels):
+            start, end = self.indptr[r], self.indptr[r + 1]
+            rows.append({
+                '明細': label,
+                '支払者': self.names[self.payers[r]],
+                '金額': self.amounts[r],
+                '対象人数': end - start,
+                '内訳': ', '.join(
+                    f"{self.names[i]} {int(a):,}円"
+                    for i, a in zip(self.indices[start:end], allocations[start:end])
+                ),
+            })
+        return pd.DataFrame(rows, columns=['明細', '支払者', '金額', '対象人数', '内訳'])
+
+
+class SeasonLedger:
+    """シーズン通算の収支台帳
+
+    イベントを記録するたびに対象メンバーの累計収支だけを更新する（1人あたり O(1)）。
+    メンバーごとに (記録日時, 累計収支) の履歴を保持し、任意時点の残高は二分探索で求める。
+    """
+
+    def __init__(self, name: str = ''):
+        self.name = name
+        self.started_at = datetime.now().isoformat()
+        self.balances: Dict[str, int] = {}
+        self.events: List[Dict] = []
+        self._event_ids = set()
+        # 記録元（計算・会計台帳）ごとの記録済み収支（再記録時は差分のみ加算）
+        self._sources: Dict[str, Dict[str, int]] = {}
+        # 記録元ごとの記録回数（再記録のイベントIDの採番用）
+        self._revisions: Dict[str, int] = {}
+        # メンバーごとの履歴（記録日時の ISO 文字列と、その時点の累計収支）
+        self._times: Dict[str, List[str]] = {}
+        self._cumulative: Dict[str, List[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def __contains__(self, event_id: str) -> bool:
+        return event_id in self._event_ids
+
+    def record_event(self, event_id: str, names: Sequence[str], balances: Sequence[int],
+                     label: str = '', timestamp: Optional[str] = None):
+        """1イベント分の収支（支払額 - 負担額）を加算"""
+        if event_id in self._event_ids:
+            raise ValueError(f"このイベントは既に記録されています: {event_id}")
+
+        balances = [int(b) for b in balances]
+        if sum(balances) != 0:
+            raise ValueError("収支の合計が0になっていません（支払額と負担額を確認してください）")
+
+        timestamp = timestamp or datetime.now().isoformat()
+        if self.events and timestamp < self.events[-1]['timestamp']:
+            raise ValueError("記録日時は直前のイベント以降である必要があります")
+
+        for name, balance in zip(names, balances):
+            if balance == 0 and name in self.balances:
+                continue
+            cumulative = self.balances.get(name, 0) + balance
+            self.balances[name] = cumulative
+            self._times.setdefault(name, []).append(timestamp)
+            self._cumulative.setdefault(name, []).append(cumulative)
+
+        self._event_ids.add(event_id)
+        self.events.append({
+            'id': event_id,
+            'label': label,
+            'timestamp': timestamp,
+            'members': len(balances),
+            'volume': sum(b for b in balances if b > 0),
+        })
+
+    def pending_changes(self, source_id: str, names: Sequence[str], balances: Sequence[int]) -> Dict[str, int]:
+        """記録元の前回記録からの収支の差分（0 のメンバーは除く）"""
+        recorded = self._sources.get(source_id, {})
+        current = {name: int(balance) for name, balance in zip(names, balances)}
+        changes = {name: current.get(name, 0) - recorded.get(name, 0) for name in {**recorded, **current}}
+        return {name: change for name, change in changes.items() if change != 0}
+
+    def record_source(self, source_id: str, names: Sequence[str], balances: Sequence[int],
+                      label: str = '', timestamp: Optional[str] = None) -> bool:
+        """記録元の現在の収支を反映（前回記録からの差分だけを1イベントとして加算、変化なしなら False）
+
+        同じ計算・台帳を編集後に再記録しても二重に加算されない。
+        """
+        changes = self.pending_changes(source_id, names, balances)
+        if not changes:
+            return False
+
+        revision = self._revisions.get(source_id, 0) + 1
+        event_id = source_id if revision == 1 else f"{source_id}#{revision}"
+        self._record_source_event(event_id, source_id, changes, label, timestamp)
+        return True
+
+    def _record_source_event(self, event_id: str, source_id: str, changes: Dict[str, int],
+                             label: str = '', timestamp: Optional[str] = None):
+        """記録元の差分を1イベントとして加算（SQLite の行からの復元でも使用）"""
+        self.record_event(event_id, list(changes), list(changes.values()), label, timestamp)
+        self.events[-1]['source'] = source_id
+        self._revisions[source_id] = self._revisions.get(source_id, 0) + 1
+        recorded = self._sources.setdefault(source_id, {})
+        for name, change in changes.items():
+            balance = recorded.get(name, 0) + change
+            if balance:
+                recorded[name] = balance
+            else:
+                recorded.pop(name, None)
+
+    def balance_of(self, name: str, at: Optional[str] = None) -> int:
+        """メンバーの累計収支（at 指定時はその時点まで）"""
+        if at is None:
+            return self.balances.get(name, 0)
+        times = self._times.get(name, [])
+        position = bisect.bisect_right(times, at)
+        return self._cumulative[name][position - 1] if position > 0 else 0
+
+    def balances_at(self, at: Optional[str] = None) -> Dict[str, int]:
+        """全メンバーの累計収支（at 指定時はその時点まで）"""
+        if at is None:
+            return dict(self.balances)
+        return {name: self.balance_of(name, at) for name in self.balances}
+
+    def settlement(self, at: Optional[str] = None) -> List[Dict]:
+        """シーズン精算の送金リスト"""
+        balances = self.balances_at(at)
+        names = list(balances)
+        return plan_settlement(names, [balances[name] for name in names])
+
+    def to_frame(self, at: Optional[str] = None) -> pd.DataFrame:
+        """メンバーごとの累計収支表"""
+        balances = self.balances_at(at)
+        return pd.DataFrame(
+            {'名前': list(balances), '累計収支': list(balances.values())}
+        ).sort_values('累計収支', ascending=False, kind='stable').reset_index(drop=True)
+
+    def to_dict(self) -> Dict:
+        """保存用の辞書表現"""
+        return {
+            'name': self.name,
+            'started_at': self.started_at,
+            'balances': dict(self.balances),
+            'events': list(self.events),
+            'sources': {source_id: dict(balances) for source_id, balances in self._sources.items()},
+            'revisions': dict(self._revisions),
+            'times': {name: list(times) for name, times in self._times.items()},
+            'cumulative': {name: list(values) for name, values in self._cumulative.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'SeasonLedger':
+        ledger = cls(data.get('name', ''))
+        ledger.started_at = data.get('started_at', ledger.started_at)
+        ledger.balances = dict(data.get('balances', {}))
+        ledger.events = list(data.get('events', []))
+        ledger._event_ids = {event['id'] for event in ledger.events}
+        ledger._sources = {source_id: dict(balances) for source_id, balances in data.get('sources', {}).items()}
+        ledger._revisions = dict(data.get('revisions', {}))
+        if not ledger._revisions:
+            for event in ledger.events:
+                if event.get('source'):
+                    ledger._revisions[event['source']] = ledger._revisions.get(event['source'], 0) + 1
+        ledger._times = {name: list(times) for name, times in data.get('times', {}).items()}
+        ledger._cumulative = {name: list(values) for name, values in data.get('cumulative', {}).items()}
+        return ledger
+
+
+def _transfer(names: Sequence[str], debtor: int, creditor: int, amount: int) -> Dict:
+    return {'支払者': names[debtor], '受取者': names[creditor], '金額': int(amount)}
+
+
+# ==== シーズン台帳の永続化（SQLite） ====
+# 保存先のパス（環境変数 WARIKAN_SEASON_DB で変更可能）
+DEFAULT_SEASON_DB_PATH = 'warikan_seasons.db'
+
+_SEASON_SCHEMA = """
+CREATE TABLE IF NOT EXISTS seasons (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner TEXT NOT NULL,
+    name TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    closed_at TEXT,
+    transfers TEXT
+);
+CREATE INDEX IF NOT EXISTS seasons_owner ON seasons (owner, closed_at);
+CREATE TABLE IF NOT EXISTS season_events (
+    season_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    event_id TEXT NOT NULL,
+    source TEXT NOT NULL,
+    label TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    PRIMARY KEY (season_id, seq)
+);
+CREATE TABLE IF NOT EXISTS season_balances (
+    season_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    change INTEGER NOT NULL,
+    PRIMARY KEY (season_id, seq, name)
+);
+"""
+
+
+def season_db_path() -> str:
+    return os.environ.get('WARIKAN_SEASON_DB') or DEFAULT_SEASON_DB_PATH
+
+
+class SQLiteSeasonBackend:
+    """シーズン台帳の SQLite 保存先（WAL モード）
+
+    イベントとメンバーごとの収支変化は追記のみの行として保存し、記録1回の書き込みは
+    そのイベントの対象人数分だけで済む。締めたシーズンも行ごと残す（closed_at を設定）。
+    記録・締めは読み込みから書き込みまでを1つの BEGIN IMMEDIATE トランザクションで行い、
+    別セッションからの同時更新を取りこぼさない。
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or season_db_path()
+        with self._connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(_SEASON_SCHEMA)
+
+    def _connect(self):
+        # 接続は操作ごとに開く（Streamlit のスレッド間で共有しない）
+        connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return closing(connection)
+
+    def _open_season(self, connection, owner: str) -> Optional[Tuple[int, SeasonLedger]]:
+        """利用者の締めていないシーズンを行から復元（未作成なら None）"""
+        row = connection.execute(
+            'SELECT id, name, started_at FROM seasons WHERE owner = ? AND closed_at IS NULL '
+            'ORDER BY id DESC LIMIT 1', (owner,)
+        ).fetchone()
+        if row is None:
+            return None
+        season_id, name, started_at = row
+        ledger = SeasonLedger(name)
+        ledger.started_at = started_at
+
+        changes: Dict[int, Dict[str, int]] = {}
+        for seq, member, change in connection.execute(
+                'SELECT seq, name, change FROM season_balances WHERE season_id = ? ORDER BY seq, rowid',
+                (season_id,)):
+            changes.setdefault(seq, {})[member] = change
+        for seq, event_id, source, label, timestamp in connection.execute(
+                'SELECT seq, event_id, source, label, timestamp FROM season_events '
+                'WHERE season_id = ? ORDER BY seq', (season_id,)):
+            ledger._record_source_event(event_id, source, changes.get(seq, {}), label, timestamp)
+        return season_id, ledger
+
+    def load(self, owner: str) -> Optional[SeasonLedger]:
+        """利用者の現在のシーズン台帳（未保存なら None）"""
+        with self._connect() as connection:
+            season = self._open_season(connection, owner)
+        return season[1] if season else None
+
+    def record(self, owner: str, source_id: str, names: Sequence[str], balances: Sequence[int],
+               label: str = '', season_name: str = '') -> bool:
+        """記録元の収支を現在のシーズンに反映（差分がなければ False）
+
+        最新の台帳を読み込んで差分を求め、そのイベントの行だけを追記する。
+        """
+        with self._connect() as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                season = self._open_season(connection, owner)
+                if season is None:
+                    ledger = SeasonLedger(season_name)
+                    season_id = connection.execute(
+                        'INSERT INTO seasons (owner, name, started_at) VALUES (?, ?, ?)',
+                        (owner, ledger.name, ledger.started_at)
+                    ).lastrowid
+                else:
+                    season_id, ledger = season
+
+                changes = ledger.pending_changes(source_id, names, balances)
+                if not changes:
+                    connection.execute('ROLLBACK')
+                    return False
+
+                ledger.record_source(source_id, names, balances, label)
+                event = ledger.events[-1]
+                seq = len(ledger.events)
+                connection.execute(
+                    'INSERT INTO season_events (season_id, seq, event_id, source, label, timestamp) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (season_id, seq, event['id'], source_id, event['label'], event['timestamp'])
+                )
+                connection.executemany(
+                    'INSERT INTO season_balances (season_id, seq, name, change) VALUES (?, ?, ?, ?)',
+                    [(season_id, seq, name, change) for name, change in changes.items()]
+                )
+                connection.execute('COMMIT')
+                return True
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+
+    def close(self, owner: str, next_name: str = '') -> List[Dict]:
+        """現在のシーズンを締めて精算リストを記録し、新しいシーズンを開始（1トランザクション）"""
+        closed_at = datetime.now().isoformat()
+        with self._connect() as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                season = self._open_season(connection, owner)
+                transfers: List[Dict] = []
+                if season is not None:
+                    season_id, ledger = season
+                    transfers = ledger.settlement()
+                    connection.execute(
+                        'UPDATE seasons SET closed_at = ?, transfers = ? WHERE id = ?',
+                        (closed_at, json.dumps(transfers, ensure_ascii=False), season_id)
+                    )
+                connection.execute(
+                    'INSERT INTO seasons (owner, name, started_at) VALUES (?, ?, ?)',
+                    (owner, next_name, closed_at)
+                )
+                connection.execute('COMMIT')
+                return transfers
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+
+
+_season_backend: Optional[SQLiteSeasonBackend] = None
+_season_backend_error: Optional[str] = None
+_season_backend_lock = threading.Lock()
+
+
+def get_season_backend() -> Tuple[Optional[SQLiteSeasonBackend], Optional[str]]:
+    """プロセス内で共有するシーズン台帳の保存先と、開けなかった場合の理由"""
+    global _season_backend, _season_backend_error
+    if _season_backend is None and _season_backend_error is None:
+        with _season_backend_lock:
+            if _season_backend is None and _season_backend_error is None:
+                try:
+                    _season_backend = SQLiteSeasonBackend()
+                except sqlite3.Error as e:
+                    # SQLite を開けない環境ではセッション内のみで保持
+                    _season_backend_error = str(e)
+    return _season_backend, _season_backend_error